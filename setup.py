@@ -44,6 +44,11 @@ setup(
     # Allows `setup.py test` to work correctly with pytest
     setup_requires=[] + pytest_runner,
 
+    # Optional dependencies
+    # hdf5: write the vibronic results to an HDF5 file (vibrav.vibronic.store.HDF5Store)
+    # sparse: sparse eigenvector transformation of the vibronic coupling calculations
+    extras_require={'hdf5': ['h5py'], 'sparse': ['scipy']},
+
     # Additional entries you may want simply uncomment the lines you want and fill in the data
     # url='http://www.my_package.com',  # Website
     # install_requires=[],              # Required packages, pulls from pip if needed; do not use for Conda deployment
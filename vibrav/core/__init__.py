@@ -13,3 +13,4 @@
 # You should have received a copy of the GNU General Public License
 # along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
 from .config import Config
+from .estimate import ResourceEstimate
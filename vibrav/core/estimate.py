@@ -0,0 +1,167 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Resource estimates
+##################
+Report of the memory, disk space and floating point operations that a calculation is expected
+to need. Built by the `estimate` methods of the main classes from the configuration file and
+the sizes of the input files without reading any of the data.
+'''
+import pandas as pd
+import warnings
+
+def format_bytes(nbytes):
+    '''
+    Format a number of bytes with binary prefixes.
+
+    Args:
+        nbytes (:obj:`float`): Number of bytes.
+
+    Returns:
+        text (:obj:`str`): Formatted size (i.e. `'1.50 GiB'`).
+    '''
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if abs(nbytes) < 1024 or unit == 'TiB':
+            break
+        nbytes /= 1024
+    return '{:.2f} {}'.format(nbytes, unit)
+
+class ResourceEstimate:
+    '''
+    Estimated resources of a calculation. The memory entries are the arrays that are held at
+    the same time so the peak memory is taken as their sum. The output entries are the bytes
+    written for each of the requested outputs and the FLOP entries are the floating point
+    operations of each kernel.
+
+    Note:
+        The estimates are upper bounds for the number of transitions and ignore the overhead
+        of the Python objects and the temporary arrays of the linear algebra libraries. The
+        time is only a rough guide from the given FLOP and text I/O rates.
+
+    Args:
+        name (:obj:`str`): Name of the calculation.
+        flop_rate (:obj:`float`, optional): Floating point operations per second used for the
+                                            time estimate. Defaults to `1e10`.
+        io_rate (:obj:`float`, optional): Bytes per second of the text files that are read and
+                                          written used for the time estimate. Defaults to
+                                          `5e7`.
+    '''
+    _kinds = ['memory', 'input', 'output', 'flops']
+    def add(self, kind, item, value):
+        '''
+        Add an entry to the estimate. Entries with the same kind and item are summed.
+
+        Args:
+            kind (:obj:`str`): Kind of entry. Can be `'memory'`, `'input'`, `'output'` or
+                               `'flops'`.
+            item (:obj:`str`): Name of the entry.
+            value (:obj:`float`): Number of bytes or floating point operations.
+
+        Raises:
+            ValueError: If the kind is not understood.
+        '''
+        if kind not in self._kinds:
+            raise ValueError("Kind {} not understood, must be one of {}".format(kind,
+                                                                             self._kinds))
+        key = (kind, item)
+        self._entries[key] = self._entries.get(key, 0) + float(value)
+
+    def total(self, kind):
+        '''
+        Get the sum of all of the entries of a kind. For the memory this is the peak memory.
+
+        Args:
+            kind (:obj:`str`): Kind of entry.
+
+        Returns:
+            total (:obj:`float`): Sum of the entries.
+        '''
+        return sum([val for (knd, _), val in self._entries.items() if knd == kind])
+
+    def time(self):
+        '''
+        Get the rough time estimate in seconds from the FLOP and I/O rates.
+
+        Returns:
+            time (:obj:`float`): Estimated time in seconds.
+        '''
+        io = self.total('input') + self.total('output')
+        return self.total('flops')/self.flop_rate + io/self.io_rate
+
+    def to_frame(self):
+        '''
+        Get the entries of the estimate as a data frame.
+
+        Returns:
+            df (:class:`pandas.DataFrame`): Data frame with the columns `'kind'`, `'item'` and
+                                            `'value'`.
+        '''
+        data = [[kind, item, val] for (kind, item), val in self._entries.items()]
+        return pd.DataFrame(data, columns=['kind', 'item', 'value'])
+
+    def to_string(self):
+        '''
+        Get a human readable summary of the estimate.
+
+        Returns:
+            text (:obj:`str`): Summary.
+        '''
+        titles = {'memory': 'Peak memory', 'input': 'Input files', 'output': 'Output files',
+                  'flops': 'Floating point operations'}
+        lines = ["Resource estimate for {}".format(self.name)]
+        for kind in self._kinds:
+            items = [(item, val) for (knd, item), val in self._entries.items() if knd == kind]
+            if not items:
+                continue
+            fmt = '{:.3E}'.format if kind == 'flops' else format_bytes
+            lines.append("{}: {}".format(titles[kind], fmt(self.total(kind))))
+            lines += ["    {:<40s} {:>14s}".format(item, fmt(val)) for item, val in items]
+        lines.append("Estimated time: {:.1f} s".format(self.time()))
+        return '\n'.join(lines)
+
+    def check(self, memory_budget=None, disk_budget=None):
+        '''
+        Warn when the peak memory or the size of the outputs exceeds the budget.
+
+        Args:
+            memory_budget (:obj:`float`, optional): Memory budget in bytes. Defaults to
+                                                     :code:`None` (not checked).
+            disk_budget (:obj:`float`, optional): Disk budget in bytes. Defaults to
+                                                  :code:`None` (not checked).
+
+        Returns:
+            ok (:obj:`bool`): Whether the estimate is within the budgets.
+        '''
+        ok = True
+        for kind, budget, text in [('memory', memory_budget, 'peak memory'),
+                                   ('output', disk_budget, 'size of the outputs')]:
+            if budget is None:
+                continue
+            total = self.total(kind)
+            if total > budget:
+                ok = False
+                warnings.warn("The estimated {} of {} ({}) exceeds ".format(text, self.name,
+                                                                         format_bytes(total)) \
+                              +"the budget of {}.".format(format_bytes(budget)), Warning)
+        return ok
+
+    def __str__(self):
+        return self.to_string()
+
+    def __init__(self, name, flop_rate=1e10, io_rate=5e7):
+        self.name = name
+        self.flop_rate = flop_rate
+        self.io_rate = io_rate
+        self._entries = {}
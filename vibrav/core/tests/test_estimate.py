@@ -0,0 +1,53 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+from vibrav.core.estimate import ResourceEstimate, format_bytes
+from vibrav.zpvc import ZPVC
+from vibrav.base import resource
+import numpy as np
+import pytest
+
+def test_format_bytes():
+    assert format_bytes(512) == '512.00 B'
+    assert format_bytes(1.5*1024**3) == '1.50 GiB'
+
+def test_resource_estimate():
+    est = ResourceEstimate('test', flop_rate=1e9, io_rate=1e6)
+    est.add('memory', 'a', 100)
+    est.add('memory', 'a', 50)
+    est.add('memory', 'b', 10)
+    est.add('output', 'c', 1e6)
+    est.add('flops', 'd', 2e9)
+    assert est.total('memory') == 160
+    assert np.isclose(est.time(), 3)
+    df = est.to_frame()
+    assert df.shape == (4, 3)
+    assert 'Peak memory: 160.00 B' in est.to_string()
+    with pytest.raises(ValueError):
+        est.add('disk', 'e', 1)
+    assert est.check(memory_budget=1000, disk_budget=2e6)
+    with pytest.warns(Warning):
+        assert not est.check(memory_budget=100)
+    with pytest.warns(Warning):
+        assert not est.check(disk_budget=1e5)
+
+def test_zpvc_estimate():
+    zpvc = ZPVC(config_file=resource('nitromalonamide-zpvc-config.conf'))
+    est = zpvc.estimate(temperature=[0, 100], print_stdout=False)
+    assert est.total('memory') > 0
+    assert est.total('flops') > 0
+    small = zpvc.estimate(temperature=[0, 100], write_out_files=False, print_stdout=False)
+    assert small.total('output') == 0
+    with pytest.warns(Warning):
+        zpvc.estimate(memory_budget=1, print_stdout=False)
@@ -99,3 +99,59 @@ def energetic_degeneracy(data_df, degen_delta, rtol=1e-12, numpy=True, original_
         degeneracy.reset_index(drop=True, inplace=True)
     return degeneracy
 
+
+def get_manifolds(degeneracy, nstates):
+    '''
+    Get the degenerate manifold of each state from the data frame of
+    :func:`energetic_degeneracy`.
+
+    Args:
+        degeneracy (:class:`pandas.DataFrame`): Degenerate energies from
+                                                :func:`energetic_degeneracy`.
+        nstates (:obj:`int`): Number of states.
+
+    Returns:
+        manifold (:obj:`numpy.array`): Zero based index of the manifold of each state.
+        first (:obj:`numpy.array`): Zero based index of the first state of each manifold.
+        degen (:obj:`numpy.array`): Number of states in each manifold.
+    '''
+    manifold = np.zeros(nstates, dtype=np.int64)
+    first = np.zeros(degeneracy.shape[0], dtype=np.int64)
+    for mdx, index in enumerate(degeneracy['index'].values):
+        index = np.atleast_1d(index)
+        manifold[index] = mdx
+        first[mdx] = index.min()
+    degen = degeneracy['degen'].values.astype(np.int64)
+    return manifold, first, degen
+
+def sum_manifolds(nrow, ncol, values, energy, manifold):
+    '''
+    Sum the values of the transitions between each pair of degenerate manifolds. The energy of
+    each pair of manifolds is the mean of the transition energies.
+
+    Args:
+        nrow (:obj:`numpy.array`): Row index (one based) of each transition.
+        ncol (:obj:`numpy.array`): Column index (one based) of each transition.
+        values (:obj:`numpy.array`): Values of the transitions on the last axis.
+        energy (:obj:`numpy.array`): Transition energies.
+        manifold (:obj:`numpy.array`): Zero based index of the manifold of each state from
+                                       :func:`get_manifolds`.
+
+    Returns:
+        mrow (:obj:`numpy.array`): Zero based manifold index of the rows.
+        mcol (:obj:`numpy.array`): Zero based manifold index of the columns.
+        values (:obj:`numpy.array`): Summed values with the pairs of manifolds on the last axis.
+        energy (:obj:`numpy.array`): Mean transition energy of each pair of manifolds.
+    '''
+    nman = manifold.max()+1 if manifold.shape[0] > 0 else 1
+    key = manifold[np.asarray(nrow)-1]*nman + manifold[np.asarray(ncol)-1]
+    pairs, inv = np.unique(key, return_inverse=True)
+    values = np.asarray(values)
+    flat = values.reshape(-1, values.shape[-1])
+    summed = np.zeros((flat.shape[0], pairs.shape[0]), dtype=flat.dtype)
+    for idx, arr in enumerate(flat):
+        summed[idx] = np.bincount(inv, weights=arr, minlength=pairs.shape[0])
+    count = np.bincount(inv, minlength=pairs.shape[0])
+    mean = np.bincount(inv, weights=energy, minlength=pairs.shape[0]) / np.maximum(count, 1)
+    summed = summed.reshape(values.shape[:-1] + (pairs.shape[0],))
+    return pairs // nman, pairs % nman, summed, mean
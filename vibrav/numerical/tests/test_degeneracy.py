@@ -12,7 +12,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
-from vibrav.numerical.degeneracy import energetic_degeneracy
+from vibrav.numerical.degeneracy import energetic_degeneracy, get_manifolds, sum_manifolds
 from vibrav.base import resource
 import numpy as np
 import pandas as pd
@@ -25,3 +25,20 @@ def test_energetic_degeneracy():
     cols = ['value', 'degen']
     assert np.allclose(degen[cols].values, test_degen[cols].values)
 
+
+def test_sum_manifolds():
+    energies = np.array([0., 1e-8, 1., 2., 2.+1e-8, 2.-1e-8])
+    degeneracy = energetic_degeneracy(energies, 1e-7)
+    manifold, first, degen = get_manifolds(degeneracy, energies.shape[0])
+    assert np.array_equal(manifold, [0, 0, 1, 2, 2, 2])
+    assert np.array_equal(first, [0, 2, 3])
+    assert np.array_equal(degen, [2, 1, 3])
+    nrow = np.array([1, 2, 1, 2, 2])
+    ncol = np.array([4, 5, 3, 6, 3])
+    values = np.array([[1., 2., 3., 4., 5.], [0., 1., 0., 1., 0.]])
+    energy = np.array([2., 2., 1., 2., 1.])
+    mrow, mcol, summed, mean = sum_manifolds(nrow, ncol, values, energy, manifold)
+    assert np.array_equal(mrow, [0, 0])
+    assert np.array_equal(mcol, [1, 2])
+    assert np.allclose(summed, [[8., 7.], [0., 2.]])
+    assert np.allclose(mean, [1., 2.])
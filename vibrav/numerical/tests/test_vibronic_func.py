@@ -15,8 +15,10 @@
 from vibrav.numerical import vibronic_func
 from vibrav.base import resource
 from vibrav.util.io import open_txt
+from vibrav.util.math import abs2
 import pandas as pd
 import numpy as np
+import pytest
 
 def test_sf_to_so():
     spin_mult = [2, 1]
@@ -76,3 +78,250 @@ def test_compute_d_dq():
     assert np.all(np.logical_not(np.isnan(test_dipoles)))
     assert np.allclose(test_dipoles, so_dipoles)
 
+
+def test_compute_d_dq_batch():
+    # setup
+    spin_mult = [3, 1]
+    states = [42, 49]
+    nstates = 0
+    nstates_sf = sum(states)
+    multiplicity = []
+    for mult, num_state in zip(spin_mult, states):
+        multiplicity.append(np.repeat(mult, num_state))
+        nstates += mult*num_state
+    nstates = int(nstates)
+    nstates_sf = int(nstates_sf)
+    multiplicity = np.concatenate(tuple(multiplicity))
+    # read data
+    sf_dipoles = pd.read_csv(resource('molcas-ucl6-2minus-sf-dipole-1.txt.xz'), compression='xz',
+                             header=0, index_col=False).values.reshape(nstates_sf, nstates_sf)
+    so_dipoles = open_txt(resource('molcas-ucl6-2minus-so-dipole-1.txt.xz'), compression='xz').values
+    eigvectors = open_txt(resource('molcas-ucl6-2minus-eigvectors.txt.xz'), compression='xz').values
+    extended = np.zeros((nstates, nstates), dtype=np.float64)
+    vibronic_func.sf_to_so(nstates_sf, nstates, multiplicity, sf_dipoles, extended)
+    # single matrix
+    test_dipoles = vibronic_func.compute_d_dq_batch(eigvectors, extended)
+    assert np.allclose(test_dipoles, so_dipoles)
+    # stacked components and modes against the reference kernel
+    rand = np.random.RandomState(42)
+    stacked = rand.rand(2, 3, nstates, nstates)
+    test = vibronic_func.compute_d_dq_batch(eigvectors, stacked)
+    assert test.shape == stacked.shape
+    for idx in range(2):
+        for jdx in range(3):
+            ref = np.zeros((nstates, nstates), dtype=np.complex128)
+            vibronic_func.compute_d_dq(nstates, eigvectors, stacked[idx][jdx], ref)
+            assert np.allclose(test[idx][jdx], ref)
+
+def test_compute_d_dq_sf_batch():
+    nstates_sf = 40
+    rand = np.random.RandomState(7)
+    energies = np.sort(rand.rand(nstates_sf))
+    # add some degenerate states to test the masking
+    energies[5] = energies[4]
+    energies[20] = energies[19] + 1e-9
+    dham_dq = rand.rand(nstates_sf, nstates_sf)
+    dham_dq = dham_dq + dham_dq.T
+    eq_sf = rand.rand(3, nstates_sf, nstates_sf)
+    incl_states = np.ones(nstates_sf, dtype=bool)
+    incl_states[30:] = False
+    for incl in [None, incl_states]:
+        denom = vibronic_func.get_energy_denominator(energies, 1e-7, incl_states=incl)
+        assert np.all(np.isfinite(denom))
+        test = vibronic_func.compute_d_dq_sf_batch(dham_dq, eq_sf, denom)
+        for cdx in range(3):
+            ref = np.zeros((nstates_sf, nstates_sf), dtype=np.float64)
+            vibronic_func.compute_d_dq_sf(nstates_sf, dham_dq, eq_sf[cdx], energies, ref,
+                                          1e-7, incl_states=incl)
+            assert np.allclose(test[cdx], ref)
+
+def test_compute_d_dq_sf_sparse():
+    nstates_sf = 40
+    rand = np.random.RandomState(11)
+    energies = np.sort(rand.rand(nstates_sf))
+    energies[5] = energies[4]
+    dham_dq = rand.rand(nstates_sf, nstates_sf) - 0.5
+    dham_dq = dham_dq + dham_dq.T
+    # remove most of the elements
+    dham_dq[np.abs(dham_dq) < 0.8] = 0.0
+    eq_sf = rand.rand(3, nstates_sf, nstates_sf)
+    denom = vibronic_func.get_energy_denominator(energies, 1e-7)
+    data, indices, indptr = vibronic_func.get_csr(dham_dq)
+    assert data.shape[0] == np.count_nonzero(dham_dq)
+    assert indptr[-1] == data.shape[0]
+    test = vibronic_func.compute_d_dq_sf_sparse(data, indices, indptr, eq_sf, denom)
+    ref = vibronic_func.compute_d_dq_sf_batch(dham_dq, eq_sf, denom)
+    assert np.allclose(test, ref)
+    # the data type of the property values is kept
+    test = vibronic_func.compute_d_dq_sf_sparse(data, indices, indptr,
+                                                eq_sf.astype(np.float32), denom)
+    assert test.dtype == np.float32
+    assert np.allclose(test, ref, rtol=1e-4, atol=1e-4*np.abs(ref).max())
+    # both of the products only use the non-zero elements so the rows and columns can have
+    # different numbers of them
+    dham_dq[:, 3] = 0.0
+    data, indices, indptr = vibronic_func.get_csr(dham_dq)
+    test = vibronic_func.compute_d_dq_sf_sparse(data, indices, indptr, eq_sf, denom)
+    ref = vibronic_func.compute_d_dq_sf_batch(dham_dq, eq_sf, denom)
+    assert np.allclose(test, ref)
+    # no non-zero elements
+    data, indices, indptr = vibronic_func.get_csr(np.zeros((nstates_sf, nstates_sf)))
+    test = vibronic_func.compute_d_dq_sf_sparse(data, indices, indptr, eq_sf, denom)
+    assert np.all(test == 0)
+
+def test_compute_d_dq_blocks():
+    # non-contiguous multiplicities to make sure that the blocks are grouped correctly
+    multiplicity = np.concatenate((np.repeat(3, 4), np.repeat(1, 3), np.repeat(3, 2),
+                                   np.repeat(2, 3)))
+    nstates_sf = multiplicity.shape[0]
+    nstates = int(np.sum(multiplicity))
+    rand = np.random.RandomState(3)
+    eigvectors = rand.rand(nstates, nstates) + 1j*rand.rand(nstates, nstates)
+    sf = rand.rand(3, nstates_sf, nstates_sf)
+    extended = np.zeros((3, nstates, nstates), dtype=np.float64)
+    for idx in range(3):
+        vibronic_func.sf_to_so(nstates_sf, nstates, multiplicity, sf[idx], extended[idx])
+    blocks = vibronic_func.get_spin_blocks(multiplicity)
+    assert sum([so_index.shape[0] for _, so_index in blocks]) == nstates
+    test = vibronic_func.compute_d_dq_blocks(eigvectors, sf, blocks)
+    ref = vibronic_func.compute_d_dq_batch(eigvectors, extended)
+    assert np.allclose(test, ref)
+
+def test_compute_d_dq_blocks_sparse():
+    sparse = pytest.importorskip('scipy.sparse')
+    multiplicity = np.concatenate((np.repeat(3, 4), np.repeat(1, 3), np.repeat(2, 3)))
+    nstates_sf = multiplicity.shape[0]
+    nstates = int(np.sum(multiplicity))
+    rand = np.random.RandomState(5)
+    eigvectors = rand.rand(nstates, nstates) + 1j*rand.rand(nstates, nstates)
+    # remove most of the coefficients as with the so_cont_tol input
+    eigvectors[rand.rand(nstates, nstates) < 0.9] = 0
+    sf = rand.rand(6, nstates_sf, nstates_sf)
+    blocks = vibronic_func.get_spin_blocks(multiplicity)
+    test = vibronic_func.compute_d_dq_blocks_sparse(sparse.csr_matrix(eigvectors), sf, blocks)
+    ref = vibronic_func.compute_d_dq_blocks(eigvectors, sf, blocks)
+    assert isinstance(test, np.ndarray)
+    assert np.allclose(test, ref)
+
+def test_compute_d_dq_blocks_window():
+    sparse = pytest.importorskip('scipy.sparse')
+    multiplicity = np.concatenate((np.repeat(3, 4), np.repeat(1, 3), np.repeat(2, 3)))
+    nstates_sf = multiplicity.shape[0]
+    nstates = int(np.sum(multiplicity))
+    rand = np.random.RandomState(7)
+    eigvectors = rand.rand(nstates, nstates) + 1j*rand.rand(nstates, nstates)
+    sf = rand.rand(3, nstates_sf, nstates_sf)
+    blocks = vibronic_func.get_spin_blocks(multiplicity)
+    rows = np.arange(4)
+    cols = np.array([2, 5, 6, 7, 20])
+    ref = vibronic_func.compute_d_dq_blocks(eigvectors, sf, blocks)
+    test = vibronic_func.compute_d_dq_blocks(eigvectors, sf, blocks, rows=rows, cols=cols)
+    assert test.shape == (3, rows.shape[0], cols.shape[0])
+    assert np.allclose(test, ref[:, rows][:, :, cols])
+    test = vibronic_func.compute_d_dq_blocks_sparse(sparse.csr_matrix(eigvectors), sf, blocks,
+                                                    rows=rows, cols=cols)
+    assert np.allclose(test, ref[:, rows][:, :, cols])
+
+def test_compute_oscil_compact():
+    nstates = 30
+    rand = np.random.RandomState(11)
+    vib_prop = rand.rand(3, nstates, nstates) + 1j*rand.rand(3, nstates, nstates)
+    energies = np.sort(rand.rand(nstates))
+    shift = 0.01
+    boltz_factor = 0.7
+    # reference from the full matrices
+    absorption = abs2(vib_prop.reshape(3, nstates*nstates))
+    energy = (energies.reshape(-1, 1) - energies.reshape(-1,) + shift).flatten()
+    iso = boltz_factor * 2./3. * vibronic_func.compute_oscil_str(np.sum(absorption, axis=0),
+                                                                 energy)
+    nrow = np.tile(range(nstates), nstates) + 1
+    ncol = np.repeat(range(nstates), nstates) + 1
+    keep = np.logical_and(iso > 0, energy > 0)
+    test = vibronic_func.compute_oscil_compact(vib_prop, energies, shift, boltz_factor)
+    assert np.all(test[0] == nrow[keep])
+    assert np.all(test[1] == ncol[keep])
+    assert np.allclose(test[2][0], iso[keep])
+    for idx in range(3):
+        comp = boltz_factor * 2. * vibronic_func.compute_oscil_str(absorption[idx], energy)
+        assert np.allclose(test[2][idx+1], comp[keep])
+    assert np.allclose(test[3], energy[keep])
+    # keep all of the transitions
+    test = vibronic_func.compute_oscil_compact(vib_prop, energies, shift, boltz_factor,
+                                               keep_all=True)
+    assert test[0].shape[0] == nstates*nstates
+    assert np.allclose(test[2][0], iso)
+
+def test_compute_oscil_compact_temps():
+    nstates = 30
+    rand = np.random.RandomState(13)
+    vib_prop = rand.rand(3, nstates, nstates) + 1j*rand.rand(3, nstates, nstates)
+    energies = np.sort(rand.rand(nstates))
+    shift = -0.01
+    boltz_factors = np.array([0.7, 0.2, 0.0])
+    nrow, ncol, oscil, energy = vibronic_func.compute_oscil_compact_temps(vib_prop, energies,
+                                                                          shift, boltz_factors)
+    assert oscil.shape == (3, 4, nrow.shape[0])
+    for tdx, boltz_factor in enumerate(boltz_factors):
+        ref = vibronic_func.compute_oscil_compact(vib_prop, energies, shift, boltz_factor)
+        keep = oscil[tdx][0] > 0
+        assert np.all(nrow[keep] == ref[0])
+        assert np.all(ncol[keep] == ref[1])
+        assert np.all(oscil[tdx][:,keep] == ref[2])
+        assert np.all(energy[keep] == ref[3])
+
+def test_compute_oscil_compact_rotatory():
+    nstates = 30
+    rand = np.random.RandomState(19)
+    vib_prop = rand.rand(3, nstates, nstates) + 1j*rand.rand(3, nstates, nstates)
+    mag_prop = rand.rand(3, nstates, nstates) + 1j*rand.rand(3, nstates, nstates)
+    energies = np.sort(rand.rand(nstates))
+    boltz_factors = np.array([0.7, 0.2])
+    base = vibronic_func.compute_oscil_compact_temps(vib_prop, energies, 0.01, boltz_factors)
+    test = vibronic_func.compute_oscil_compact_temps(vib_prop, energies, 0.01, boltz_factors,
+                                                     mag_prop=mag_prop)
+    assert len(test) == 5
+    # the same transitions as without the magnetic dipoles
+    for arr, ref in zip(test[:4], base):
+        assert np.all(arr == ref)
+    # R = Im(mu_if . m_fi) with m = i/2 L
+    dot = np.real(np.sum(vib_prop*np.conj(mag_prop), axis=0))
+    ref = -0.5*dot[test[1]-1, test[0]-1]
+    for tdx, boltz_factor in enumerate(boltz_factors):
+        assert np.allclose(test[4][tdx], boltz_factor*ref)
+    with pytest.raises(ValueError):
+        vibronic_func.compute_oscil_compact_temps(vib_prop, energies, 0.01, boltz_factors,
+                                                  mag_prop=mag_prop[:2])
+
+def test_compute_oscil_compact_window():
+    nstates = 30
+    rand = np.random.RandomState(17)
+    vib_prop = rand.rand(3, nstates, nstates) + 1j*rand.rand(3, nstates, nstates)
+    energies = np.sort(rand.rand(nstates))
+    boltz_factors = np.array([0.7, 0.2])
+    final = np.arange(10, 25)
+    initial = np.arange(5)
+    full = vibronic_func.compute_oscil_compact_temps(vib_prop, energies, 0.01, boltz_factors)
+    test = vibronic_func.compute_oscil_compact_temps(vib_prop[:, final][:, :, initial],
+                                                     energies, 0.01, boltz_factors,
+                                                     final=final, initial=initial)
+    # same transitions in the same order as the full matrix
+    keep = np.isin(full[0], initial+1) & np.isin(full[1], final+1)
+    assert np.all(test[0] == full[0][keep])
+    assert np.all(test[1] == full[1][keep])
+    assert np.allclose(test[2], full[2][:, :, keep])
+    assert np.allclose(test[3], full[3][keep])
+
+def test_prune_oscil():
+    nrow = np.array([1, 1, 1, 2, 2, 3])
+    oscil = np.array([1e-12, 0.5, 0.2, 1.0, 1e-3, 0.3])
+    assert np.array_equal(vibronic_func.prune_oscil(nrow, oscil),
+                          np.ones(6, dtype=bool))
+    assert np.array_equal(vibronic_func.prune_oscil(nrow, oscil, tol=0.25),
+                          [False, True, False, True, False, True])
+    assert np.array_equal(vibronic_func.prune_oscil(nrow, oscil, rel_tol=1e-6),
+                          [False, True, True, True, True, True])
+    assert np.array_equal(vibronic_func.prune_oscil(nrow, oscil, top_n=1),
+                          [False, True, False, True, False, True])
+    assert np.array_equal(vibronic_func.prune_oscil(nrow, oscil, rel_tol=1e-6, top_n=2),
+                          [False, True, True, True, True, True])
+    assert vibronic_func.prune_oscil(nrow[:0], oscil[:0], tol=1.).shape == (0,)
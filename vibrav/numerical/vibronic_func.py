@@ -20,6 +20,211 @@ def compute_oscil_str(absorption, energy):
     '''Multiply the absorptin and energy'''
     return absorption * energy
 
+def compute_oscil_compact(vib_prop, energies, shift, boltz_factor, keep_all=False):
+    '''
+    Compute the isotropic and component oscillator strengths of all the transitions in one pass
+    over the vibronic property values and only keep the physically meaningful transitions
+    (positive isotropic oscillator strength and transition energy). The isotropic oscillator
+    strengths and those of each component are given by,
+
+    .. math::
+        f_{iso} = \\frac{2}{3}\\Delta E\\sum_{\\alpha}\\left|\\mu_{\\alpha}\\right|^2 \\qquad
+        f_{\\alpha} = 2\\Delta E\\left|\\mu_{\\alpha}\\right|^2
+
+    where :math:`\\Delta E_{ab} = E_a - E_b + shift` and every value is scaled by the
+    Boltzmann factor. Neither the full absorption nor the energy difference matrices are built.
+    The transitions are ordered in the same way as the flattened `vib_prop` array.
+
+    Args:
+        vib_prop (:obj:`numpy.array`): Vibronic property values of a single sign with the shape
+                                       `(ncomp, nstates, nstates)`. Stored as the transpose of
+                                       the derivative matrix.
+        energies (:obj:`numpy.array`): Energies of the states.
+        shift (:obj:`float`): Energy added to each of the transition energies. Typically, the
+                              vibrational energy times the sign of the displacement.
+        boltz_factor (:obj:`float`): Boltzmann factor to scale the oscillator strengths.
+        keep_all (:obj:`bool`, optional): Keep all of the transitions. Defaults to :code:`False`.
+
+    Returns:
+        nrow (:obj:`numpy.array`): Row index (one based) of each transition.
+        ncol (:obj:`numpy.array`): Column index (one based) of each transition.
+        oscil (:obj:`numpy.array`): Oscillator strengths with the shape `(ncomp+1, ntrans)`. The
+                                    first row is the isotropic value and the rest are the
+                                    components.
+        energy (:obj:`numpy.array`): Transition energies.
+    '''
+    boltz_factors = np.array([boltz_factor], dtype=np.float64)
+    nrow, ncol, oscil, energy = compute_oscil_compact_temps(vib_prop, energies, shift,
+                                                            boltz_factors, keep_all)
+    return nrow, ncol, oscil[0], energy
+
+def compute_oscil_compact_temps(vib_prop, energies, shift, boltz_factors, keep_all=False,
+                                final=None, initial=None, mag_prop=None):
+    '''
+    Same as :func:`compute_oscil_compact` for the Boltzmann factors of more than one
+    temperature. The absorption of each transition is only computed once. A transition is kept
+    when it is physically meaningful for any of the Boltzmann factors so the transitions of a
+    single temperature have to be filtered again by the positive isotropic oscillator strength.
+
+    When the vibronic magnetic dipole values are given the rotatory strengths of the same
+    transitions are computed in the same pass,
+
+    .. math::
+        R_{if} = \\Im\\left(\\mathbf{\\mu}_{if}\\cdot\\mathbf{m}_{fi}\\right)
+               = -\\frac{1}{2}\\Re\\left(\\sum_{c}\\mu_{if}^c L_{if}^{c*}\\right)
+
+    where the magnetic dipole is taken as :math:`\\mathbf{m}=\\frac{i}{2}\\mathbf{L}` from
+    the real antisymmetric angular momentum values of MOLCAS. The spin contribution is not
+    included.
+
+    Args:
+        vib_prop (:obj:`numpy.array`): Vibronic property values of a single sign with the shape
+                                       `(ncomp, nfinal, ninitial)`. Stored as the transpose of
+                                       the derivative matrix.
+        energies (:obj:`numpy.array`): Energies of all of the states.
+        shift (:obj:`float`): Energy added to each of the transition energies.
+        boltz_factors (:obj:`numpy.array`): Boltzmann factor of each temperature.
+        keep_all (:obj:`bool`, optional): Keep all of the transitions. Defaults to :code:`False`.
+        final (:obj:`numpy.array`, optional): Zero based indeces of the final states of the
+                                              second axis of `vib_prop`. Defaults to
+                                              :code:`None` (all of the states).
+        initial (:obj:`numpy.array`, optional): Zero based indeces of the initial states of the
+                                                third axis of `vib_prop`. Defaults to
+                                                :code:`None` (all of the states).
+        mag_prop (:obj:`numpy.array`, optional): Vibronic magnetic dipole values with the same
+                                                 shape as the electric dipole values in
+                                                 `vib_prop`. Defaults to :code:`None`.
+
+    Returns:
+        nrow (:obj:`numpy.array`): Row index (one based) of each transition.
+        ncol (:obj:`numpy.array`): Column index (one based) of each transition.
+        oscil (:obj:`numpy.array`): Oscillator strengths with the shape
+                                    `(ntemps, ncomp+1, ntrans)`.
+        energy (:obj:`numpy.array`): Transition energies.
+        rot (:obj:`numpy.array`): Boltzmann weighted rotatory strengths with the shape
+                                  `(ntemps, ntrans)`. Only returned when `mag_prop` is given.
+    '''
+    if final is None:
+        final = np.arange(vib_prop.shape[1])
+    if initial is None:
+        initial = np.arange(vib_prop.shape[2])
+    rotatory = mag_prop is not None
+    if rotatory and mag_prop.shape != vib_prop.shape:
+        raise ValueError("The electric and magnetic dipole values must have the same shape.")
+    # the kernel needs an array of the same type when the rotatory strengths are not computed
+    mag = np.asarray(mag_prop, dtype=vib_prop.dtype) if rotatory else vib_prop
+    final = np.asarray(final, dtype=np.int64)
+    initial = np.asarray(initial, dtype=np.int64)
+    boltz_factors = np.asarray(boltz_factors, dtype=np.float64)
+    nrow, ncol, oscil, energy, rot = _compute_oscil_window(vib_prop, energies, final, initial,
+                                                           shift, boltz_factors, keep_all, mag,
+                                                           rotatory)
+    if rotatory:
+        return nrow, ncol, oscil, energy, rot
+    return nrow, ncol, oscil, energy
+
+def prune_oscil(nrow, oscil, tol=None, rel_tol=None, top_n=None):
+    '''
+    Get the transitions that are kept after removing the weak oscillator strengths. The
+    transitions are removed when the oscillator strength is less than the absolute cut-off or
+    less than the relative cut-off times the largest oscillator strength. Only the `top_n`
+    strongest transitions out of each initial state are kept.
+
+    Args:
+        nrow (:obj:`numpy.array`): Row index of the initial state of each transition.
+        oscil (:obj:`numpy.array`): Oscillator strength of each transition.
+        tol (:obj:`float`, optional): Absolute cut-off. Defaults to :code:`None`.
+        rel_tol (:obj:`float`, optional): Cut-off relative to the largest oscillator strength.
+                                          Defaults to :code:`None`.
+        top_n (:obj:`int`, optional): Number of transitions to keep for each initial state.
+                                      Defaults to :code:`None`.
+
+    Returns:
+        keep (:obj:`numpy.array`): Mask of the transitions that are kept.
+    '''
+    nrow = np.asarray(nrow)
+    oscil = np.asarray(oscil)
+    keep = np.ones(oscil.shape[0], dtype=bool)
+    if oscil.shape[0] == 0:
+        return keep
+    if tol is not None:
+        keep &= oscil >= tol
+    if rel_tol is not None:
+        keep &= oscil >= rel_tol*oscil.max()
+    if top_n is not None:
+        # rank the transitions of each initial state from the strongest one
+        order = np.lexsort((-oscil, nrow))
+        rows = nrow[order]
+        start = np.concatenate([[0], np.flatnonzero(rows[1:] != rows[:-1])+1])
+        count = np.diff(np.concatenate([start, [rows.shape[0]]]))
+        rank = np.arange(rows.shape[0]) - np.repeat(start, count)
+        top = np.zeros(oscil.shape[0], dtype=bool)
+        top[order] = rank < top_n
+        keep &= top
+    return keep
+
+@jit(nopython=True, parallel=False)
+def _compute_oscil_window(vib_prop, energies, final, initial, shift, boltz_factors, keep_all,
+                          mag_prop, rotatory):
+    ncomp = vib_prop.shape[0]
+    ntemps = boltz_factors.shape[0]
+    # count the transitions to keep
+    count = 0
+    for idx in range(final.shape[0]):
+        for jdx in range(initial.shape[0]):
+            eng = energies[final[idx]] - energies[initial[jdx]] + shift
+            absorption = 0.0
+            for cdx in range(ncomp):
+                val = vib_prop[cdx, idx, jdx]
+                absorption += val.real*val.real + val.imag*val.imag
+            keep = keep_all
+            for tdx in range(ntemps):
+                osc = boltz_factors[tdx] * 2./3. * absorption * eng
+                if osc > 0 and eng > 0:
+                    keep = True
+            if keep:
+                count += 1
+    nrow = np.empty(count, dtype=np.int64)
+    ncol = np.empty(count, dtype=np.int64)
+    oscil = np.empty((ntemps, ncomp+1, count), dtype=np.float64)
+    energy = np.empty(count, dtype=np.float64)
+    rot = np.empty((ntemps, count if rotatory else 0), dtype=np.float64)
+    # fill the compact arrays
+    count = 0
+    for idx in range(final.shape[0]):
+        for jdx in range(initial.shape[0]):
+            eng = energies[final[idx]] - energies[initial[jdx]] + shift
+            absorption = 0.0
+            for cdx in range(ncomp):
+                val = vib_prop[cdx, idx, jdx]
+                absorption += val.real*val.real + val.imag*val.imag
+            keep = keep_all
+            for tdx in range(ntemps):
+                osc = boltz_factors[tdx] * 2./3. * absorption * eng
+                if osc > 0 and eng > 0:
+                    keep = True
+            if keep:
+                nrow[count] = initial[jdx] + 1
+                ncol[count] = final[idx] + 1
+                for tdx in range(ntemps):
+                    oscil[tdx, 0, count] = boltz_factors[tdx] * 2./3. * absorption * eng
+                    for cdx in range(ncomp):
+                        val = vib_prop[cdx, idx, jdx]
+                        oscil[tdx, cdx+1, count] = boltz_factors[tdx] * 2. * eng \
+                                                   * (val.real*val.real + val.imag*val.imag)
+                if rotatory:
+                    # real part of the product with the complex conjugate
+                    dot = 0.0
+                    for cdx in range(ncomp):
+                        val = vib_prop[cdx, idx, jdx]
+                        mag = mag_prop[cdx, idx, jdx]
+                        dot += val.real*mag.real + val.imag*mag.imag
+                    for tdx in range(ntemps):
+                        rot[tdx, count] = -0.5 * boltz_factors[tdx] * dot
+                energy[count] = eng
+                count += 1
+    return nrow, ncol, oscil, energy, rot
+
 @jit(nopython=True, parallel=False)
 def compute_d_dq_sf(nstates_sf, dham_dq, eq_sf, energies_sf, dprop_dq_sf, tol=1e-5,
                     incl_states=None):
@@ -77,6 +282,140 @@ def compute_d_dq_sf(nstates_sf, dham_dq, eq_sf, energies_sf, dprop_dq_sf, tol=1e
                             dprop_dq_sf[idx][jdx] += dham_dq[kdx][jdx]*eq_sf[idx][kdx] \
                                                         / (energies_sf[jdx] - energies_sf[kdx])
 
+def get_energy_denominator(energies_sf, tol=1e-5, incl_states=None):
+    '''
+    Build the reciprocal energy difference matrix used in the sum-over-states equations of
+    :func:`vibrav.numerical.vibronic_func.compute_d_dq_sf`,
+
+    .. math::
+        W_{ik} = \\frac{1}{E_i^0 - E_k^0}
+
+    where all of the elements with :math:`\\left|E_i^0 - E_k^0\\right| < tol` are set to zero.
+    This does not depend on the normal mode or the property component so it only has to be
+    generated once per calculation.
+
+    Args:
+        energies_sf (:obj:`numpy.array`): Spin-free energies parsed from the equilibrium geometry.
+        tol (:obj:`float`, optional): Tolerance value for the energy differences.
+                                      Defaults to :code:`1e-5`.
+        incl_states (:obj:`numpy.array`, optional): Boolean array of the states to include in the
+                                                    SOS. The columns of the states that are not
+                                                    included are set to zero. Defaults to
+                                                    :code:`None` (all available states are included).
+
+    Returns:
+        denom (:obj:`numpy.array`): Masked reciprocal energy difference matrix.
+    '''
+    energies_sf = np.asarray(energies_sf, dtype=np.float64)
+    diff = energies_sf.reshape(-1, 1) - energies_sf.reshape(1, -1)
+    mask = np.abs(diff) < tol
+    if incl_states is not None:
+        mask[:, ~np.asarray(incl_states, dtype=bool)] = True
+    diff[mask] = 1.0
+    denom = 1. / diff
+    denom[mask] = 0.0
+    return denom
+
+def compute_d_dq_sf_batch(dham_dq, eq_sf, denom):
+    '''
+    Matrix form of :func:`vibrav.numerical.vibronic_func.compute_d_dq_sf`. With the masked
+    reciprocal energy difference matrix, :math:`W`, from
+    :func:`vibrav.numerical.vibronic_func.get_energy_denominator` the two sums over the states
+    reduce to two matrix products,
+
+    .. math::
+        \\frac{\\partial\\mu^{e}\\left(Q\\right)}{\\partial Q_p} =
+            \\left(\\frac{\\partial H}{\\partial Q_p}\\circ W\\right)\\mu^e
+            + \\mu^e\\left(\\frac{\\partial H}{\\partial Q_p}\\circ W^T\\right)
+
+    where the second term is :math:`\\mu^e\\left(\\partial H/\\partial Q_p\\circ W\\right)^T`
+    for a symmetric Hamiltonian derivative.
+
+    Args:
+        dham_dq (:obj:`numpy.array`): Derivative of the Hamiltonian with respect to the normal
+                                      coordinate.
+        eq_sf (:obj:`numpy.array`): Spin-free values of the property parsed from the equilibrium
+                                    geometry. Can have the shape `(ncomp, nstates_sf, nstates_sf)`
+                                    to compute all of the components at once.
+        denom (:obj:`numpy.array`): Masked reciprocal energy difference matrix.
+
+    Returns:
+        dprop_dq_sf (:obj:`numpy.array`): Spin-free derivative of the property of interest with
+                                          the same shape as `eq_sf`.
+    '''
+    dham_w = dham_dq * denom
+    dham_wt = dham_dq * denom.T
+    dprop_dq_sf = np.matmul(dham_w, eq_sf) + np.matmul(eq_sf, dham_wt)
+    return dprop_dq_sf
+
+def get_csr(arr):
+    '''
+    Get the compressed sparse row arrays of the non-zero elements of a matrix without needing
+    scipy.
+
+    Args:
+        arr (:obj:`numpy.array`): Matrix with the shape `(nrows, ncols)`.
+
+    Returns:
+        data (:obj:`numpy.array`): Non-zero values in the row major order.
+        indices (:obj:`numpy.array`): Column index of each of the non-zero values.
+        indptr (:obj:`numpy.array`): Position of the first non-zero value of each row with the
+                                     number of non-zero values appended.
+    '''
+    arr = np.asarray(arr)
+    rows, cols = np.nonzero(arr)
+    indptr = np.zeros(arr.shape[0]+1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=arr.shape[0]), out=indptr[1:])
+    return arr[rows, cols], cols.astype(np.int64), indptr
+
+def compute_d_dq_sf_sparse(data, indices, indptr, eq_sf, denom):
+    '''
+    Sparse version of :func:`vibrav.numerical.vibronic_func.compute_d_dq_sf_batch` for when
+    most of the elements of the Hamiltonian derivative have been removed (i.e. with the
+    `dham_dq_tol` input). Only the non-zero elements of the derivative are iterated over so the
+    number of operations scales with the number of non-zero elements instead of the cube of the
+    number of spin-free states.
+
+    Args:
+        data (:obj:`numpy.array`): Non-zero values of the derivative of the Hamiltonian with
+                                   respect to the normal coordinate from
+                                   :func:`vibrav.numerical.vibronic_func.get_csr`.
+        indices (:obj:`numpy.array`): Column index of each of the non-zero values.
+        indptr (:obj:`numpy.array`): Position of the first non-zero value of each row.
+        eq_sf (:obj:`numpy.array`): Spin-free values of the property parsed from the equilibrium
+                                    geometry with the shape `(ncomp, nstates_sf, nstates_sf)`.
+        denom (:obj:`numpy.array`): Masked reciprocal energy difference matrix.
+
+    Returns:
+        dprop_dq_sf (:obj:`numpy.array`): Spin-free derivative of the property of interest with
+                                          the same shape and data type as `eq_sf`.
+    '''
+    eq_sf = np.ascontiguousarray(eq_sf)
+    data = np.asarray(data, dtype=eq_sf.dtype)
+    denom = np.asarray(denom, dtype=eq_sf.dtype)
+    dprop_dq_sf = np.zeros_like(eq_sf)
+    _compute_d_dq_sf_csr(data, indices, indptr, eq_sf, denom, dprop_dq_sf)
+    return dprop_dq_sf
+
+@jit(nopython=True, parallel=False)
+def _compute_d_dq_sf_csr(data, indices, indptr, eq_sf, denom, dprop_dq_sf):
+    ncomp, nstates_sf, _ = eq_sf.shape
+    for cdx in range(ncomp):
+        # (dH/dQ o W) mu
+        for idx in range(nstates_sf):
+            for ndx in range(indptr[idx], indptr[idx+1]):
+                kdx = indices[ndx]
+                coef = data[ndx]*denom[idx, kdx]
+                for jdx in range(nstates_sf):
+                    dprop_dq_sf[cdx, idx, jdx] += coef*eq_sf[cdx, kdx, jdx]
+        # mu (dH/dQ o W^T)
+        for kdx in range(nstates_sf):
+            for ndx in range(indptr[kdx], indptr[kdx+1]):
+                jdx = indices[ndx]
+                coef = data[ndx]*denom[jdx, kdx]
+                for idx in range(nstates_sf):
+                    dprop_dq_sf[cdx, idx, jdx] += coef*eq_sf[cdx, idx, kdx]
+
 @jit(nopython=True, parallel=False)
 def sf_to_so(nstates_sf, nstates, multiplicity, dprop_dq_sf, dprop_dq_so):
     '''
@@ -169,3 +508,194 @@ def compute_d_dq(nstates, eigvectors, prop_so, dprop_dq):
             for kdx in range(nstates):
                 dprop_dq[idx][jdx] += tmp[idx][kdx] * eigvectors[kdx][jdx]
 
+def compute_d_dq_batch(eigvectors, prop_so):
+    '''
+    Batched, BLAS backed version of :func:`vibrav.numerical.vibronic_func.compute_d_dq`.
+    Performs the same complex transformation with the eigen vectors,
+
+    .. math::
+        \\left<\\psi_1^{SO}|\\mu^e|\\psi_2^{SO}\\right> = \\sum_{k,m}U_{k1}^{0*}U_{m2}^{0}
+                                    \\left<\\psi_k|\\mu_{1,2}^{e,SF}\\left(Q\\right)|\\psi_m\\right>
+
+    but for any number of stacked matrices at once. All of the matrices in `prop_so` are
+    placed side by side so the entire transformation is done with two matrix products,
+    :math:`U^{\\dagger}\\left[P_1 P_2 \\cdots\\right]` followed by
+    :math:`\\left[T_1; T_2; \\cdots\\right]U`, instead of one per component.
+
+    Note:
+        When `prop_so` is real valued, as is the case for the output of
+        :func:`vibrav.numerical.vibronic_func.sf_to_so`, the first product is split into
+        two real matrix products to avoid the complex upcast of the input array.
+
+        This is the reference implementation of the transformation of the full extended
+        matrices. :class:`vibrav.vibronic.Vibronic` uses
+        :func:`vibrav.numerical.vibronic_func.compute_d_dq_blocks` (or
+        :func:`vibrav.numerical.vibronic_func.compute_d_dq_blocks_sparse`) which never builds
+        the extended matrices.
+
+    Args:
+        eigvectors (:obj:`numpy.array`): Array containing the eigen vectors read from the
+                                         eigvectors.txt file produced by Molcas.
+        prop_so (:obj:`numpy.array`): Extended spin-free derivatives with the shape
+                                      `(..., nstates, nstates)`. Any leading dimensions
+                                      (components, normal modes, etc.) are treated as a batch.
+
+    Returns:
+        dprop_dq (:obj:`numpy.array`): Spin-orbit derivatives of the property of interest with
+                                       the same shape as `prop_so`.
+    '''
+    prop_so = np.asarray(prop_so)
+    shape = prop_so.shape
+    nstates = shape[-1]
+    if prop_so.ndim == 2:
+        flat = prop_so.reshape(1, nstates, nstates)
+    else:
+        flat = prop_so.reshape(-1, nstates, nstates)
+    nbatch = flat.shape[0]
+    # place all of the matrices side by side (nstates, nbatch*nstates)
+    horiz = np.transpose(flat, (1, 0, 2)).reshape(nstates, nbatch*nstates)
+    if np.iscomplexobj(horiz):
+        tmp = np.dot(np.conjugate(eigvectors.T), horiz)
+    else:
+        tmp = np.dot(np.real(eigvectors).T, horiz) \
+              - 1j*np.dot(np.imag(eigvectors).T, horiz)
+    # stack the intermediates on top of each other (nbatch*nstates, nstates)
+    vert = np.transpose(tmp.reshape(nstates, nbatch, nstates), (1, 0, 2))
+    vert = vert.reshape(nbatch*nstates, nstates)
+    dprop_dq = np.dot(vert, eigvectors)
+    return dprop_dq.reshape(shape)
+
+def get_spin_blocks(multiplicity):
+    '''
+    Get the spin blocks of the spin-free derivatives once they are extended into the number of
+    spin-orbit states with :func:`vibrav.numerical.vibronic_func.sf_to_so`. Each block is made of
+    the spin-free states with the same multiplicity and a single :math:`M_s` component. The
+    extended matrix is then the sum over the blocks of the spin-free block placed at the
+    spin-orbit indeces of that block,
+
+    .. math::
+        P^{SO} = \\sum_{S,M_s} E_{S,M_s}P^{SF}_{S}E_{S,M_s}^T
+
+    where :math:`E_{S,M_s}` is the selection matrix of the block.
+
+    Args:
+        multiplicity (:obj:`numpy.array`): 1D array detailing which spin-free states have which
+                                           multiplicity.
+
+    Returns:
+        blocks (:obj:`list`): List of tuples with the spin-free indeces and the spin-orbit
+                              indeces of each block.
+    '''
+    multiplicity = np.asarray(multiplicity, dtype=np.int64)
+    offset = np.concatenate(([0], np.cumsum(multiplicity)[:-1]))
+    blocks = []
+    for mult in np.unique(multiplicity):
+        sf_index = np.where(multiplicity == mult)[0]
+        for ist in range(mult):
+            blocks.append((sf_index, offset[sf_index] + ist))
+    return blocks
+
+def compute_d_dq_blocks(eigvectors, dprop_dq_sf, blocks, rows=None, cols=None):
+    '''
+    Perform the complex transformation with the eigen vectors directly from the spin-free
+    derivatives without building the extended matrix from
+    :func:`vibrav.numerical.vibronic_func.sf_to_so`. Using the spin blocks from
+    :func:`vibrav.numerical.vibronic_func.get_spin_blocks` the first half of the transformation
+    only involves the non-zero blocks,
+
+    .. math::
+        \\left(U^{\\dagger}P^{SO}\\right)_{:,\\left\\{S,M_s\\right\\}} =
+            \\left(U_{\\left\\{S,M_s\\right\\},:}\\right)^{\\dagger}P^{SF}_{S}
+
+    and the second half is done as a single matrix product for all of the components. The
+    result is the same as that of the reference implementation
+    :func:`vibrav.numerical.vibronic_func.compute_d_dq_batch` with the extended matrices from
+    :func:`vibrav.numerical.vibronic_func.sf_to_so`. When only some of the rows and
+    columns of the spin-orbit derivatives are needed only those columns of the eigen vectors
+    are used in each half of the transformation.
+
+    Args:
+        eigvectors (:obj:`numpy.array`): Array containing the eigen vectors read from the
+                                         eigvectors.txt file produced by Molcas.
+        dprop_dq_sf (:obj:`numpy.array`): Spin-free derivatives with the shape
+                                          `(..., nstates_sf, nstates_sf)`.
+        blocks (:obj:`list`): Spin blocks from
+                              :func:`vibrav.numerical.vibronic_func.get_spin_blocks`.
+        rows (:obj:`numpy.array`, optional): Zero based indeces of the spin-orbit states to
+                                             compute the rows for. Defaults to :code:`None`
+                                             (all of the states).
+        cols (:obj:`numpy.array`, optional): Zero based indeces of the spin-orbit states to
+                                             compute the columns for. Defaults to :code:`None`
+                                             (all of the states).
+
+    Returns:
+        dprop_dq (:obj:`numpy.array`): Spin-orbit derivatives of the property of interest with
+                                       the shape `(..., nrows, ncols)`. Complex64 when both the
+                                       eigen vectors and the derivatives are single precision.
+    '''
+    dprop_dq_sf = np.asarray(dprop_dq_sf)
+    shape = dprop_dq_sf.shape
+    nstates_sf = shape[-1]
+    nstates = eigvectors.shape[0]
+    left = eigvectors if rows is None else eigvectors[:, rows]
+    right = eigvectors if cols is None else eigvectors[:, cols]
+    nrows = left.shape[1]
+    flat = dprop_dq_sf.reshape(-1, nstates_sf, nstates_sf)
+    nbatch = flat.shape[0]
+    # single precision eigen vectors and derivatives are kept in single precision
+    tmp = np.zeros((nbatch, nrows, nstates), dtype=np.result_type(left.dtype, flat.dtype,
+                                                                   np.complex64))
+    for sf_index, so_index in blocks:
+        block = flat[:, sf_index.reshape(-1, 1), sf_index]
+        tmp[:, :, so_index] = np.matmul(np.conjugate(left[so_index].T), block)
+    dprop_dq = np.dot(tmp.reshape(nbatch*nrows, nstates), right)
+    return dprop_dq.reshape(shape[:-2]+(nrows, right.shape[1]))
+
+def compute_d_dq_blocks_sparse(eigvectors, dprop_dq_sf, blocks, rows=None, cols=None):
+    '''
+    Sparse version of :func:`vibrav.numerical.vibronic_func.compute_d_dq_blocks` for when most
+    of the eigen vector coefficients are zero (i.e. after removing the small spin-free
+    contributions with the `so_cont_tol` input). The spin blocks of all the components are
+    placed side by side so each block is a single sparse-dense matrix product and the second
+    half of the transformation is a single dense-sparse matrix product.
+
+    Args:
+        eigvectors (:class:`scipy.sparse.csr_matrix`): Sparse eigen vectors.
+        dprop_dq_sf (:obj:`numpy.array`): Spin-free derivatives with the shape
+                                          `(..., nstates_sf, nstates_sf)`.
+        blocks (:obj:`list`): Spin blocks from
+                              :func:`vibrav.numerical.vibronic_func.get_spin_blocks`.
+        rows (:obj:`numpy.array`, optional): Zero based indeces of the spin-orbit states to
+                                             compute the rows for. Defaults to :code:`None`
+                                             (all of the states).
+        cols (:obj:`numpy.array`, optional): Zero based indeces of the spin-orbit states to
+                                             compute the columns for. Defaults to :code:`None`
+                                             (all of the states).
+
+    Returns:
+        dprop_dq (:obj:`numpy.array`): Spin-orbit derivatives of the property of interest with
+                                       the shape `(..., nrows, ncols)`. Complex64 when both the
+                                       eigen vectors and the derivatives are single precision.
+    '''
+    dprop_dq_sf = np.asarray(dprop_dq_sf)
+    shape = dprop_dq_sf.shape
+    nstates_sf = shape[-1]
+    nstates = eigvectors.shape[0]
+    left = eigvectors if rows is None else eigvectors[:, rows]
+    right = eigvectors if cols is None else eigvectors[:, cols]
+    nrows = left.shape[1]
+    flat = dprop_dq_sf.reshape(-1, nstates_sf, nstates_sf)
+    nbatch = flat.shape[0]
+    # single precision eigen vectors and derivatives are kept in single precision
+    tmp = np.zeros((nbatch, nrows, nstates), dtype=np.result_type(left.dtype, flat.dtype,
+                                                                   np.complex64))
+    for sf_index, so_index in blocks:
+        nblock = sf_index.shape[0]
+        block = flat[:, sf_index.reshape(-1, 1), sf_index]
+        horiz = np.transpose(block, (1, 0, 2)).reshape(nblock, nbatch*nblock)
+        conj_t = left[so_index].conj().T.tocsr()
+        prod = np.asarray(conj_t @ horiz).reshape(nrows, nbatch, nblock)
+        tmp[:, :, so_index] = np.transpose(prod, (1, 0, 2))
+    dprop_dq = np.asarray(tmp.reshape(nbatch*nrows, nstates) @ right)
+    return dprop_dq.reshape(shape[:-2]+(nrows, right.shape[1]))
+
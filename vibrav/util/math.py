@@ -51,7 +51,7 @@ def get_tril(arr, k=0):
     tril_arr = arr[tril]
     return tril_arr
 
-def ishermitian(data):
+def ishermitian(data, rtol=1e-05, atol=1e-08):
     '''
     Check if the input array is hermitian.
 
@@ -61,15 +61,19 @@ def ishermitian(data):
 
     Args:
         data (:obj:`numpy.array`): Array to be evaluated
+        rtol (:obj:`float`, optional): Relative tolerance passed to :func:`numpy.allclose`.
+                                       Defaults to `1e-05`.
+        atol (:obj:`float`, optional): Absolute tolerance passed to :func:`numpy.allclose`.
+                                       Defaults to `1e-08`.
 
     Return:
         isherm (:obj:`bool`): Is the array hermitian
     '''
     herm = np.conjugate(np.transpose(data))
-    isherm = np.allclose(herm, data)
+    isherm = np.allclose(herm, data, rtol=rtol, atol=atol)
     return isherm
 
-def isantihermitian(data):
+def isantihermitian(data, rtol=1e-05, atol=1e-08):
     '''
     Check if the input array is symmetric.
 
@@ -79,6 +83,10 @@ def isantihermitian(data):
 
     Args:
         data (:obj:`numpy.array`): Array to be evaluated
+        rtol (:obj:`float`, optional): Relative tolerance passed to :func:`numpy.allclose`.
+                                       Defaults to `1e-05`.
+        atol (:obj:`float`, optional): Absolute tolerance passed to :func:`numpy.allclose`.
+                                       Defaults to `1e-08`.
 
     Return:
         isherm (:obj:`bool`): Is the array hermitian
@@ -86,7 +94,7 @@ def isantihermitian(data):
     if isinstance(data, (list, tuple)): data = np.array(data)
     a = -1*(np.ones(data.shape) - np.eye(data.shape[0])) + np.eye(data.shape[0])
     antiherm = a*np.conjugate(np.transpose(data))
-    isantiherm = np.allclose(antiherm, data)
+    isantiherm = np.allclose(antiherm, data, rtol=rtol, atol=atol)
     return isantiherm
 
 def issymmetric(data):
@@ -15,3 +15,8 @@
 from .vibronic import Vibronic, write_txt
 from .combine_ham import combine_ham_files
 
+from .store import TxtStore, HDF5Store, AsyncStore
+from .checkpoint import Checkpoint
+from .results import ModeResult
+from .spectrum import Spectrum
+from .shard import merge_shards
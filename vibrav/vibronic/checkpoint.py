@@ -0,0 +1,284 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Checkpoints for the vibronic coupling calculations
+##################################################
+Record the normal modes that have been completed by
+:meth:`vibrav.vibronic.Vibronic.vibronic_coupling` so that an interrupted calculation can be
+resumed or only the normal modes with changed inputs are computed again.
+'''
+import numpy as np
+import hashlib
+import json
+import os
+import warnings
+
+# column of the normal mode index in the oscillator files
+_freqdx_col = 4
+
+def hash_inputs(files, values=None):
+    '''
+    Get the content hash of the input files and values.
+
+    Args:
+        files (:obj:`list`): Filepaths of the input files. Missing files are hashed as such.
+        values (:obj:`list`, optional): Any other values that affect the results. They are
+                                        hashed as their string representation. Defaults to
+                                        :code:`None`.
+
+    Returns:
+        digest (:obj:`str`): Hexadecimal SHA-256 digest.
+    '''
+    sha = hashlib.sha256()
+    for fp in files:
+        sha.update(fp.encode())
+        if os.path.exists(fp):
+            with open(fp, 'rb') as fn:
+                for chunk in iter(lambda: fn.read(1 << 20), b''):
+                    sha.update(chunk)
+        else:
+            sha.update(b'missing')
+    if values is not None:
+        for val in values:
+            sha.update(repr(val).encode())
+    return sha.hexdigest()
+
+def _rewrite_lines(fp, func):
+    # the oscillator files have a header line and every other line starts with a newline
+    with open(fp, 'r') as fn:
+        lines = fn.read().split('\n')
+    lines = lines[:1] + func(lines[1:])
+    _replace(fp, lambda fn: fn.write('\n'.join(lines)))
+
+def _replace(fp, write, mode='w', sync=True):
+    # write to a temporary file and rename so the file is never left half written
+    # the contents are only forced to the disk before the rename when syncing
+    tmp = fp+'.tmp'
+    with open(tmp, mode) as fn:
+        write(fn)
+        if sync:
+            fn.flush()
+            os.fsync(fn.fileno())
+    os.replace(tmp, fp)
+
+class Checkpoint:
+    '''
+    Keep track of the normal modes that have been completed in a vibronic coupling calculation
+    so that it can be resumed when it is interrupted. After each normal mode the size of each
+    of the files that are appended to (i.e. the `oscillators-*.txt` files) is recorded in a
+    manifest file. When resuming, the files are truncated to the recorded sizes to discard the
+    partial output of the interrupted normal mode. The hash of the inputs of each normal mode
+    can also be recorded so that only the normal modes with changed inputs are computed again.
+
+    Args:
+        path (:obj:`str`): Directory where the checkpoint files are written.
+        settings (:obj:`dict`): Settings of the calculation. A calculation can only be resumed
+                                with the same settings.
+        files (:obj:`list`): Filepaths of the files that are appended to after each normal mode.
+    '''
+    _manifest = 'checkpoint.json'
+    _data = 'checkpoint-data.npz'
+    _mode_data = 'checkpoint-mode-{}.npz'
+    def load(self, strict=True):
+        '''
+        Load the manifest file and truncate the appended files to the size they had after the
+        last completed normal mode.
+
+        Args:
+            strict (:obj:`bool`, optional): Raise an error when the settings do not match.
+                                            Otherwise, the checkpoint is ignored. Defaults to
+                                            :code:`True`.
+
+        Returns:
+            found (:obj:`bool`): Whether a usable checkpoint was found.
+
+        Raises:
+            ValueError: When the settings of the checkpoint do not match the current settings.
+        '''
+        manifest = os.path.join(self.path, self._manifest)
+        if not os.path.exists(manifest):
+            warnings.warn("Could not find a checkpoint in {}. ".format(self.path) \
+                          +"Starting from the beginning.", Warning)
+            return False
+        with open(manifest, 'r') as fn:
+            data = json.load(fn)
+        if data['settings'] != self.settings:
+            if not strict:
+                warnings.warn("The settings or inputs of the checkpoint in " \
+                              +"{} have changed. Starting from the ".format(self.path) \
+                              +"beginning.", Warning)
+                return False
+            raise ValueError("The settings of the checkpoint in {} ".format(self.path) \
+                             +"do not match the current settings. Cannot resume the " \
+                             +"calculation.")
+        for file in self.files:
+            if file not in data['sizes'] or not os.path.exists(file) \
+                    or os.path.getsize(file) < data['sizes'][file]:
+                raise ValueError("The file {} of the checkpoint is missing ".format(file) \
+                                 +"or incomplete. Cannot resume the calculation.")
+            # discard anything written by a mode that did not finish
+            with open(file, 'r+') as fn:
+                fn.truncate(data['sizes'][file])
+        self.completed = data['completed']
+        self.prefactor = data['prefactor']
+        self.hashes = data.get('hashes', {})
+        return True
+
+    def reset(self):
+        '''
+        Remove the files of a previous checkpoint when starting from the beginning.
+        '''
+        for name in [self._manifest, self._data]:
+            fp = os.path.join(self.path, name)
+            if os.path.exists(fp):
+                os.remove(fp)
+        prefix, suffix = self._mode_data.split('{}')
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name.endswith(suffix):
+                os.remove(os.path.join(self.path, name))
+        self.completed = []
+        self.prefactor = []
+        self.hashes = {}
+
+    def _save(self):
+        sizes = {}
+        for file in self.files:
+            with open(file, 'a') as fn:
+                fn.flush()
+                os.fsync(fn.fileno())
+            sizes[file] = os.path.getsize(file)
+        data = {'settings': self.settings, 'completed': self.completed,
+                'prefactor': self.prefactor, 'hashes': self.hashes, 'sizes': sizes}
+        _replace(os.path.join(self.path, self._manifest), lambda fn: json.dump(data, fn))
+
+    def update(self, founddx, prefactor, digest=None):
+        '''
+        Mark the normal mode as completed.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            prefactor (:obj:`float`): Transition dipole moment prefactor of the normal mode.
+            digest (:obj:`str`, optional): Hash of the inputs of the normal mode. Defaults to
+                                           :code:`None`.
+        '''
+        self.completed.append(int(founddx))
+        self.prefactor.append(float(prefactor))
+        if digest is not None:
+            self.hashes[str(founddx)] = digest
+        self._save()
+
+    def discard(self, modes):
+        '''
+        Remove the completed normal modes from the checkpoint and their lines from the appended
+        files so that they can be computed again.
+
+        Args:
+            modes (:obj:`list`): Zero based indeces of the normal modes.
+        '''
+        modes = set(int(fdx) for fdx in modes)
+        if not modes:
+            return
+        keep = [idx for idx, fdx in enumerate(self.completed) if fdx not in modes]
+        self.completed = [self.completed[idx] for idx in keep]
+        self.prefactor = [self.prefactor[idx] for idx in keep]
+        for fdx in modes:
+            self.hashes.pop(str(fdx), None)
+        func = lambda lines: [line for line in lines
+                              if int(line.split()[_freqdx_col]) not in modes]
+        for file in self.files:
+            _rewrite_lines(file, func)
+        self._save()
+
+    def sort(self, order):
+        '''
+        Sort the lines of the appended files and the completed normal modes in the given order
+        of the normal modes. The order of the lines of each normal mode is not changed.
+
+        Args:
+            order (:obj:`list`): Zero based indeces of the normal modes.
+        '''
+        position = {int(fdx): idx for idx, fdx in enumerate(order)}
+        func = lambda lines: sorted(lines, key=lambda line: position.get(
+                                        int(line.split()[_freqdx_col]), len(position)))
+        for file in self.files:
+            _rewrite_lines(file, func)
+        idx = sorted(range(len(self.completed)),
+                     key=lambda idx: position.get(self.completed[idx], len(position)))
+        self.completed = [self.completed[i] for i in idx]
+        self.prefactor = [self.prefactor[i] for i in idx]
+        self._save()
+
+    def save_data(self, **arrays):
+        '''
+        Save the parsed zero order data so it does not have to be parsed again when resuming.
+
+        Args:
+            **arrays: Arrays to save.
+        '''
+        _replace(os.path.join(self.path, self._data), lambda fn: np.savez(fn, **arrays),
+                 mode='wb')
+
+    def load_data(self):
+        '''
+        Load the saved zero order data.
+
+        Returns:
+            arrays (:obj:`dict`): Saved arrays. :code:`None` if nothing was saved.
+        '''
+        fp = os.path.join(self.path, self._data)
+        if not os.path.exists(fp):
+            return None
+        with np.load(fp) as data:
+            arrays = {key: data[key] for key in data.files}
+        return arrays
+
+    def save_mode_data(self, founddx, **arrays):
+        '''
+        Save the data of a normal mode that is needed to remove its contributions again when
+        it was not completed or is computed again (i.e. the oscillator strengths added to the
+        spectra).
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            **arrays: Arrays to save.
+        '''
+        fp = os.path.join(self.path, self._mode_data.format(int(founddx)))
+        _replace(fp, lambda fn: np.savez(fn, **arrays), mode='wb')
+
+    def load_mode_data(self, founddx):
+        '''
+        Load the data of a normal mode saved with :meth:`save_mode_data`.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+
+        Returns:
+            arrays (:obj:`dict`): Saved arrays. :code:`None` if nothing was saved.
+        '''
+        fp = os.path.join(self.path, self._mode_data.format(int(founddx)))
+        if not os.path.exists(fp):
+            return None
+        with np.load(fp) as data:
+            arrays = {key: data[key] for key in data.files}
+        return arrays
+
+    def __init__(self, path, settings, files):
+        self.path = path
+        # make sure that the settings can be compared to those read from the json file
+        self.settings = json.loads(json.dumps(settings))
+        self.files = list(files)
+        self.completed = []
+        self.prefactor = []
+        self.hashes = {}
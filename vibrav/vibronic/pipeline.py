@@ -0,0 +1,150 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Pipelined vibronic coupling calculations
+########################################
+Background threads used by the `pipeline` option of
+:meth:`vibrav.vibronic.Vibronic.vibronic_coupling`. A reader thread loads the Hamiltonian
+derivatives of the next normal modes and a writer thread writes the completed normal modes
+while the current normal mode is computed. The queues between the stages are bounded so only
+a few normal modes are held in memory at any given time.
+'''
+import queue
+import threading
+
+# number of normal modes that can wait between two stages
+queue_size = 2
+
+# marks the end of the items in a queue
+_done = object()
+
+def _put(buf, item, stop):
+    # put an item in the queue unless the consumer has stopped
+    while not stop.is_set():
+        try:
+            buf.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def prefetch(items, size=queue_size):
+    '''
+    Generator that gets the items of an iterable in a background thread. At most `size`
+    items are waiting to be used at any given time. Any exception raised while getting the
+    items is raised again in the calling thread.
+
+    Args:
+        items (:obj:`iterable`): Items to get in the background thread.
+        size (:obj:`int`, optional): Maximum number of items waiting to be used. Defaults to
+                                     `2`.
+
+    Returns:
+        items (:obj:`generator`): Generator of the items in the same order.
+    '''
+    buf = queue.Queue(maxsize=max(int(size), 1))
+    stop = threading.Event()
+    def run():
+        try:
+            for item in items:
+                if not _put(buf, (item, None), stop):
+                    return
+        except BaseException as exc:
+            _put(buf, (_done, exc), stop)
+        else:
+            _put(buf, (_done, None), stop)
+    thread = threading.Thread(target=run, name='vibrav-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = buf.get()
+            if item is _done:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        # stop the thread when the generator is closed before all of the items are used
+        stop.set()
+        thread.join()
+
+class Writer:
+    '''
+    Background thread that calls a function with each of the items put in a bounded queue.
+    The items are handled in the order they were put. An exception raised by the function is
+    raised again in the calling thread by the next :meth:`put` or when closing the writer and
+    the items that are still waiting are dropped.
+
+    Args:
+        func (:obj:`callable`): Function called with each item.
+        size (:obj:`int`, optional): Maximum number of items waiting to be handled. Defaults to
+                                     `2`.
+    '''
+    def put(self, item):
+        '''
+        Put an item in the queue. Waits when the queue is full.
+
+        Args:
+            item: Item to pass to the function.
+        '''
+        self._check()
+        while not _put(self._queue, item, self._failed):
+            self._check()
+
+    def close(self, wait=True):
+        '''
+        Wait for all of the items in the queue to be handled and stop the thread.
+
+        Args:
+            wait (:obj:`bool`, optional): Raise the exception of the function when there was
+                                          one. Defaults to :code:`True`.
+        '''
+        if self._thread.is_alive():
+            _put(self._queue, _done, self._failed)
+            self._thread.join()
+        if wait:
+            self._check()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _done or self._failed.is_set():
+                return
+            try:
+                self.func(item)
+            except BaseException as exc:
+                self._error = exc
+                self._failed.set()
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the exception of the calling thread is not replaced by that of the writer
+        self.close(wait=exc_type is None)
+        return False
+
+    def __init__(self, func, size=queue_size):
+        self.func = func
+        self._queue = queue.Queue(maxsize=max(int(size), 1))
+        self._failed = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='vibrav-writer', daemon=True)
+        self._thread.start()
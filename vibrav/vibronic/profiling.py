@@ -0,0 +1,172 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Profiling of the vibronic coupling calculations
+###############################################
+Record the wall and CPU time of each stage of a vibronic coupling calculation along with the
+bytes written and the peak memory so that they can be written to a JSON file. The CPU time of
+a stage is that of the thread that ran it so that the stages that run at the same time in the
+background threads of the pipeline are not counted more than once. The threads started by the
+linear algebra libraries are not included. The total CPU time is that of the whole process.
+'''
+from contextlib import contextmanager
+from time import perf_counter, process_time, thread_time
+import json
+import os
+import sys
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+def peak_rss(children=False):
+    '''
+    Get the peak resident set size of this process or of its terminated child processes.
+
+    Args:
+        children (:obj:`bool`, optional): Get the largest peak of the child processes.
+                                          Defaults to :code:`False`.
+
+    Returns:
+        rss (:obj:`int`): Peak resident set size in bytes. :code:`None` when it is not
+                          available on the platform.
+    '''
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    # the units are kilobytes on linux and bytes on macos
+    return int(rss) if sys.platform == 'darwin' else int(rss)*1024
+
+def clock():
+    '''
+    Get the current wall and CPU times of the calling thread to be used with :func:`elapsed`.
+
+    Returns:
+        start (:obj:`tuple`): Wall and CPU times in seconds.
+    '''
+    return perf_counter(), thread_time()
+
+def elapsed(start):
+    '''
+    Get the wall and CPU time since :func:`clock` was called. Must be called from the same
+    thread as :func:`clock`.
+
+    Args:
+        start (:obj:`tuple`): Wall and CPU times from :func:`clock`.
+
+    Returns:
+        times (:obj:`tuple`): Elapsed wall and CPU times in seconds.
+    '''
+    return perf_counter() - start[0], thread_time() - start[1]
+
+class Profile:
+    '''
+    Wall and CPU times of the stages of a calculation. Each record has the name of the stage
+    and optionally the zero based index of the normal mode, the component and the number of
+    bytes written.
+    '''
+    @contextmanager
+    def stage(self, name, founddx=None, component=None):
+        '''
+        Context manager to time a stage. The yielded record can be updated with the number of
+        bytes written under the `'bytes'` key.
+
+        Args:
+            name (:obj:`str`): Name of the stage.
+            founddx (:obj:`int`, optional): Zero based index of the normal mode. Defaults to
+                                            :code:`None`.
+            component (:obj:`str`, optional): Component or property. Defaults to
+                                              :code:`None`.
+        '''
+        record = {}
+        start = clock()
+        try:
+            yield record
+        finally:
+            self.add(name, *elapsed(start), founddx=founddx, component=component,
+                     nbytes=record.get('bytes'))
+
+    def add(self, name, wall, cpu=None, founddx=None, component=None, nbytes=None):
+        '''
+        Add a timing record.
+
+        Args:
+            name (:obj:`str`): Name of the stage.
+            wall (:obj:`float`): Wall time in seconds.
+            cpu (:obj:`float`, optional): CPU time in seconds. Defaults to :code:`None`.
+            founddx (:obj:`int`, optional): Zero based index of the normal mode. Defaults to
+                                            :code:`None`.
+            component (:obj:`str`, optional): Component or property. Defaults to
+                                              :code:`None`.
+            nbytes (:obj:`int`, optional): Number of bytes written. Defaults to :code:`None`.
+        '''
+        record = {'stage': name, 'wall': float(wall)}
+        if cpu is not None: record['cpu'] = float(cpu)
+        if founddx is not None: record['mode'] = int(founddx)
+        if component is not None: record['component'] = component
+        if nbytes is not None: record['bytes'] = int(nbytes)
+        self.records.append(record)
+
+    def summary(self):
+        '''
+        Get the totals of each stage.
+
+        Returns:
+            summary (:obj:`dict`): Total wall and CPU time, number of calls and bytes written
+                                   of each stage in the order they were first recorded.
+        '''
+        summary = {}
+        for record in self.records:
+            data = summary.setdefault(record['stage'], {'wall': 0., 'cpu': 0., 'calls': 0,
+                                                        'bytes': 0})
+            data['wall'] += record['wall']
+            data['cpu'] += record.get('cpu', 0.)
+            data['calls'] += 1
+            data['bytes'] += record.get('bytes', 0)
+        return summary
+
+    def to_dict(self):
+        '''
+        Get the profile with the totals, the summary of each stage and all of the records.
+
+        Returns:
+            profile (:obj:`dict`): Profile of the calculation.
+        '''
+        wall = perf_counter() - self._start[0]
+        cpu = process_time() - self._start[1]
+        return {'wall': wall, 'cpu': cpu, 'peak_rss': peak_rss(),
+                'peak_rss_children': peak_rss(children=True),
+                'bytes_written': sum([rec.get('bytes', 0) for rec in self.records]),
+                'stages': self.summary(), 'records': self.records}
+
+    def write(self, fp):
+        '''
+        Write the profile to a JSON file. The file is written to a temporary file first and
+        renamed.
+
+        Args:
+            fp (:obj:`str`): Filepath to write to.
+        '''
+        tmp = fp+'.tmp'
+        with open(tmp, 'w') as fn:
+            json.dump(self.to_dict(), fn, indent=1)
+        os.replace(tmp, fp)
+
+    def __init__(self):
+        # the totals are the wall and CPU time of the whole process
+        self._start = (perf_counter(), process_time())
+        self.records = []
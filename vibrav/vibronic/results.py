@@ -0,0 +1,107 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Vibronic results of a single normal mode
+########################################
+Container for the values that :meth:`vibrav.vibronic.Vibronic.iter_modes` yields for each
+normal mode.
+'''
+import pandas as pd
+
+class ModeResult:
+    '''
+    Vibronic results of a single normal mode. The property values are in the same orientation
+    as the `vib###` files, meaning that the rows are the initial states and the columns are the
+    final states. The first index of the property values is the minus (0) and plus (1)
+    displacement.
+
+    Args:
+        founddx (:obj:`int`): Zero based index of the normal mode.
+        prefactor (:obj:`float`): Transition dipole moment prefactor of the normal mode.
+        evib (:obj:`float`): Vibrational energy of the normal mode in atomic units.
+        properties (:obj:`dict`): Spin-orbit vibronic property values of each property with
+                                  the shape `(2, ncomp, nrow, ncol)`.
+        energies (:obj:`dict`): Vibronic energies of the minus and plus displacements.
+        dham_dq (:obj:`numpy.array`): Derivative of the Hamiltonian with respect to the normal
+                                      mode.
+        sf_properties (:obj:`dict`, optional): Spin-free vibronic property values. Defaults to
+                                               :code:`None`.
+        sf_so_len_properties (:obj:`dict`, optional): Spin-free vibronic property values
+                                                      extended to the number of spin-orbit
+                                                      states. Defaults to :code:`None`.
+        oscil (:obj:`dict`, optional): Compact spin-orbit oscillator arrays of the minus and
+                                       plus displacements from
+                                       :func:`vibrav.numerical.vibronic_func.compute_oscil_compact_temps`.
+                                       Includes the rotatory strengths when they were
+                                       computed. Defaults to :code:`None`.
+        sf_oscil (:obj:`dict`, optional): Compact spin-free oscillator arrays. Defaults to
+                                          :code:`None`.
+        initial (:obj:`numpy.array`, optional): Zero based indeces of the initial spin-orbit
+                                                states. Defaults to :code:`None` (all of the
+                                                states).
+        final (:obj:`numpy.array`, optional): Zero based indeces of the final spin-orbit
+                                              states. Defaults to :code:`None` (all of the
+                                              states).
+        timings (:obj:`dict`, optional): Wall and CPU times in seconds spent in each of the
+                                         steps. Defaults to :code:`None`.
+    '''
+    def get_oscillators(self, sign, tdx=0, sf=False):
+        '''
+        Get the oscillator strengths of a displacement as a data frame.
+
+        Args:
+            sign (:obj:`str`): Displacement sign. Either `'plus'` or `'minus'`.
+            tdx (:obj:`int`, optional): Index of the temperature. Defaults to `0`.
+            sf (:obj:`bool`, optional): Get the spin-free oscillators. Defaults to
+                                        :code:`False`.
+
+        Returns:
+            oscil (:class:`pandas.DataFrame`): One based row and column indeces, isotropic and
+                                               component oscillator strengths and the
+                                               transition energies. Has the `'rotatory'`
+                                               column when the rotatory strengths were
+                                               computed.
+
+        Raises:
+            ValueError: If the oscillators were not computed.
+        '''
+        data = self.sf_oscil if sf else self.oscil
+        if data is None:
+            raise ValueError("The oscillators were not computed.")
+        nrow, ncol, oscil, energy = data[sign][:4]
+        df = pd.DataFrame(oscil[tdx].T, columns=['iso', 'x', 'y', 'z'][:oscil.shape[1]])
+        df.insert(0, 'ncol', ncol)
+        df.insert(0, 'nrow', nrow)
+        df['energy'] = energy
+        if len(data[sign]) > 4:
+            df['rotatory'] = data[sign][4][tdx]
+        return df
+
+    def __init__(self, founddx, prefactor, evib, properties, energies, dham_dq,
+                 sf_properties=None, sf_so_len_properties=None, oscil=None, sf_oscil=None,
+                 initial=None, final=None, timings=None):
+        self.founddx = founddx
+        self.prefactor = prefactor
+        self.evib = evib
+        self.properties = properties
+        self.energies = energies
+        self.dham_dq = dham_dq
+        self.sf_properties = sf_properties
+        self.sf_so_len_properties = sf_so_len_properties
+        self.oscil = oscil
+        self.sf_oscil = sf_oscil
+        self.initial = initial
+        self.final = final
+        self.timings = {} if timings is None else timings
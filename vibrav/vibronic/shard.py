@@ -0,0 +1,235 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Sharded vibronic coupling calculations
+######################################
+Split the normal modes of a vibronic coupling calculation over independent jobs with the
+`shard` parameter of :meth:`vibrav.vibronic.Vibronic.vibronic_coupling` and combine the outputs
+of all of the shards with :func:`merge_shards` into the same files that a single job writes.
+'''
+import numpy as np
+import json
+import os
+import re
+import shutil
+from vibrav.vibronic.checkpoint import _freqdx_col, _replace
+
+# name of the file that marks a shard as completed
+_manifest = 'shard.json'
+
+def parse_shard(shard):
+    '''
+    Get the one based index and the number of shards from the shard specification.
+
+    Args:
+        shard (:obj:`str` or :obj:`tuple`): Shard specification as `'index/count'` (i.e.
+                                            `'3/8'`) or as a tuple `(index, count)`.
+
+    Returns:
+        index (:obj:`int`): One based index of the shard.
+        count (:obj:`int`): Number of shards.
+
+    Raises:
+        ValueError: If the shard specification is not understood or the index is out of range.
+    '''
+    try:
+        if isinstance(shard, str):
+            index, count = shard.split('/')
+        else:
+            index, count = shard
+        index, count = int(index), int(count)
+    except (TypeError, ValueError):
+        raise ValueError("Shard {} not understood, must be given as ".format(shard) \
+                         +"'index/count' (i.e. '3/8').")
+    if count < 1 or index < 1 or index > count:
+        raise ValueError("The shard index must be between 1 and the number of shards, " \
+                         +"got {}/{}.".format(index, count))
+    return index, count
+
+def shard_dir(vib_dir, index, count):
+    '''
+    Get the directory where the outputs of a shard are written.
+
+    Args:
+        vib_dir (:obj:`str`): Output directory of the calculation.
+        index (:obj:`int`): One based index of the shard.
+        count (:obj:`int`): Number of shards.
+
+    Returns:
+        path (:obj:`str`): Directory of the shard.
+    '''
+    return os.path.join(vib_dir, 'shard-{}-of-{}'.format(index, count))
+
+def select_shard(modes, index, count):
+    '''
+    Get the normal modes computed by a shard. The normal modes are distributed in turn so
+    that every shard gets about the same number of them.
+
+    Args:
+        modes (:obj:`list`): Zero based indeces of all of the normal modes.
+        index (:obj:`int`): One based index of the shard.
+        count (:obj:`int`): Number of shards.
+
+    Returns:
+        modes (:obj:`list`): Zero based indeces of the normal modes of the shard.
+    '''
+    return list(modes)[index-1::count]
+
+def write_manifest(path, **data):
+    '''
+    Write the manifest of a completed shard.
+
+    Args:
+        path (:obj:`str`): Directory of the shard.
+        **data: Values to write.
+    '''
+    _replace(os.path.join(path, _manifest), lambda fn: json.dump(data, fn))
+
+def remove_manifest(path):
+    '''
+    Remove the manifest of a shard when it is started again.
+
+    Args:
+        path (:obj:`str`): Directory of the shard.
+    '''
+    fp = os.path.join(path, _manifest)
+    if os.path.exists(fp):
+        os.remove(fp)
+
+def _read_lines(fp):
+    # the appended files have a header line and every other line starts with a newline
+    with open(fp, 'r') as fn:
+        lines = fn.read().split('\n')
+    return lines[0], lines[1:]
+
+def merge_shards(vib_dir='vibronic-outputs', spectrum=None, print_stdout=False):
+    '''
+    Combine the outputs of all of the shards of a vibronic coupling calculation. The lines of
+    the oscillator and rotatory strength files are put in the order of the normal modes of a
+    calculation that is not sharded and the `alpha.txt` and `boltzmann-populations.csv` files
+    are written to the output directory. The groups of each normal mode of the HDF5 stores of
+    the shards are copied to the HDF5 store of the calculation. The `vib###` directories of
+    the text store are already shared by all of the shards.
+
+    Args:
+        vib_dir (:obj:`str`, optional): Output directory of the calculation with the shard
+                                        directories. Defaults to `'vibronic-outputs'`.
+        spectrum (:class:`vibrav.vibronic.spectrum.Spectrum`, optional): Spectrum that was
+                                                 given to the shards. Needed to write the
+                                                 broadened spectrum. Defaults to
+                                                 :code:`None`.
+        print_stdout (:obj:`bool`, optional): Print the progress to stdout. Defaults to
+                                              :code:`False`.
+
+    Returns:
+        completed (:obj:`list`): Zero based indeces of the normal modes in the order they were
+                                 written.
+
+    Raises:
+        ValueError: If no shards are found, a shard is missing or not completed or the shards
+                    were run with different settings.
+    '''
+    found = {}
+    for name in os.listdir(vib_dir):
+        match = re.match(r'^shard-(\d+)-of-(\d+)$', name)
+        if match is not None and os.path.isdir(os.path.join(vib_dir, name)):
+            found[(int(match.group(1)), int(match.group(2)))] = os.path.join(vib_dir, name)
+    if not found:
+        raise ValueError("Could not find any shards in {}.".format(vib_dir))
+    counts = set([count for _, count in found])
+    if len(counts) > 1:
+        raise ValueError("Found shards of different calculations in {} ".format(vib_dir) \
+                         +"with {} shards.".format(sorted(counts)))
+    count = counts.pop()
+    manifests = []
+    for index in range(1, count+1):
+        path = found.get((index, count))
+        fp = None if path is None else os.path.join(path, _manifest)
+        if fp is None or not os.path.exists(fp):
+            raise ValueError("Shard {}/{} is missing or was not completed.".format(index, count))
+        with open(fp, 'r') as fn:
+            manifests.append((path, json.load(fn)))
+    first = manifests[0][1]
+    for path, data in manifests[1:]:
+        if data['settings'] != first['settings'] or data['modes'] != first['modes']:
+            raise ValueError("The shard in {} was run with different settings.".format(path))
+    # the normal modes are written in the order of the calculation that is not sharded
+    position = {int(fdx): idx for idx, fdx in enumerate(first['modes'])}
+    order = lambda fdx: position.get(int(fdx), len(position))
+    completed = []
+    prefactor = {}
+    for _, data in manifests:
+        completed += data['completed']
+        prefactor.update(zip(data['completed'], data['prefactor']))
+    completed = sorted(completed, key=order)
+    for rel in first['files']:
+        header = None
+        lines = []
+        for path, _ in manifests:
+            head, shard_lines = _read_lines(os.path.join(path, rel))
+            if header is None: header = head
+            lines += shard_lines
+        # the order of the lines of each normal mode is not changed
+        lines = sorted(lines, key=lambda line: order(line.split()[_freqdx_col]))
+        fp = os.path.join(vib_dir, rel)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        _replace(fp, lambda fn: fn.write('\n'.join([header]+lines)))
+        if print_stdout:
+            print("Merged {} shards into {}".format(count, fp))
+    # the boltzmann populations do not depend on the normal modes of the shard
+    for rel in first['boltzmann']:
+        shutil.copyfile(os.path.join(manifests[0][0], rel), os.path.join(vib_dir, rel))
+    with open(os.path.join(vib_dir, 'alpha.txt'), 'w') as fn:
+        fn.write('alpha\n')
+        for fdx in completed:
+            fn.write('{:.9f}\n'.format(prefactor[fdx]))
+    if first['spectra']:
+        if spectrum is None:
+            raise ValueError("The spectrum given to the shards is needed to write the " \
+                             +"broadened spectrum.")
+        for rel in first['spectra']:
+            # the running sums of the shards are added together
+            sticks = []
+            modes = []
+            for path, _ in manifests:
+                spectrum.load(os.path.join(path, rel, 'spectrum-sticks.npz'))
+                if spectrum.sticks is not None:
+                    sticks.append(spectrum.sticks)
+                modes += spectrum.modes
+            spectrum.sticks = np.sum(sticks, axis=0) if sticks else None
+            spectrum.modes = sorted(modes, key=order)
+            spectrum.to_csv(os.path.join(vib_dir, rel, 'spectrum.csv'))
+    if first['store'] is not None:
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("The h5py package is needed to merge the HDF5 stores of the " \
+                              +"shards. Install it with `pip install vibrav[hdf5]`.")
+        with h5py.File(first['store'], 'a') as out:
+            for fdx in completed:
+                key = 'vib'+str(fdx+1).zfill(3)
+                for path, data in manifests:
+                    if fdx not in data['completed']:
+                        continue
+                    src_fp = os.path.join(path, os.path.basename(first['store']))
+                    with h5py.File(src_fp, 'r') as src:
+                        if key not in src:
+                            continue
+                        if key in out:
+                            del out[key]
+                        src.copy(src[key], out, name=key)
+        if print_stdout:
+            print("Merged {} shards into {}".format(count, first['store']))
+    return completed
@@ -0,0 +1,238 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Broadened vibronic spectra
+##########################
+Accumulate the vibronic oscillator strengths of each normal mode on an energy grid and
+broaden them with a line shape function at the end. The memory used only depends on the size
+of the energy grid and not on the number of transitions or normal modes.
+'''
+import numpy as np
+import pandas as pd
+import os
+from exatomic.exa.util.units import Energy
+
+def gaussian(x, fwhm):
+    '''
+    Area normalized Gaussian line shape.
+
+    Args:
+        x (:obj:`numpy.array`): Distance from the center of the line.
+        fwhm (:obj:`float`): Full width at half maximum.
+
+    Returns:
+        shape (:obj:`numpy.array`): Line shape values.
+    '''
+    sigma = fwhm/(2*np.sqrt(2*np.log(2)))
+    return np.exp(-x**2/(2*sigma**2))/(sigma*np.sqrt(2*np.pi))
+
+def lorentzian(x, fwhm):
+    '''
+    Area normalized Lorentzian line shape.
+
+    Args:
+        x (:obj:`numpy.array`): Distance from the center of the line.
+        fwhm (:obj:`float`): Full width at half maximum.
+
+    Returns:
+        shape (:obj:`numpy.array`): Line shape values.
+    '''
+    gamma = fwhm/2
+    return gamma/(np.pi*(x**2+gamma**2))
+
+def _fft_convolve(data, kernel):
+    # linear convolution along the last axis with the output centered on the data
+    size = data.shape[-1] + kernel.shape[-1] - 1
+    nfft = 1 << int(np.ceil(np.log2(size)))
+    conv = np.fft.irfft(np.fft.rfft(data, nfft)*np.fft.rfft(kernel, nfft), nfft)
+    start = (kernel.shape[-1] - 1) // 2
+    return conv[..., start:start+data.shape[-1]]
+
+class Spectrum:
+    '''
+    Broadened spectrum of the vibronic oscillator strengths on a uniform energy grid.
+
+    The oscillator strengths are added to the two nearest grid points (linear binning) of a
+    grid that extends past the requested one so that the tails of the lines outside of the
+    grid are included. The line shape is applied with a single FFT convolution when the
+    spectrum is requested. Only the running sum of the binned oscillator strengths and the
+    indeces of the normal modes that were added are kept, so the memory does not grow with the
+    number of normal modes. A normal mode is removed by subtracting the same oscillator
+    strengths again with :meth:`remove`.
+
+    Args:
+        grid (:obj:`numpy.array`): Uniformly spaced energies to compute the spectrum on.
+        fwhm (:obj:`float` or :obj:`tuple`): Full width at half maximum of the line shape. For
+                                             the Voigt line shape the Gaussian and Lorentzian
+                                             widths must be given.
+        shape (:obj:`str`, optional): Line shape. Can be `'gaussian'`, `'lorentzian'` or
+                                      `'voigt'`. Defaults to `'gaussian'`.
+        units (:obj:`str`, optional): Units of the energy grid and widths. Defaults to
+                                      `'cm^-1'`.
+        pad (:obj:`float`, optional): Number of widths to extend the grid by on each side.
+                                      Defaults to `10`.
+
+    Raises:
+        ValueError: If the energy grid is not uniformly spaced.
+        ValueError: If the line shape is not understood.
+    '''
+    _shapes = ['gaussian', 'lorentzian', 'voigt']
+    def _bin(self, energy, oscil):
+        # linear binning of the oscillator strengths on the extended grid
+        npoints = self.sticks_grid.shape[0]
+        pos = (energy*Energy['Ha', self.units] - self.sticks_grid[0])/self.step
+        # drop the transitions that are too far away from the grid
+        keep = (pos >= 0) & (pos < npoints-1)
+        pos = pos[keep]
+        lower = np.floor(pos).astype(np.int64)
+        weight = pos - lower
+        sticks = np.zeros((oscil.shape[0], npoints), dtype=np.float64)
+        for cdx, osc in enumerate(oscil):
+            osc = osc[keep]
+            sticks[cdx] += np.bincount(lower, weights=osc*(1-weight), minlength=npoints)
+            sticks[cdx] += np.bincount(lower+1, weights=osc*weight, minlength=npoints)
+        return sticks
+
+    def add(self, founddx, energy, oscil):
+        '''
+        Add the oscillator strengths of a normal mode to the spectrum.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            energy (:obj:`numpy.array`): Transition energies in atomic units.
+            oscil (:obj:`numpy.array`): Oscillator strengths with the shape `(ncomp, ntrans)`.
+        '''
+        sticks = self._bin(energy, oscil)
+        if self.sticks is None:
+            self.sticks = sticks
+        else:
+            self.sticks += sticks
+        if int(founddx) not in self.modes:
+            self.modes.append(int(founddx))
+
+    def remove(self, founddx, energy, oscil):
+        '''
+        Remove the oscillator strengths of a normal mode that were added with :meth:`add`.
+        The same energies and oscillator strengths must be given.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            energy (:obj:`numpy.array`): Transition energies in atomic units.
+            oscil (:obj:`numpy.array`): Oscillator strengths with the shape `(ncomp, ntrans)`.
+        '''
+        if self.sticks is not None:
+            self.sticks -= self._bin(energy, oscil)
+        if int(founddx) in self.modes:
+            self.modes.remove(int(founddx))
+
+    def _get_kernel(self):
+        npoints = self.sticks_grid.shape[0]
+        x = np.arange(-(npoints-1), npoints)*self.step
+        if self.shape == 'gaussian':
+            kernel = gaussian(x, self.fwhm)
+        elif self.shape == 'lorentzian':
+            kernel = lorentzian(x, self.fwhm)
+        else:
+            gauss, lorentz = self.fwhm
+            kernel = _fft_convolve(lorentzian(x, lorentz), gaussian(x, gauss))*self.step
+        return kernel
+
+    def broaden(self):
+        '''
+        Get the broadened spectrum.
+
+        Returns:
+            spectrum (:class:`pandas.DataFrame`): Energy grid and the broadened spectrum of
+                                                  each of the components.
+        '''
+        npoints = self.sticks_grid.shape[0]
+        if self.sticks is not None:
+            sticks = self.sticks
+        else:
+            sticks = np.zeros((len(self.columns), npoints))
+        spectrum = _fft_convolve(sticks, self._get_kernel())
+        spectrum = spectrum[:, self.npad:self.npad+self.grid.shape[0]]
+        df = pd.DataFrame(spectrum.T, columns=self.columns[:spectrum.shape[0]])
+        df.insert(0, 'energy', self.grid)
+        return df
+
+    def to_csv(self, fp):
+        '''
+        Write the broadened spectrum to a csv file.
+
+        Args:
+            fp (:obj:`str`): Filepath to write to.
+        '''
+        self.broaden().to_csv(fp, index=False, float_format='%.9E')
+
+    def save(self, fp):
+        '''
+        Save the accumulated oscillator strengths and the normal modes that were added. The
+        file is written to a temporary file first and renamed.
+
+        Args:
+            fp (:obj:`str`): Filepath to write to.
+        '''
+        tmp = fp+'.tmp'
+        with open(tmp, 'wb') as fn:
+            arrays = {'modes': np.array(self.modes, dtype=np.int64)}
+            if self.sticks is not None:
+                arrays['sticks'] = self.sticks
+            np.savez(fn, **arrays)
+        os.replace(tmp, fp)
+
+    def load(self, fp):
+        '''
+        Load the accumulated oscillator strengths saved with :meth:`save`.
+
+        Args:
+            fp (:obj:`str`): Filepath to read from.
+        '''
+        with np.load(fp) as data:
+            self.sticks = data['sticks'] if 'sticks' in data.files else None
+            self.modes = data['modes'].tolist()
+
+    def get_settings(self):
+        '''
+        Get the parameters of the spectrum.
+
+        Returns:
+            settings (:obj:`dict`): Parameters of the spectrum.
+        '''
+        return {'grid': [float(self.grid[0]), float(self.grid[-1]), int(self.grid.shape[0])],
+                'fwhm': np.array(self.fwhm, dtype=np.float64).tolist(), 'shape': self.shape,
+                'units': self.units, 'npad': self.npad}
+
+    def __init__(self, grid, fwhm, shape='gaussian', units='cm^-1', pad=10):
+        grid = np.asarray(grid, dtype=np.float64)
+        step = np.diff(grid)
+        if grid.shape[0] < 2 or not np.allclose(step, step[0]):
+            raise ValueError("The energy grid must have at least two uniformly spaced points.")
+        if shape not in self._shapes:
+            raise ValueError("Line shape {} not understood, must be one of {}".format(shape,
+                                                                               self._shapes))
+        if shape == 'voigt' and np.ndim(fwhm) != 1:
+            raise ValueError("The Gaussian and Lorentzian widths must be given for the " \
+                             +"Voigt line shape.")
+        self.grid = grid
+        self.step = step[0]
+        self.fwhm = fwhm
+        self.shape = shape
+        self.units = units
+        self.npad = int(np.ceil(pad*np.max(fwhm)/abs(self.step)))
+        self.sticks_grid = grid[0] + np.arange(-self.npad, grid.shape[0]+self.npad)*self.step
+        self.columns = ['iso', 'x', 'y', 'z']
+        self.sticks = None
+        self.modes = []
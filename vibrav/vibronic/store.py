@@ -0,0 +1,500 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+'''
+Result stores for the vibronic property values
+##############################################
+Writers for the vibronic property values, energies and Hamiltonian derivatives of each normal
+mode. :class:`TxtStore` writes the `vib###/plus|minus` text files and :class:`HDF5Store` writes
+everything to a single HDF5 file. Both have the same methods so they can be used
+interchangeably by :meth:`vibrav.vibronic.Vibronic.vibronic_coupling`. :class:`AsyncStore`
+runs either of them in a background process so the files are formatted and written while the
+next normal mode is computed. The rows of the oscillator files that are appended to after each
+normal mode are written by the stores as well so they are done in the same order.
+'''
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from vibrav.vibronic.checkpoint import _replace
+
+# suffixes of the legacy text files for each of the levels
+_levels = {'so': '', 'sf': '-sf', 'sf-so-len': '-sf-so-len'}
+
+def _mode_dir(founddx):
+    return 'vib'+str(founddx+1).zfill(3)
+
+def write_matrix_txt(fp, data, header, rows=None, cols=None):
+    '''
+    Write the matrix to the text format used in the `vib###` directories. Each line has the
+    one based row and column indeces followed by the real and imaginary values. The row index
+    changes the fastest. The file is written to a temporary file first and renamed so it is
+    never left half written.
+
+    Args:
+        fp (:obj:`str`): Filepath to write to.
+        data (:obj:`numpy.array`): Matrix to write.
+        header (:obj:`str`): Header line of the file.
+        rows (:obj:`numpy.array`, optional): Zero based indeces of the rows when the matrix
+                                             only has some of them. Defaults to :code:`None`.
+        cols (:obj:`numpy.array`, optional): Zero based indeces of the columns when the matrix
+                                             only has some of them. Defaults to :code:`None`.
+
+    Returns:
+        nbytes (:obj:`int`): Number of bytes written.
+    '''
+    nrow, ncol = data.shape
+    rows = np.arange(nrow) if rows is None else np.asarray(rows)
+    cols = np.arange(ncol) if cols is None else np.asarray(cols)
+    initial = np.tile(rows, ncol)+1
+    final = np.repeat(cols, nrow)+1
+    flat = data.flatten(order='F')
+    real = np.real(flat)
+    imag = np.imag(flat)
+    template = "{:6d}  {:6d}  {:>18.9E}  {:>18.9E}\n".format
+    text = header + ''.join([template(nr, nc, re, im)
+                             for nr, nc, re, im in zip(initial, final, real, imag)])
+    _replace(fp, lambda fn: fn.write(text), sync=False)
+    return len(text)
+
+def write_energies_txt(fp, energies):
+    '''
+    Write the vibronic energies to the text format used in the `vib###` directories. The file
+    is written to a temporary file first and renamed.
+
+    Args:
+        fp (:obj:`str`): Filepath to write to.
+        energies (:obj:`numpy.array`): Energies to write.
+
+    Returns:
+        nbytes (:obj:`int`): Number of bytes written.
+    '''
+    text = '# {} (atomic units)\n'.format(energies.shape[0]) \
+           + ''.join(['{:.9E}\n'.format(energy) for energy in energies])
+    _replace(fp, lambda fn: fn.write(text), sync=False)
+    return len(text)
+
+def append_rows_txt(fp, template, columns):
+    '''
+    Append the rows of a table to a text file. Each row starts on a new line as the appended
+    oscillator files do not end with a newline. All of the rows are written at once so the
+    appended size of the file can be recorded by :class:`vibrav.vibronic.checkpoint.Checkpoint`
+    and truncated back to when resuming.
+
+    Args:
+        fp (:obj:`str`): Filepath to append to.
+        template (:obj:`str`): Format string of each row.
+        columns (:obj:`list`): Values of each of the columns. A column with a single value
+                               (i.e. the normal mode index) is used for all of the rows.
+
+    Returns:
+        nbytes (:obj:`int`): Number of bytes written.
+    '''
+    nrows = max([len(col) for col in columns if np.ndim(col) > 0] + [0])
+    columns = [col if np.ndim(col) > 0 else [col]*nrows for col in columns]
+    template = template.format
+    text = ''.join(['\n'+template(*row) for row in zip(*columns)])
+    with open(fp, 'a') as fn:
+        fn.write(text)
+    return len(text)
+
+class TxtStore:
+    '''
+    Write the vibronic results as text files in the `vib###/plus` and `vib###/minus`
+    directories.
+
+    Args:
+        path (:obj:`str`, optional): Directory where the `vib###` directories are created.
+                                     Defaults to :code:`'.'`.
+    '''
+    _headers = {'plus': '{:>5s}  {:>6s}  {:>18s}  {:>18s}\n'.format('#NROW', 'NCOL',
+                                                                   'REAL', 'IMAG'),
+                'minus': '{:>5s}  {:>6s}  {:>10s}  {:>10s}\n'.format('#NROW', 'NCOL',
+                                                                    'REAL', 'IMAG')}
+    def _get_dir(self, founddx, sign=None):
+        if sign is None:
+            dir_name = os.path.join(self.path, _mode_dir(founddx))
+        else:
+            dir_name = os.path.join(self.path, _mode_dir(founddx), sign)
+        os.makedirs(dir_name, 0o755, exist_ok=True)
+        return dir_name
+
+    def write_property(self, founddx, sign, level, name, data, rows=None, cols=None):
+        '''
+        Write the vibronic property values of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            sign (:obj:`str`): Displacement sign. Either `'plus'` or `'minus'`.
+            level (:obj:`str`): Level of the values. Can be `'so'`, `'sf'` or `'sf-so-len'`.
+            name (:obj:`str`): Name of the property (i.e. `'dipole'`).
+            data (:obj:`numpy.array`): Property values with the shape `(ncomp, nrow, ncol)`.
+            rows (:obj:`numpy.array`, optional): Zero based state indeces of the rows when only
+                                                 some of them were computed. Defaults to
+                                                 :code:`None`.
+            cols (:obj:`numpy.array`, optional): Zero based state indeces of the columns when
+                                                 only some of them were computed. Defaults to
+                                                 :code:`None`.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        dir_name = self._get_dir(founddx, sign)
+        nbytes = 0
+        for cdx, comp in enumerate(data):
+            filename = os.path.join(dir_name, name+_levels[level]+'-{}.txt'.format(cdx+1))
+            nbytes += write_matrix_txt(filename, comp, self._headers[sign], rows=rows,
+                                       cols=cols)
+        return nbytes
+
+    def write_energies(self, founddx, sign, energies):
+        '''
+        Write the vibronic energies of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            sign (:obj:`str`): Displacement sign. Either `'plus'` or `'minus'`.
+            energies (:obj:`numpy.array`): Energies to write.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        dir_name = self._get_dir(founddx, sign)
+        return write_energies_txt(os.path.join(dir_name, 'energies.txt'), energies)
+
+    def write_dham_dq(self, founddx, data):
+        '''
+        Write the Hamiltonian derivatives of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            data (:obj:`numpy.array`): Hamiltonian derivative.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        dir_name = self._get_dir(founddx)
+        return write_matrix_txt(os.path.join(dir_name, 'hamiltonian-derivs.txt'), data,
+                                self._headers['minus'])
+
+    def append_rows(self, fp, template, columns):
+        '''
+        Append the rows of a table to a text file such as the oscillator files. See
+        :func:`append_rows_txt`.
+
+        Args:
+            fp (:obj:`str`): Filepath to append to.
+            template (:obj:`str`): Format string of each row.
+            columns (:obj:`list`): Values of each of the columns.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        return append_rows_txt(fp, template, columns)
+
+    def flush(self):
+        '''
+        Nothing to do as each file is complete once it is written.
+        '''
+        pass
+
+    def close(self):
+        pass
+
+    def __init__(self, path='.'):
+        self.path = path
+
+class HDF5Store:
+    '''
+    Write the vibronic results to a single HDF5 file. The datasets are written as whole arrays
+    with the keys,
+
+    - `vib###/{plus,minus}/{so,sf,sf-so-len}/{name}-{component}` for the property values
+    - `vib###/{plus,minus}/energies` for the vibronic energies
+    - `vib###/hamiltonian-derivs` for the Hamiltonian derivatives
+
+    where the first two indeces of the property values and Hamiltonian derivatives are the
+    row and column of the legacy text files. When only some of the rows and columns of the
+    property values were computed their zero based state indeces are kept in the `rows` and
+    `cols` attributes of the datasets.
+
+    Note:
+        Requires the `h5py` package.
+
+    Args:
+        fp (:obj:`str`): Filepath of the HDF5 file.
+        mode (:obj:`str`, optional): File mode passed to :class:`h5py.File`. Defaults to
+                                     :code:`'a'`.
+        compression (:obj:`str`, optional): Compression filter of the datasets. Defaults to
+                                            :code:`'gzip'`. Use :code:`None` for no compression.
+        compression_opts (optional): Options of the compression filter. Defaults to
+                                     :code:`None`.
+    '''
+    def _write(self, key, data):
+        # the number of bytes is that of the uncompressed data
+        if key in self.file:
+            del self.file[key]
+        if self.compression is not None and data.size > 1:
+            self.file.create_dataset(key, data=data, compression=self.compression,
+                                     compression_opts=self.compression_opts)
+        else:
+            self.file.create_dataset(key, data=data)
+        return data.nbytes
+
+    def write_property(self, founddx, sign, level, name, data, rows=None, cols=None):
+        '''
+        Write the vibronic property values of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            sign (:obj:`str`): Displacement sign. Either `'plus'` or `'minus'`.
+            level (:obj:`str`): Level of the values. Can be `'so'`, `'sf'` or `'sf-so-len'`.
+            name (:obj:`str`): Name of the property (i.e. `'dipole'`).
+            data (:obj:`numpy.array`): Property values with the shape `(ncomp, nrow, ncol)`.
+            rows (:obj:`numpy.array`, optional): Zero based state indeces of the rows when only
+                                                 some of them were computed. Defaults to
+                                                 :code:`None`.
+            cols (:obj:`numpy.array`, optional): Zero based state indeces of the columns when
+                                                 only some of them were computed. Defaults to
+                                                 :code:`None`.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        if level not in _levels:
+            raise ValueError("Level {} not understood, must be one of {}".format(level,
+                                                                              list(_levels)))
+        nbytes = 0
+        for cdx, comp in enumerate(data):
+            key = '/'.join([_mode_dir(founddx), sign, level, name+'-{}'.format(cdx+1)])
+            nbytes += self._write(key, comp)
+            # the state indeces are kept with the dataset
+            for attr, val in zip(['rows', 'cols'], [rows, cols]):
+                if val is not None:
+                    self.file[key].attrs[attr] = np.asarray(val, dtype=np.int64)
+        return nbytes
+
+    def write_energies(self, founddx, sign, energies):
+        '''
+        Write the vibronic energies of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            sign (:obj:`str`): Displacement sign. Either `'plus'` or `'minus'`.
+            energies (:obj:`numpy.array`): Energies to write.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        return self._write('/'.join([_mode_dir(founddx), sign, 'energies']), energies)
+
+    def write_dham_dq(self, founddx, data):
+        '''
+        Write the Hamiltonian derivatives of a normal mode.
+
+        Args:
+            founddx (:obj:`int`): Zero based index of the normal mode.
+            data (:obj:`numpy.array`): Hamiltonian derivative.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        return self._write('/'.join([_mode_dir(founddx), 'hamiltonian-derivs']), data)
+
+    def append_rows(self, fp, template, columns):
+        '''
+        Append the rows of a table to a text file. The oscillator files are text files with
+        either store. See :func:`append_rows_txt`.
+
+        Args:
+            fp (:obj:`str`): Filepath to append to.
+            template (:obj:`str`): Format string of each row.
+            columns (:obj:`list`): Values of each of the columns.
+
+        Returns:
+            nbytes (:obj:`int`): Number of bytes written.
+        '''
+        return append_rows_txt(fp, template, columns)
+
+    def read(self, key):
+        '''
+        Read a dataset from the store.
+
+        Args:
+            key (:obj:`str`): Key of the dataset.
+
+        Returns:
+            data (:obj:`numpy.array`): Data in the dataset.
+        '''
+        return self.file[key][()]
+
+    def to_txt(self, path='.'):
+        '''
+        Write the contents of the store in the legacy `vib###/plus|minus` text layout.
+
+        Args:
+            path (:obj:`str`, optional): Directory where the `vib###` directories are created.
+                                         Defaults to :code:`'.'`.
+        '''
+        txt = TxtStore(path)
+        for mode_dir in sorted(self.file.keys()):
+            founddx = int(mode_dir.replace('vib', ''))-1
+            for key, item in self.file[mode_dir].items():
+                if key == 'hamiltonian-derivs':
+                    txt.write_dham_dq(founddx, item[()])
+                    continue
+                sign = key
+                for level, group in item.items():
+                    if level == 'energies':
+                        txt.write_energies(founddx, sign, group[()])
+                        continue
+                    for name, dset in group.items():
+                        name, cdx = name.rsplit('-', 1)
+                        dir_name = txt._get_dir(founddx, sign)
+                        filename = os.path.join(dir_name, name+_levels[level]+'-{}.txt'.format(cdx))
+                        write_matrix_txt(filename, dset[()], txt._headers[sign],
+                                         rows=dset.attrs.get('rows'), cols=dset.attrs.get('cols'))
+
+    def flush(self):
+        '''
+        Write the buffered datasets to the file.
+        '''
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, fp, mode='a', compression='gzip', compression_opts=None):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("The h5py package is needed to write the vibronic results to an " \
+                              +"HDF5 file. Install it with `pip install vibrav[hdf5]`.")
+        self.file = h5py.File(fp, mode)
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+# store of the background process of an asynchronous store
+_async_store = None
+
+def _open_async(cls, args, kwargs):
+    global _async_store
+    _async_store = cls(*args, **kwargs)
+
+def _call_async(method, args, kwargs):
+    return getattr(_async_store, method)(*args, **kwargs)
+
+class AsyncStore:
+    '''
+    Write the vibronic results with a :class:`TxtStore` or :class:`HDF5Store` that is opened in
+    a background process. The arrays are sent to the process and the methods return right away
+    so the formatting and the disk I/O are done while the next normal mode is computed. The
+    writes are done in the order they were made and at most `size` of them are waiting at any
+    given time. Any exception raised in the background process is raised again by the next
+    method call.
+
+    Note:
+        The methods that write the results return :code:`None` as the number of bytes is only
+        known once they have been written. The total is kept in the `nbytes` attribute.
+
+    Args:
+        cls (:obj:`type`): Store to open in the background process. Either :class:`TxtStore`
+                           or :class:`HDF5Store`.
+        *args: Positional arguments of the store.
+        size (:obj:`int`, optional): Maximum number of writes waiting to be done. Defaults to
+                                     `8`.
+        **kwargs: Keyword arguments of the store.
+    '''
+    def _collect(self, future):
+        nbytes = future.result()
+        if nbytes is not None:
+            self.nbytes += nbytes
+
+    def _submit(self, method, *args, **kwargs):
+        # wait for the oldest writes when too many are waiting
+        while len(self._pending) >= self.size:
+            self._collect(self._pending.pop(0))
+        self._pending.append(self._pool.submit(_call_async, method, args, kwargs))
+
+    def write_property(self, founddx, sign, level, name, data, rows=None, cols=None):
+        '''
+        Write the vibronic property values of a normal mode. See
+        :meth:`TxtStore.write_property`.
+        '''
+        self._submit('write_property', founddx, sign, level, name, np.asarray(data),
+                     rows=rows, cols=cols)
+
+    def write_energies(self, founddx, sign, energies):
+        '''
+        Write the vibronic energies of a normal mode. See :meth:`TxtStore.write_energies`.
+        '''
+        self._submit('write_energies', founddx, sign, np.asarray(energies))
+
+    def write_dham_dq(self, founddx, data):
+        '''
+        Write the Hamiltonian derivatives of a normal mode. See
+        :meth:`TxtStore.write_dham_dq`.
+        '''
+        # copy the values of memory-mapped arrays
+        self._submit('write_dham_dq', founddx, np.array(data))
+
+    def append_rows(self, fp, template, columns):
+        '''
+        Append the rows of a table to a text file. See :meth:`TxtStore.append_rows`.
+        '''
+        self._submit('append_rows', fp, template,
+                     [np.asarray(col) if np.ndim(col) > 0 else col for col in columns])
+
+    def flush(self):
+        '''
+        Wait for all of the writes to be done.
+        '''
+        while self._pending:
+            self._collect(self._pending.pop(0))
+        self._collect(self._pool.submit(_call_async, 'flush', (), {}))
+
+    def close(self):
+        '''
+        Wait for all of the writes to be done and close the store and the background process.
+        '''
+        if self._pool is None:
+            return
+        try:
+            self.flush()
+            self._collect(self._pool.submit(_call_async, 'close', (), {}))
+        finally:
+            # the writes that have not started are not done when there was an error
+            for future in self._pending:
+                future.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, cls, *args, size=8, **kwargs):
+        self.size = max(int(size), 1)
+        self.nbytes = 0
+        self._pending = []
+        self._pool = ProcessPoolExecutor(max_workers=1, initializer=_open_async,
+                                         initargs=(cls, args, kwargs))
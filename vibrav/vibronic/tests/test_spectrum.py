@@ -0,0 +1,61 @@
+# This file is part of vibrav.
+#
+# vibrav is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# vibrav is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
+from vibrav.vibronic.spectrum import Spectrum, gaussian, lorentzian
+from exatomic.exa.util.units import Energy
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize('shape', ['gaussian', 'lorentzian'])
+def test_spectrum_broaden(shape):
+    grid = np.linspace(1000, 2000, 501)
+    rand = np.random.RandomState(3)
+    # put the transitions on the grid points so the binning is exact
+    centers = grid[rand.randint(0, grid.shape[0], 50)]
+    oscil = rand.rand(4, 50)
+    spec = Spectrum(grid, 20, shape=shape)
+    spec.add(0, centers[:25]*Energy['cm^-1', 'Ha'], oscil[:,:25])
+    spec.add(1, centers[25:]*Energy['cm^-1', 'Ha'], oscil[:,25:])
+    func = gaussian if shape == 'gaussian' else lorentzian
+    ref = np.array([np.sum(osc*func(grid.reshape(-1, 1) - centers, 20), axis=1)
+                    for osc in oscil])
+    test = spec.broaden()
+    assert np.allclose(test['energy'].values, grid)
+    # the lorentzian tails that are outside of the padding are missing
+    assert np.allclose(test[['iso', 'x', 'y', 'z']].values.T, ref, rtol=1e-3,
+                       atol=1e-6*ref.max())
+    # only the running sum is kept
+    assert spec.sticks.shape == (4, spec.sticks_grid.shape[0])
+    assert spec.modes == [0, 1]
+    spec.remove(1, centers[25:]*Energy['cm^-1', 'Ha'], oscil[:,25:])
+    assert spec.modes == [0]
+    ref = np.array([np.sum(osc*func(grid.reshape(-1, 1) - centers[:25], 20), axis=1)
+                    for osc in oscil[:,:25]])
+    test = spec.broaden()
+    assert np.allclose(test[['iso', 'x', 'y', 'z']].values.T, ref, rtol=1e-3,
+                       atol=1e-6*ref.max())
+
+def test_spectrum_voigt():
+    grid = np.linspace(0, 4000, 4001)
+    energy = np.array([1500.3, 2500.7])*Energy['cm^-1', 'Ha']
+    oscil = np.array([[1.0, 2.0]])
+    spec = Spectrum(grid, (15, 5), shape='voigt', pad=50)
+    spec.add(0, energy, oscil)
+    test = spec.broaden()
+    # the area is conserved
+    assert np.isclose(np.trapz(test['iso'], grid), 3, rtol=1e-2)
+    with pytest.raises(ValueError):
+        Spectrum(grid, 15, shape='voigt')
+    with pytest.raises(ValueError):
+        Spectrum(np.array([0, 1, 3]), 15)
@@ -13,11 +13,15 @@
 # You should have received a copy of the GNU General Public License
 # along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
 from vibrav.vibronic import Vibronic
+from vibrav.vibronic.vibronic import _compute_mode
+from vibrav.vibronic import vibronic
+from vibrav.vibronic.pipeline import prefetch, Writer
 from vibrav.base import resource
 from vibrav.util.io import open_txt
 import numpy as np
 import pandas as pd
 import tarfile
+import json
 import os
 import shutil
 import pytest
@@ -82,3 +86,781 @@ def test_vibronic_coupling(freqdx):
     os.chdir(parent)
     shutil.rmtree('molcas-ucl6-2minus-vibronic-coupling')
 
+
+def _extract_vibronic_coupling():
+    with tarfile.open(resource('molcas-ucl6-2minus-vibronic-coupling.tar.xz'), 'r:xz') as tar:
+        for member in tar.getmembers():
+            path = os.path.abspath(os.path.join('.', member.name))
+            if os.path.commonprefix([os.path.abspath('.'), path]) != os.path.abspath('.'):
+                raise Exception("Attempted Path Traversal in Tar File")
+        tar.extractall('.')
+
+@pytest.fixture
+def vib(tmp_path, monkeypatch):
+    # the outputs are written in the extracted directory of a temporary path so the working
+    # directory is restored and nothing is left behind when a test fails
+    monkeypatch.chdir(tmp_path)
+    _extract_vibronic_coupling()
+    monkeypatch.chdir('molcas-ucl6-2minus-vibronic-coupling')
+    return Vibronic(config_file='va.conf')
+
+def test_vibronic_coupling_n_jobs(vib):
+    texts = []
+    for n_jobs in [1, 2]:
+        vib.vibronic_coupling(property='electric_dipole', print_stdout=False, temp=298,
+                              write_property=False, write_oscil=True, boltz_states=2,
+                              write_energy=False, verbose=False, eq_cont=False,
+                              select_fdx=[1,7,8], n_jobs=n_jobs)
+        with open(os.path.join('vibronic-outputs', 'oscillators-0.txt'), 'r') as fn:
+            texts.append(fn.read())
+    assert texts[0] == texts[1]
+
+def test_vibronic_coupling_store(vib):
+    pytest.importorskip('h5py')
+    from vibrav.vibronic.store import HDF5Store
+    kwargs = dict(property='electric_dipole', print_stdout=False, temp=298,
+                  write_property=True, write_sf_property=True, write_dham_dq=True,
+                  write_oscil=False, boltz_states=2, select_fdx=[3])
+    vib.vibronic_coupling(**kwargs)
+    vib.vibronic_coupling(store='vibronic.h5', **kwargs)
+    with HDF5Store('vibronic.h5', mode='r') as store:
+        test = store.read('vib004/plus/so/dipole-2')
+        base = open_txt(os.path.join('vib004', 'plus', 'dipole-2.txt')).values
+        assert np.allclose(test, base)
+        store.to_txt('converted')
+    for root, _, files in os.walk('vib004'):
+        for file in files:
+            with open(os.path.join(root, file), 'r') as fn:
+                base = fn.read()
+            with open(os.path.join('converted', root, file), 'r') as fn:
+                test = fn.read()
+            assert base == test
+
+def test_vibronic_coupling_resume(monkeypatch, vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, temp=298,
+                  write_property=False, write_oscil=True, write_sf_oscil=True,
+                  boltz_states=2, write_energy=False, select_fdx=[1,7,8])
+    files = ['oscillators-{}.txt'.format(idx) for idx in range(4)] \
+            + ['oscillators-sf-{}.txt'.format(idx) for idx in range(4)] + ['alpha.txt']
+    vib.vibronic_coupling(**kwargs)
+    base = []
+    for file in files:
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            base.append(fn.read())
+    # interrupt the calculation after the oscillators of the last mode are partially written
+    write_oscillators = Vibronic._write_oscillators
+    def interrupt(oscil, founddx, *args, **kwargs):
+        write_oscillators(oscil, founddx, *args, **kwargs)
+        if founddx == 8:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(Vibronic, '_write_oscillators', staticmethod(interrupt))
+    with pytest.raises(KeyboardInterrupt):
+        vib.vibronic_coupling(checkpoint=True, **kwargs)
+    monkeypatch.setattr(Vibronic, '_write_oscillators', staticmethod(write_oscillators))
+    with pytest.raises(ValueError):
+        vib.vibronic_coupling(resume=True, **dict(kwargs, temp=300))
+    vib.vibronic_coupling(resume=True, **kwargs)
+    for file, text in zip(files, base):
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            assert fn.read() == text
+
+def test_vibronic_coupling_incremental(monkeypatch, vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, temp=298,
+                  write_property=False, write_oscil=True, boltz_states=2,
+                  write_energy=False, select_fdx=[1,7,8])
+    files = ['oscillators-{}.txt'.format(idx) for idx in range(4)] + ['alpha.txt']
+    vib.vibronic_coupling(incremental=True, **kwargs)
+    # change the hamiltonian of a single displaced structure
+    fp = os.path.join('confg008', 'ham-sf.txt')
+    with open(fp, 'r') as fn:
+        text = fn.read()
+    with open(fp, 'w') as fn:
+        fn.write(text.replace('-0.4712051918377672E-06', '-0.5712051918377672E-06'))
+    computed = []
+    write_oscillators = Vibronic._write_oscillators
+    def count(oscil, founddx, *args, **kwargs):
+        computed.append(founddx)
+        write_oscillators(oscil, founddx, *args, **kwargs)
+    monkeypatch.setattr(Vibronic, '_write_oscillators', staticmethod(count))
+    vib.vibronic_coupling(incremental=True, **kwargs)
+    monkeypatch.setattr(Vibronic, '_write_oscillators', staticmethod(write_oscillators))
+    assert computed == [7]
+    test = []
+    for file in files:
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            test.append(fn.read())
+    vib.vibronic_coupling(**kwargs)
+    for file, text in zip(files, test):
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            assert fn.read() == text
+
+def test_vibronic_coupling_multi_property(vib):
+    kwargs = dict(print_stdout=False, temp=298, write_property=True, write_oscil=True,
+                  boltz_states=2, select_fdx=[2])
+    properties = ['electric_dipole', 'magnetic_dipole', 'electric_quadrupole']
+    vib.vibronic_coupling(property=properties, **kwargs)
+    shutil.move('vib003', 'multi')
+    shutil.move(os.path.join('vibronic-outputs', 'oscillators-0.txt'), 'multi')
+    for prop in properties:
+        vib.vibronic_coupling(property=prop, **kwargs)
+    for file in os.listdir(os.path.join('vib003', 'plus')):
+        if file == 'energies.txt': continue
+        for sign in ['minus', 'plus']:
+            base = open_txt(os.path.join('vib003', sign, file)).values
+            test = open_txt(os.path.join('multi', sign, file)).values
+            assert np.allclose(base, test, rtol=1e-10, atol=1e-12*np.abs(base).max())
+    with open(os.path.join('vibronic-outputs', 'oscillators-0.txt'), 'r') as fn:
+        base = fn.read()
+    with open(os.path.join('multi', 'oscillators-0.txt'), 'r') as fn:
+        test = fn.read()
+    assert base == test
+
+def test_vibronic_coupling_temps(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=False,
+                  write_oscil=True, write_sf_oscil=True, boltz_states=2, select_fdx=[1,7])
+    temps = [100, 298, 500.5]
+    vib.vibronic_coupling(temp=temps, **kwargs)
+    files = ['oscillators-{}.txt'.format(idx) for idx in range(4)] \
+            + ['oscillators-sf-{}.txt'.format(idx) for idx in range(4)] \
+            + ['boltzmann-populations.csv']
+    for temp in temps:
+        vib.vibronic_coupling(temp=temp, **kwargs)
+        for file in files:
+            with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+                base = fn.read()
+            with open(os.path.join('vibronic-outputs', '{:g}K'.format(temp), file), 'r') as fn:
+                test = fn.read()
+            assert base == test
+
+def test_vibronic_coupling_spectrum(vib):
+    from vibrav.vibronic.spectrum import Spectrum
+    grid = np.linspace(0, 30000, 3001)
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=False,
+                  boltz_states=2, select_fdx=[1,7])
+    vib.vibronic_coupling(write_oscil=True, **kwargs)
+    oscil = []
+    for idx in range(4):
+        df = pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx)),
+                         delim_whitespace=True)
+        oscil.append(df)
+    vib.vibronic_coupling(write_oscil=False, spectrum=Spectrum(grid, 300), **kwargs)
+    test = pd.read_csv(os.path.join('vibronic-outputs', 'spectrum.csv'))
+    assert np.allclose(test['energy'], grid)
+    for idx, col in enumerate(['iso', 'x', 'y', 'z']):
+        spec = Spectrum(grid, 300)
+        spec.add(0, oscil[idx]['ENERGY'].values, oscil[idx]['OSCIL'].values.reshape(1, -1))
+        spec = spec.broaden()['iso'].values
+        assert np.allclose(test[col].values, spec, rtol=1e-6, atol=1e-9*spec.max())
+
+def test_vibronic_coupling_spectrum_resume(monkeypatch, vib):
+    from vibrav.vibronic.spectrum import Spectrum
+    from vibrav.vibronic.checkpoint import Checkpoint
+    grid = np.linspace(0, 30000, 3001)
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_oscil=False,
+                  boltz_states=2, select_fdx=[1,7,8])
+    read = lambda: pd.read_csv(os.path.join('vibronic-outputs', 'spectrum.csv')).values
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), **kwargs)
+    base = read()
+    # interrupt the calculation after the spectrum with the last mode was saved
+    update = Checkpoint.update
+    def interrupt(self, founddx, *args, **kwargs):
+        if founddx == 8:
+            raise KeyboardInterrupt
+        update(self, founddx, *args, **kwargs)
+    monkeypatch.setattr(Checkpoint, 'update', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        vib.vibronic_coupling(spectrum=Spectrum(grid, 300), checkpoint=True, **kwargs)
+    monkeypatch.setattr(Checkpoint, 'update', update)
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), resume=True, **kwargs)
+    assert np.allclose(read(), base, rtol=1e-10, atol=1e-12*np.abs(base).max())
+    # the old contributions of the normal modes with changed inputs are removed
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), incremental=True, **kwargs)
+    old = read()
+    shutil.copyfile(os.path.join('confg003', 'ham-sf.txt'), os.path.join('confg008', 'ham-sf.txt'))
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), incremental=True, **kwargs)
+    test = read()
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), **kwargs)
+    base = read()
+    assert not np.allclose(old, base, rtol=1e-10, atol=1e-12*np.abs(base).max())
+    assert np.allclose(test, base, rtol=1e-10, atol=1e-12*np.abs(base).max())
+
+def test_vibronic_coupling_sparse(vib):
+    pytest.importorskip('scipy')
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=False, boltz_states=2, select_fdx=[3])
+    vib.vibronic_coupling(sparse_eigvectors=False, **kwargs)
+    base = [open_txt(os.path.join('vib004', 'plus', 'dipole-{}.txt'.format(idx))).values
+            for idx in range(1, 4)]
+    for n_jobs in [1, 2]:
+        vib.vibronic_coupling(sparse_eigvectors=True, n_jobs=n_jobs, **kwargs)
+        for idx in range(1, 4):
+            test = open_txt(os.path.join('vib004', 'plus', 'dipole-{}.txt'.format(idx))).values
+            atol = 1e-12*np.abs(base[idx-1]).max()
+            assert np.allclose(test, base[idx-1], rtol=1e-8, atol=atol)
+    # the timings of both transformations of the first normal mode are in the profile
+    for sparse_eigvectors in [False, True]:
+        vib.vibronic_coupling(sparse_eigvectors=sparse_eigvectors, verbose=True, profile=True,
+                              **kwargs)
+        with open(os.path.join('vibronic-outputs', 'profile.json'), 'r') as fn:
+            stages = json.load(fn)['stages']
+        used = 'so-transform-'+('sparse' if sparse_eigvectors else 'dense')
+        assert stages[used]['wall'] == stages['so-transform']['wall']
+        for stage in ['so-transform-dense', 'so-transform-sparse']:
+            assert stages[stage]['calls'] == 1
+
+def test_vibronic_coupling_window(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=True, boltz_states=2, select_fdx=[1,7])
+    vib.vibronic_coupling(**kwargs)
+    base_oscil = [pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx)),
+                              delim_whitespace=True) for idx in range(4)]
+    base_prop = pd.read_csv(os.path.join('vib002', 'plus', 'dipole-1.txt'),
+                            delim_whitespace=True)
+    energies = vib._parse_zero_order(['electric-dipole'])[2]
+    vib.config['initial_states'] = 3
+    vib.config['final_energy_min'] = 0.01
+    vib.config['final_energy_max'] = 0.05
+    vib.vibronic_coupling(**kwargs)
+    initial, final = vib._get_windows(energies, 3, 0.01, 0.05, vib.config.degen_delta)
+    # the ground state manifold is not split
+    assert initial.shape[0] >= 3
+    others = np.setdiff1d(np.arange(energies.shape[0]), initial)
+    assert np.all(energies[others] > energies[initial].max() + vib.config.degen_delta)
+    for idx in range(4):
+        test = pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx)),
+                           delim_whitespace=True)
+        base = base_oscil[idx]
+        keep = base['#NROW'].isin(initial+1) & base['NCOL'].isin(final+1)
+        assert test.shape[0] > 0
+        assert np.all(test[['#NROW', 'NCOL', 'FREQDX']].values \
+                      == base.loc[keep, ['#NROW', 'NCOL', 'FREQDX']].values)
+        assert np.allclose(test['OSCIL'].values, base.loc[keep, 'OSCIL'].values)
+    test = pd.read_csv(os.path.join('vib002', 'plus', 'dipole-1.txt'), delim_whitespace=True)
+    assert test.shape[0] == initial.shape[0]*final.shape[0]
+    assert np.all(test['#NROW'].isin(initial+1)) and np.all(test['NCOL'].isin(final+1))
+    index = list(zip(test['#NROW'], test['NCOL']))
+    base_prop = base_prop.set_index(['#NROW', 'NCOL']).loc[index]
+    assert np.allclose(test['REAL'].values, base_prop['REAL'].values)
+    assert np.allclose(test['IMAG'].values, base_prop['IMAG'].values)
+
+
+def test_iter_modes(vib):
+    vib.vibronic_coupling(property='electric_dipole', print_stdout=False, write_property=True,
+                          write_oscil=True, boltz_states=2, select_fdx=[1,7])
+    oscil = pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-0.txt'),
+                        delim_whitespace=True)
+    modes = vib.iter_modes('electric_dipole', boltz_states=2, select_fdx=[1,7])
+    assert len(vib.boltz) == 1
+    founddx = []
+    for result in modes:
+        founddx.append(result.founddx)
+        vib_dir = 'vib{:03d}'.format(result.founddx+1)
+        for idx, sign in enumerate(['minus', 'plus']):
+            values = result.properties['electric-dipole'][idx]
+            assert values.shape == (3, vib.nstates, vib.nstates)
+            for cdx in range(3):
+                fp = os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(cdx+1))
+                base = open_txt(fp).values
+                assert np.allclose(values[cdx], base, atol=1e-9*np.abs(base).max())
+            df = result.get_oscillators(sign)
+            df = df[(df['iso'] > 0) & (df['energy'] > 0)]
+            base = oscil[(oscil['FREQDX'] == result.founddx) & (oscil['SIGN'] == sign)]
+            assert np.all(df['nrow'].values == base['#NROW'].values)
+            assert np.all(df['ncol'].values == base['NCOL'].values)
+            assert np.allclose(df['iso'].values, base['OSCIL'].values)
+        assert result.sf_oscil is None
+        assert 'compute' in result.timings
+    assert founddx == [1, 7]
+
+def test_vibronic_estimate(vib):
+    kwargs = dict(select_fdx=[1,7], write_sf_oscil=True, write_dham_dq=True)
+    est = vib.estimate(print_stdout=False, **kwargs)
+    vib.vibronic_coupling(property='electric_dipole', print_stdout=False, boltz_states=2,
+                          **kwargs)
+    df = est.to_frame().set_index(['kind', 'item'])['value']
+    size = lambda files: sum([os.path.getsize(fp) for fp in files])
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in ['vib002', 'vib008'] for sign in ['minus', 'plus']
+             for idx in range(1, 4)]
+    assert np.isclose(df[('output', 'vibronic property values')], size(files), rtol=1e-2)
+    files = [os.path.join(vib_dir, 'hamiltonian-derivs.txt') for vib_dir in ['vib002', 'vib008']]
+    assert np.isclose(df[('output', 'hamiltonian derivatives')], size(files), rtol=1e-2)
+    # the number of oscillators is an upper bound
+    files = [os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx))
+             for idx in range(4)]
+    assert df[('output', 'oscillators')] >= size(files)
+    # only the initial states are transformed
+    vib.config['initial_states'] = 4
+    small = vib.estimate(print_stdout=False, **kwargs)
+    assert small.total('flops') < est.total('flops')
+    assert small.total('output') < est.total('output')
+    # the final states in the window are counted from the spin-orbit energies file
+    energies = vib._parse_zero_order(['electric-dipole'])[2]
+    np.savetxt('energies-so.txt', energies, header='so energies')
+    final = vib._get_windows(energies, None, 0.01, 0.05, vib.config.degen_delta)[1]
+    assert vib._count_window('energies-so.txt', 0.01, 0.05) == final.shape[0]
+    vib.config['so_energies_file'] = 'energies-so.txt'
+    vib.config['final_energy_min'] = 0.01
+    vib.config['final_energy_max'] = 0.05
+    window = vib.estimate(print_stdout=False, **kwargs)
+    assert window.total('flops') < small.total('flops')
+    with pytest.raises(ValueError):
+        vib._count_window('energies-so.txt', 10, 20)
+    with pytest.warns(Warning):
+        vib.estimate(print_stdout=False, disk_budget=1024, **kwargs)
+
+def test_vibronic_profile(vib):
+    vib.vibronic_coupling(property='electric_dipole', print_stdout=False, boltz_states=2,
+                          select_fdx=[1,7], write_dham_dq=True, profile=True)
+    with open(os.path.join('vibronic-outputs', 'profile.json'), 'r') as fn:
+        profile = json.load(fn)
+    stages = profile['stages']
+    for stage in ['config-parse', 'zero-order-parse', 'hamiltonian-read', 'sos-kernel',
+                  'so-transform', 'hermiticity-check', 'write-property', 'write-energies',
+                  'write-dham-dq', 'write-oscillators']:
+        assert stage in stages
+        assert stages[stage]['wall'] >= 0
+    # one record per normal mode for the kernels and per component for the oscillators
+    assert stages['sos-kernel']['calls'] == 2
+    assert stages['write-oscillators']['calls'] == 2*2*4
+    records = [rec for rec in profile['records'] if rec['stage'] == 'write-oscillators']
+    assert set([rec['mode'] for rec in records]) == set([1, 7])
+    assert set([rec['component'] for rec in records]) == set(['iso', 'x', 'y', 'z'])
+    # the bytes written are those of the files
+    size = lambda files: sum([os.path.getsize(fp) for fp in files])
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in ['vib002', 'vib008'] for sign in ['minus', 'plus']
+             for idx in range(1, 4)]
+    assert stages['write-property']['bytes'] == size(files)
+    files = [os.path.join(vib_dir, 'hamiltonian-derivs.txt') for vib_dir in ['vib002', 'vib008']]
+    assert stages['write-dham-dq']['bytes'] == size(files)
+    assert profile['bytes_written'] >= size(files)
+    if profile['peak_rss'] is not None:
+        assert profile['peak_rss'] > 0
+
+def test_vibronic_coupling_rotatory(vib):
+    kwargs = dict(print_stdout=False, write_property=True, boltz_states=2, select_fdx=[1,7])
+    vib.vibronic_coupling(property='magnetic_dipole', write_oscil=False, **kwargs)
+    for vib_dir in ['vib002', 'vib008']:
+        shutil.move(vib_dir, vib_dir+'-mag')
+    vib.vibronic_coupling(property='electric_dipole', write_rotatory=True, **kwargs)
+    # only the requested property is written
+    assert not os.path.exists(os.path.join('vib002', 'plus', 'angmom-1.txt'))
+    oscil = pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-0.txt'),
+                        delim_whitespace=True)
+    rot = pd.read_csv(os.path.join('vibronic-outputs', 'rotatory.txt'), delim_whitespace=True)
+    boltz = pd.read_csv(os.path.join('vibronic-outputs', 'boltzmann-populations.csv'))
+    # same transitions as the isotropic oscillators
+    for col in ['#NROW', 'NCOL', 'ENERGY', 'FREQDX', 'SIGN']:
+        assert np.all(rot[col].values == oscil[col].values)
+    for founddx in [1, 7]:
+        vib_dir = 'vib{:03d}'.format(founddx+1)
+        for sign in ['minus', 'plus']:
+            dip = np.array([open_txt(os.path.join(vib_dir, sign,
+                                                  'dipole-{}.txt'.format(idx))).values
+                            for idx in range(1, 4)])
+            ang = np.array([open_txt(os.path.join(vib_dir+'-mag', sign,
+                                                  'angmom-{}.txt'.format(idx))).values
+                            for idx in range(1, 4)])
+            dot = np.real(np.sum(dip*np.conj(ang), axis=0))
+            df = rot[(rot['FREQDX'] == founddx) & (rot['SIGN'] == sign)]
+            ref = -0.5*boltz.loc[founddx, sign]*dot[df['#NROW'].values-1,
+                                                     df['NCOL'].values-1]
+            assert np.allclose(df['ROTATORY'].values, ref, rtol=1e-6,
+                               atol=1e-6*np.abs(ref).max())
+    # the electric dipole is only used for the rotatory strengths so none of its oscillator
+    # outputs are written
+    for name in os.listdir('vibronic-outputs'):
+        if name.startswith('oscillators'):
+            os.remove(os.path.join('vibronic-outputs', name))
+    vib.vibronic_coupling(property='magnetic_dipole', write_rotatory=True, write_sf_oscil=True,
+                          write_manifold_oscil=True, **kwargs)
+    assert not [name for name in os.listdir('vibronic-outputs')
+                if name.startswith('oscillators')]
+    test = pd.read_csv(os.path.join('vibronic-outputs', 'rotatory.txt'), delim_whitespace=True)
+    assert test.equals(rot)
+
+def test_vibronic_coupling_shard(vib):
+    from vibrav.vibronic import merge_shards, Spectrum
+    import h5py
+    grid = np.linspace(0, 30000, 301)
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=True, boltz_states=2, select_fdx=[7,1,8,3], temp=[298, 400],
+                  store='vibronic.h5')
+    vib.vibronic_coupling(spectrum=Spectrum(grid, 300), **kwargs)
+    files = [os.path.join('{:g}K'.format(temp), name) for temp in [298, 400]
+             for name in ['oscillators-{}.txt'.format(idx) for idx in range(4)] \
+                         + ['boltzmann-populations.csv']] + ['alpha.txt']
+    spectra = [os.path.join('{:g}K'.format(temp), 'spectrum.csv') for temp in [298, 400]]
+    base = {}
+    for file in files:
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            base[file] = fn.read()
+    for file in spectra:
+        base[file] = pd.read_csv(os.path.join('vibronic-outputs', file)).values
+    with h5py.File('vibronic.h5', 'r') as fn:
+        keys = []
+        fn.visit(lambda key: keys.append(key) if isinstance(fn[key], h5py.Dataset) else None)
+        datasets = {key: fn[key][()] for key in keys}
+    shutil.rmtree('vibronic-outputs')
+    os.remove('vibronic.h5')
+    for shard in ['3/3', '1/3', '2/3']:
+        vib.vibronic_coupling(spectrum=Spectrum(grid, 300), shard=shard, **kwargs)
+    assert os.path.exists(os.path.join('vibronic-outputs', 'shard-1-of-3', 'vibronic.h5'))
+    completed = merge_shards(spectrum=Spectrum(grid, 300))
+    assert completed == [7, 1, 8, 3]
+    for file in files:
+        with open(os.path.join('vibronic-outputs', file), 'r') as fn:
+            assert fn.read() == base[file]
+    # the running sums of the shards are added in a different order
+    for file in spectra:
+        test = pd.read_csv(os.path.join('vibronic-outputs', file)).values
+        assert np.allclose(test, base[file], rtol=1e-10, atol=1e-12*np.abs(base[file]).max())
+    with h5py.File('vibronic.h5', 'r') as fn:
+        for key, val in datasets.items():
+            assert np.array_equal(fn[key][()], val)
+    # all of the shards are needed
+    os.remove(os.path.join('vibronic-outputs', 'shard-2-of-3', 'shard.json'))
+    with pytest.raises(ValueError):
+        merge_shards()
+    with pytest.raises(ValueError):
+        vib.vibronic_coupling(shard='4/3', **kwargs)
+
+def test_read_hamiltonian_deriv(vib):
+    from exatomic.util import conversions as conv
+    delta, rmass, freq = vib._read_mode_inputs()
+    nmodes = vib.config.number_of_modes
+    found_modes, dham_dq = vib.read_hamiltonian_deriv([7,1,8], delta, rmass, nmodes, True,
+                                                      False)
+    assert isinstance(dham_dq, np.memmap)
+    assert dham_dq.shape == (3, vib.nstates_sf, vib.nstates_sf)
+    assert found_modes.tolist() == [7, 1, 8]
+    for fdx, founddx in enumerate(found_modes):
+        plus = open_txt(os.path.join('confg{:03d}'.format(founddx+1), 'ham-sf.txt'))
+        minus = open_txt(os.path.join('confg{:03d}'.format(founddx+1+nmodes), 'ham-sf.txt'))
+        to_dq = 2*np.sqrt(rmass.loc[founddx].values*(1/conv.amu2u))*delta.loc[founddx].values
+        base = np.real((plus - minus).values/to_dq)
+        assert np.array_equal(dham_dq[fdx], base)
+    # the data frame of all of the normal modes
+    df = vib.get_hamiltonian_deriv([7,1,8], delta, rmass, nmodes, True, False)
+    assert df['freqdx'].unique().tolist() == [7, 1, 8]
+    assert np.array_equal(df.drop('freqdx', axis=1).values,
+                          dham_dq.reshape(-1, vib.nstates_sf))
+
+def test_vibronic_coupling_precision(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=True, boltz_states=2, select_fdx=[1,7])
+    vib.vibronic_coupling(**kwargs)
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in ['vib002', 'vib008'] for sign in ['minus', 'plus']
+             for idx in range(1, 4)]
+    base = [open_txt(fp).values for fp in files]
+    oscil_fp = os.path.join('vibronic-outputs', 'oscillators-0.txt')
+    base_oscil = pd.read_csv(oscil_fp, delim_whitespace=True)
+    assert not os.path.exists(os.path.join('vibronic-outputs', 'precision-report.csv'))
+    vib.vibronic_coupling(precision='single', **kwargs)
+    for fp, values in zip(files, base):
+        test = open_txt(fp).values
+        assert np.allclose(test, values, rtol=1e-4, atol=1e-5*np.abs(values).max())
+    oscil = pd.read_csv(oscil_fp, delim_whitespace=True)
+    assert np.all(oscil['#NROW'].values == base_oscil['#NROW'].values)
+    assert np.allclose(oscil['OSCIL'].values, base_oscil['OSCIL'].values, rtol=1e-4,
+                       atol=1e-8*base_oscil['OSCIL'].abs().max())
+    # the report of the first normal mode
+    report = pd.read_csv(os.path.join('vibronic-outputs', 'precision-report.csv'))
+    assert report['freqdx'].unique().tolist() == [2]
+    assert report.shape[0] == 6
+    assert np.all(report['max_rel'] < 1e-5)
+    result = next(vib.iter_modes('electric_dipole', boltz_states=2, select_fdx=[1],
+                                 precision='single'))
+    assert result.properties['electric-dipole'].dtype == np.complex64
+    assert result.oscil['plus'][2].dtype == np.float64
+    # the kernels need less memory
+    est = vib.estimate(print_stdout=False, select_fdx=[1,7])
+    small = vib.estimate(print_stdout=False, select_fdx=[1,7], precision='single')
+    assert small.total('memory') < est.total('memory')
+    with pytest.raises(ValueError):
+        next(vib.iter_modes('electric_dipole', select_fdx=[1], precision='half'))
+
+def test_get_components(vib):
+    # both spellings give the same components so they are checked the same way
+    for property in ['electric_dipole', 'electric-dipole']:
+        _, components, _ = vib._get_components(property)
+        assert components == [('electric-dipole', key) for key in ['x', 'y', 'z']]
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_compute_mode_hermiticity(dtype):
+    components = [('electric-dipole', key) for key in ['x', 'y', 'z']]
+    rng = np.random.default_rng(7)
+    nstates = 4
+    energies = np.arange(nstates, dtype=np.float64)
+    diff = energies[np.newaxis] - energies[:, np.newaxis]
+    denom = np.divide(1, diff, out=np.zeros_like(diff), where=diff != 0)
+    dham_dq = rng.random((nstates, nstates))
+    dham_dq = dham_dq + dham_dq.T
+    eq_props = rng.random((3, nstates, nstates))
+    eq_props = eq_props + np.transpose(eq_props, (0, 2, 1))
+    eigvectors = np.eye(nstates, dtype=np.complex128)
+    multiplicity = np.ones(nstates, dtype=int)
+    args = (dham_dq, 1., components, nstates)
+    kwargs = dict(denom=denom, eigvectors=eigvectors, multiplicity=multiplicity)
+    _compute_mode(0, *args, eq_props=eq_props.astype(dtype), **kwargs)
+    # a property that is not symmetric gives derivatives that are not hermitian
+    eq_props[:, 0, 1] += 1
+    with pytest.raises(ValueError):
+        _compute_mode(0, *args, eq_props=eq_props.astype(dtype), **kwargs)
+
+def test_vibronic_coupling_dham_dq_tol(monkeypatch, vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=True, boltz_states=2, select_fdx=[1,14])
+    vib.vibronic_coupling(**kwargs)
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in ['vib002', 'vib015'] for sign in ['minus', 'plus']
+             for idx in range(1, 4)]
+    base = [open_txt(fp).values for fp in files]
+    # only the numerical noise is removed
+    vib.config['dham_dq_tol'] = 1e-15
+    vib.vibronic_coupling(**kwargs)
+    for fp, values in zip(files, base):
+        test = open_txt(fp).values
+        assert np.allclose(test, values, rtol=1e-6, atol=1e-8*np.abs(values).max())
+    # all of the derivatives of the second normal mode are smaller
+    shutil.rmtree('vib002')
+    shutil.rmtree('vib015')
+    vib.config['dham_dq_tol'] = None
+    vib.vibronic_coupling(write_dham_dq=True, **kwargs)
+    dham_fp = os.path.join('vib002', 'hamiltonian-derivs.txt')
+    with open(dham_fp, 'r') as fn:
+        base_dham = fn.read()
+    vib.config['dham_dq_tol'] = 1e-4
+    # the normal mode with all of the derivatives removed is not computed
+    compute_mode = vibronic._compute_mode
+    computed = []
+    def check_compute(fdx, dham_dq_mode, *args, **kwargs):
+        computed.append(dham_dq_mode[0].shape[0])
+        return compute_mode(fdx, dham_dq_mode, *args, **kwargs)
+    monkeypatch.setattr(vibronic, '_compute_mode', check_compute)
+    with pytest.warns(Warning, match='dham_dq_tol'):
+        vib.vibronic_coupling(write_dham_dq=True, **kwargs)
+    assert len(computed) == 1 and computed[0] > 0
+    monkeypatch.setattr(vibronic, '_compute_mode', compute_mode)
+    # the written derivatives are not changed by the cut-off
+    with open(dham_fp, 'r') as fn:
+        assert fn.read() == base_dham
+    # the normal mode is kept with zero values so it has all of the outputs
+    for fp in files[:6]:
+        assert np.all(open_txt(fp).values == 0)
+    alpha = pd.read_csv(os.path.join('vibronic-outputs', 'alpha.txt'))
+    assert alpha.shape[0] == 2
+    with pytest.warns(Warning, match='dham_dq_tol'):
+        modes = vib.iter_modes('electric_dipole', boltz_states=2, select_fdx=[1,14])
+        results = list(modes)
+    assert [result.founddx for result in results] == [1, 14]
+    assert np.all(results[0].properties['electric-dipole'] == 0)
+
+def test_vibronic_coupling_pipeline(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_oscil=True, write_dham_dq=True, boltz_states=2,
+                  select_fdx=[7,1,8,3,0], checkpoint=True)
+    vib.vibronic_coupling(**kwargs)
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in ['vib001', 'vib002', 'vib004', 'vib008', 'vib009']
+             for sign in ['minus', 'plus'] for idx in range(1, 4)]
+    files += [os.path.join(vib_dir, 'hamiltonian-derivs.txt')
+              for vib_dir in ['vib001', 'vib002', 'vib004', 'vib008', 'vib009']]
+    files += [os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx))
+              for idx in range(4)] + [os.path.join('vibronic-outputs', 'alpha.txt')]
+    base = {}
+    for file in files:
+        with open(file, 'r') as fn:
+            base[file] = fn.read()
+    for n_jobs in [1, 2]:
+        for file in files:
+            os.remove(file)
+        vib.vibronic_coupling(pipeline=True, n_jobs=n_jobs, **kwargs)
+        for file in files:
+            with open(file, 'r') as fn:
+                assert fn.read() == base[file]
+    est = vib.estimate(print_stdout=False, select_fdx=[7,1,8,3,0])
+    ahead = vib.estimate(print_stdout=False, select_fdx=[7,1,8,3,0], pipeline=True)
+    assert ahead.total('memory') > est.total('memory')
+    # the errors of the writer are raised in the calling thread
+    def write_mode(result):
+        raise RuntimeError("could not write")
+    modes = vib.iter_modes('electric_dipole', boltz_states=2, select_fdx=[1,7,8],
+                           pipeline=True)
+    with pytest.raises(RuntimeError):
+        with Writer(write_mode) as writer:
+            for result in modes:
+                writer.put(result)
+    modes.close()
+
+def test_vibronic_coupling_async_write(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_property=True,
+                  write_energy=True, write_oscil=True, write_dham_dq=True, boltz_states=2,
+                  select_fdx=[7,1,8], checkpoint=True)
+    vib.vibronic_coupling(**kwargs)
+    vib_dirs = ['vib002', 'vib008', 'vib009']
+    files = [os.path.join(vib_dir, sign, 'dipole-{}.txt'.format(idx))
+             for vib_dir in vib_dirs for sign in ['minus', 'plus'] for idx in range(1, 4)]
+    files += [os.path.join(vib_dir, sign, 'energies.txt')
+              for vib_dir in vib_dirs for sign in ['minus', 'plus']]
+    files += [os.path.join(vib_dir, 'hamiltonian-derivs.txt') for vib_dir in vib_dirs]
+    files += [os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(idx))
+              for idx in range(4)]
+    base = {}
+    for file in files:
+        with open(file, 'r') as fn:
+            base[file] = fn.read()
+    for file in files:
+        os.remove(file)
+    vib.vibronic_coupling(async_write=True, profile=True, **kwargs)
+    for file in files:
+        with open(file, 'r') as fn:
+            assert fn.read() == base[file]
+    # the files are renamed after they are written
+    for vib_dir in vib_dirs:
+        for _, _, names in os.walk(vib_dir):
+            assert not [name for name in names if name.endswith('.tmp')]
+    with open(os.path.join('vibronic-outputs', 'profile.json'), 'r') as fn:
+        profile = json.load(fn)
+    assert profile['stages']['store-close']['bytes'] > 0
+    # the CPU time of each stage is that of the thread that ran it so the stages written in
+    # the background are not counted twice
+    for rec in profile['records']:
+        assert rec['cpu'] <= rec['wall'] + 1e-2
+    assert sum([stage['cpu'] for stage in profile['stages'].values()]) \
+                <= profile['cpu'] + 1e-2
+    h5py = pytest.importorskip('h5py')
+    datasets = {}
+    for async_write in [False, True]:
+        vib.vibronic_coupling(store='vibronic.h5', async_write=async_write, **kwargs)
+        with h5py.File('vibronic.h5', 'r') as fn:
+            keys = []
+            fn.visit(lambda key: keys.append(key) if isinstance(fn[key], h5py.Dataset) \
+                                 else None)
+            datasets[async_write] = {key: fn[key][()] for key in keys}
+        os.remove('vibronic.h5')
+    assert datasets[False] and sorted(datasets[True]) == sorted(datasets[False])
+    for key, val in datasets[False].items():
+        assert np.array_equal(datasets[True][key], val)
+
+def test_vibronic_coupling_manifold_oscil(vib):
+    vib.vibronic_coupling(property='electric_dipole', print_stdout=False, write_oscil=True,
+                          write_manifold_oscil=True, boltz_states=2, select_fdx=[1,7],
+                          checkpoint=True)
+    manifold, first, degen = vib.so_manifolds
+    for cdx in range(4):
+        oscil = pd.read_csv(os.path.join('vibronic-outputs', 'oscillators-{}.txt'.format(cdx)),
+                            delim_whitespace=True)
+        summed = pd.read_csv(os.path.join('vibronic-outputs',
+                                          'oscillators-manifold-{}.txt'.format(cdx)),
+                             delim_whitespace=True)
+        assert summed.shape[0] < oscil.shape[0]
+        # sum the oscillators of each state over the manifolds
+        oscil['MROW'] = manifold[oscil['#NROW'].values-1]
+        oscil['MCOL'] = manifold[oscil['NCOL'].values-1]
+        oscil = oscil[oscil['ENERGY'] > 0]
+        ref = oscil.groupby(['FREQDX', 'SIGN', 'MROW', 'MCOL']).agg(
+                  {'OSCIL': 'sum', 'ENERGY': 'mean'})
+        ref = ref[ref['OSCIL'] > 0]
+        summed['MROW'] = manifold[summed['#NROW'].values-1]
+        summed['MCOL'] = manifold[summed['NCOL'].values-1]
+        assert np.array_equal(summed['NDEGR'].values, degen[summed['MROW'].values])
+        assert np.array_equal(summed['NDEGC'].values, degen[summed['MCOL'].values])
+        summed = summed.set_index(['FREQDX', 'SIGN', 'MROW', 'MCOL'])
+        assert ref.shape[0] == summed.shape[0]
+        ref = ref.loc[summed.index]
+        assert np.allclose(summed['OSCIL'].values, ref['OSCIL'].values, rtol=1e-12)
+        assert np.allclose(summed['ENERGY'].values, ref['ENERGY'].values, rtol=1e-12)
+
+def test_vibronic_coupling_prune_oscil(vib):
+    kwargs = dict(property='electric_dipole', print_stdout=False, write_oscil=True,
+                  write_rotatory=True, boltz_states=2, select_fdx=[1,7], checkpoint=True)
+    vib.vibronic_coupling(**kwargs)
+    read = lambda name: pd.read_csv(os.path.join('vibronic-outputs', name),
+                                    delim_whitespace=True)
+    base = read('oscillators-0.txt')
+    base_rot = read('rotatory.txt')
+    vib.vibronic_coupling(oscil_rel_tol=1e-3, oscil_top_n=5, **kwargs)
+    oscil = read('oscillators-0.txt')
+    rot = read('rotatory.txt')
+    summary = read('oscillators-pruned.txt')
+    assert 0 < oscil.shape[0] < base.shape[0]
+    # the same transitions are kept for the rotatory strengths
+    for col in ['#NROW', 'NCOL', 'FREQDX', 'SIGN']:
+        assert np.all(rot[col].values == oscil[col].values)
+    for (founddx, sign), df in base.groupby(['FREQDX', 'SIGN']):
+        pruned = oscil[(oscil['FREQDX'] == founddx) & (oscil['SIGN'] == sign)]
+        assert pruned['OSCIL'].min() >= 1e-3*df['OSCIL'].max()
+        assert pruned.groupby('#NROW').size().max() <= 5
+        # the strongest transitions are kept
+        top = df.sort_values('OSCIL', ascending=False).groupby('#NROW').head(5)
+        top = top[top['OSCIL'] >= 1e-3*df['OSCIL'].max()]
+        assert sorted(top.index.tolist()) == \
+               sorted(df.index[df.set_index(['#NROW', 'NCOL']).index.isin(
+                   pruned.set_index(['#NROW', 'NCOL']).index)].tolist())
+        line = summary[(summary['FREQDX'] == founddx) & (summary['SIGN'] == sign)]
+        assert line['#NKEEP'].values[0] == pruned.shape[0]
+        assert line['#NKEEP'].values[0] + line['NPRUNE'].values[0] == df.shape[0]
+        assert np.isclose(line['OSCIL'].values[0], df['OSCIL'].sum())
+        assert np.isclose(line['PRUNED'].values[0],
+                          df['OSCIL'].sum() - pruned['OSCIL'].sum())
+    assert base_rot.shape[0] == base.shape[0]
+    with pytest.raises(ValueError):
+        vib.vibronic_coupling(oscil_top_n=0, **kwargs)
+    # the appended files are the same when they are written in the background
+    names = ['oscillators-{}.txt'.format(idx) for idx in range(4)] \
+            + ['oscillators-manifold-{}.txt'.format(idx) for idx in range(4)] \
+            + ['rotatory.txt', 'oscillators-pruned.txt']
+    texts = {}
+    for async_write in [False, True]:
+        vib.vibronic_coupling(oscil_top_n=5, write_manifold_oscil=True,
+                              async_write=async_write, **kwargs)
+        texts[async_write] = []
+        for name in names:
+            with open(os.path.join('vibronic-outputs', name), 'r') as fn:
+                texts[async_write].append(fn.read())
+    assert texts[False] == texts[True]
+
+def test_async_store(tmp_path, monkeypatch):
+    from vibrav.vibronic.store import AsyncStore, TxtStore
+    monkeypatch.chdir(tmp_path)
+    data = np.arange(12).reshape(1, 3, 4)*(1+1j)
+    with AsyncStore(TxtStore, size=1) as store:
+        assert store.write_property(0, 'plus', 'so', 'dipole', data) is None
+        store.write_energies(0, 'plus', np.arange(3))
+        store.flush()
+        assert store.nbytes == os.path.getsize(os.path.join('vib001', 'plus', 'dipole-1.txt')) \
+                               + os.path.getsize(os.path.join('vib001', 'plus', 'energies.txt'))
+        # the rows are appended in the order of the calls
+        with open('oscillators.txt', 'w') as fn:
+            fn.write('#NROW')
+        for founddx in range(2):
+            store.append_rows('oscillators.txt', '{:>5d} {:>6d} {:>7s}',
+                              [np.arange(3), founddx, 'plus'])
+        store.flush()
+        with open('oscillators.txt', 'r') as fn:
+            lines = fn.read().split('\n')
+        assert len(lines) == 7
+        assert lines[-1].split() == ['2', '1', 'plus']
+    # the errors of the background process are raised by the next call
+    store = AsyncStore(TxtStore)
+    store.write_property(0, 'plus', 'so', 'dipole', np.arange(3))
+    with pytest.raises(ValueError):
+        store.close()
+
+def test_prefetch():
+    def items():
+        yield 1
+        yield 2
+        raise ValueError("could not read")
+    values = []
+    with pytest.raises(ValueError):
+        for val in prefetch(items(), size=1):
+            values.append(val)
+    assert values == [1, 2]
+    # the background thread is stopped when not all of the items are used
+    gen = prefetch(iter(range(100)), size=1)
+    assert next(gen) == 0
+    gen.close()
@@ -15,7 +15,10 @@
 import pandas as pd
 import numpy as np
 import os
+import copy
 import warnings
+import tempfile
+import weakref
 from vibrav.molcas import Output
 from exatomic.exa.util.units import Time, Length
 from exatomic.util.constants import (speed_of_light_in_vacuum as speed_of_light,
@@ -23,14 +26,268 @@ from exatomic.util.constants import (speed_of_light_in_vacuum as speed_of_light,
 from exatomic.util import conversions as conv
 from vibrav.numerical.vibronic_func import *
 from vibrav.core.config import Config
-from vibrav.numerical.degeneracy import energetic_degeneracy
+from vibrav.core.estimate import ResourceEstimate
+from vibrav.numerical.degeneracy import energetic_degeneracy, get_manifolds, sum_manifolds
 from vibrav.numerical.boltzmann import boltz_dist
-from vibrav.util.io import open_txt
+from vibrav.util.io import open_txt, write_txt
 from vibrav.util.math import get_triu, ishermitian, isantihermitian, abs2
 from vibrav.util.print import dataframe_to_txt
+from vibrav.vibronic.store import TxtStore, HDF5Store, AsyncStore
+from vibrav.vibronic.checkpoint import Checkpoint, hash_inputs
+from vibrav.vibronic.results import ModeResult
+from vibrav.vibronic.profiling import Profile, clock, elapsed
+from vibrav.vibronic.pipeline import prefetch, Writer, queue_size as pipeline_queue_size
+from vibrav.vibronic.shard import (parse_shard, shard_dir, select_shard, write_manifest,
+                                   remove_manifest)
+from collections import deque
 from glob import glob
 from datetime import datetime, timedelta
 from time import time
+from concurrent.futures import ProcessPoolExecutor
+
+# arrays attached from shared memory in the worker processes
+_shared_arrays = {}
+
+def _compute_mode(fdx, dham_dq_mode, tdm_prefac, components, nstates, eq_props, denom,
+                  eigvectors, multiplicity, fc=1, extend_so=False, initial=None, final=None):
+    '''
+    Calculate the vibronic property values of a single normal mode.
+
+    Args:
+        fdx (:obj:`int`): Index of the normal mode in the found modes. Only used for the error
+                          messages.
+        dham_dq_mode (:obj:`numpy.array` or :obj:`tuple`): Derivative of the Hamiltonian with
+                                                           respect to the normal mode. Can be
+                                                           the compressed sparse row arrays
+                                                           from
+                                                           :func:`vibrav.numerical.vibronic_func.get_csr`.
+        tdm_prefac (:obj:`float`): Transition dipole moment prefactor of the normal mode.
+        components (:obj:`list`): Property and component label of each of the stacked
+                                  components (i.e. :code:`('electric-dipole', 'x')`).
+        nstates (:obj:`int`): Number of spin-orbit states.
+        eq_props (:obj:`numpy.array`): Stacked spin-free property components parsed from the
+                                       equilibrium geometry. Can have the components of more
+                                       than one property. The derivatives are computed in the
+                                       precision of these values.
+        denom (:obj:`numpy.array`): Masked reciprocal energy difference matrix.
+        eigvectors (:obj:`numpy.array`): Spin-orbit eigenvectors. Can be a
+                                         :class:`scipy.sparse.csr_matrix`.
+        multiplicity (:obj:`numpy.array`): Multiplicity of each of the spin-free states.
+        fc (:obj:`float`, optional): Franck-Condon factor. Defaults to :code:`1`.
+        extend_so (:obj:`bool`, optional): Build the spin-free derivatives extended into the
+                                           number of spin-orbit states. These are not needed
+                                           for the transformation with the eigenvectors as only
+                                           the non-zero spin blocks are used. Defaults to
+                                           :code:`False`.
+        initial (:obj:`numpy.array`, optional): Zero based indeces of the initial spin-orbit
+                                                states. Defaults to :code:`None` (all of the
+                                                states).
+        final (:obj:`numpy.array`, optional): Zero based indeces of the final spin-orbit
+                                              states. Defaults to :code:`None` (all of the
+                                              states).
+
+    Returns:
+        vib_prop (:obj:`numpy.array`): Spin-orbit vibronic property values for the minus and
+                                       plus displacements with the shape
+                                       `(2, ncomp, nfinal, ninitial)`.
+        vib_prop_sf (:obj:`numpy.array`): Spin-free vibronic property values.
+        vib_prop_sf_so_len (:obj:`numpy.array`): Spin-free vibronic property values extended to
+                                                 the number of spin-orbit states. :code:`None`
+                                                 when `extend_so` is :code:`False`.
+        timings (:obj:`dict`): Wall and CPU times of the sum over states kernel, the
+                               eigenvector transformation and the hermiticity checks.
+
+    Raises:
+        ValueError: If the array that is expected to be Hermitian actually is not. The
+                    electric dipole and quadrupole are expected to be Hermitian and the
+                    magnetic dipole anti-Hermitian.
+    '''
+    ncomp, nstates_sf, _ = eq_props.shape
+    timings = {}
+    # spin-free derivatives for all of the components at once
+    # the derivatives are kept in double precision and converted to the precision of the
+    # zero order property values
+    start = clock()
+    if isinstance(dham_dq_mode, tuple):
+        dprop_dq_sf_all = compute_d_dq_sf_sparse(*dham_dq_mode, eq_props, denom)
+    else:
+        dham_dq_mode = np.asarray(dham_dq_mode, dtype=eq_props.dtype)
+        dprop_dq_sf_all = compute_d_dq_sf_batch(dham_dq_mode, eq_props, denom)
+    timings['sos-kernel'] = elapsed(start)
+    # spin-orbit derivatives for all of the components at once
+    # only the non-zero spin blocks of the extended spin-free derivatives are used
+    blocks = get_spin_blocks(multiplicity)
+    # only the rows of the initial states and columns of the final states are computed
+    start = clock()
+    if isinstance(eigvectors, np.ndarray):
+        dprop_dq_all = compute_d_dq_blocks(eigvectors, dprop_dq_sf_all, blocks, rows=initial,
+                                           cols=final)
+    else:
+        dprop_dq_all = compute_d_dq_blocks_sparse(eigvectors, dprop_dq_sf_all, blocks,
+                                                  rows=initial, cols=final)
+    timings['so-transform'] = elapsed(start)
+    # the spin-orbit values can only be checked with the full matrix
+    check_so = initial is None and final is None
+    start = clock()
+    # iterate over all of the available components
+    for cdx, (property, key) in enumerate(components):
+        dprop_dq_sf = dprop_dq_sf_all[cdx]
+        dprop_dq = dprop_dq_all[cdx]
+        tol = _herm_tol(dprop_dq)
+        sf_tol = _herm_tol(dprop_dq_sf)
+        # check if the array is hermitian
+        if property == 'electric-dipole':
+            if check_so and not ishermitian(dprop_dq, **tol):
+                text = "The vibronic electric dipole at frequency {} for component {} " \
+                       +"was not found to be hermitian."
+                raise ValueError(text.format(fdx, key))
+            if not ishermitian(dprop_dq_sf, **sf_tol):
+                text = "The vibronic electric dipole at frequency {} for component {} " \
+                       +"was not found to be hermitian."
+                raise ValueError(text.format(fdx, key))
+        elif property == 'magnetic-dipole':
+            if check_so and not isantihermitian(dprop_dq, **tol):
+                text = "The vibronic magentic dipole at frequency {} for component {} " \
+                       +"was not found to be non-hermitian."
+                raise ValueError(text.format(fdx, key))
+        elif property == 'electric-quadrupole':
+            if check_so and not ishermitian(dprop_dq, **tol):
+                text = "The vibronic electric quadrupole at frequency {} for " \
+                       +"component {} was not found to be hermitian."
+                raise ValueError(text.format(fdx, key))
+    timings['hermiticity-check'] = elapsed(start)
+    # store the transpose as it will make some things easier down the line
+    # the first index is the minus and the second is the plus displacement
+    vib_prop = fc*tdm_prefac*np.transpose(dprop_dq_all, (0, 2, 1))
+    vib_prop = np.stack([-vib_prop, vib_prop])
+    vib_prop_sf = fc*tdm_prefac*np.transpose(dprop_dq_sf_all, (0, 2, 1))
+    vib_prop_sf = np.stack([-vib_prop_sf, vib_prop_sf])
+    if extend_so:
+        # spin-free derivatives extended into the number of spin-orbit states
+        dprop_dq_so_all = np.zeros((ncomp, nstates, nstates), dtype=dprop_dq_sf_all.dtype)
+        for cdx in range(ncomp):
+            sf_to_so(nstates_sf, nstates, multiplicity, dprop_dq_sf_all[cdx],
+                     dprop_dq_so_all[cdx])
+        vib_prop_sf_so_len = fc*tdm_prefac*np.transpose(dprop_dq_so_all, (0, 2, 1))
+        vib_prop_sf_so_len = np.stack([-vib_prop_sf_so_len, vib_prop_sf_so_len])
+    else:
+        vib_prop_sf_so_len = None
+    return vib_prop, vib_prop_sf, vib_prop_sf_so_len, timings
+
+def _herm_tol(arr):
+    # the single precision values are only hermitian to the precision of the data type
+    # relative to the largest value
+    if np.finfo(arr.dtype).bits == 64:
+        return {}
+    return {'rtol': 1e-4, 'atol': 1e-4*np.abs(arr).max()}
+
+def _remove_file(fp):
+    try:
+        os.remove(fp)
+    except OSError:
+        pass
+
+def _scratch_array(shape, scratch=None):
+    # float64 array backed by a temporary file that is removed when it is no longer used
+    fd, fp = tempfile.mkstemp(prefix='vibrav-', suffix='.npy', dir=scratch)
+    os.close(fd)
+    arr = np.lib.format.open_memmap(fp, mode='w+', dtype=np.float64, shape=shape)
+    if os.name == 'nt':
+        # the file cannot be removed while it is mapped on windows
+        weakref.finalize(arr, _remove_file, fp)
+    else:
+        _remove_file(fp)
+    return arr
+
+def _shared_memory():
+    # only available from python 3.8
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        raise ImportError("Python 3.8 or newer is needed to compute the normal modes in " \
+                          +"more than one process (n_jobs or executor).")
+    return shared_memory
+
+def _create_shared(arrays):
+    # copy the arrays into shared memory blocks
+    shared_memory = _shared_memory()
+    blocks = []
+    specs = {}
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[...] = arr
+        blocks.append(shm)
+        specs[key] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, specs
+
+def _attach_shared(specs):
+    # get the numpy arrays from the shared memory blocks in the worker process
+    # only attach when the blocks are not already available
+    shared_memory = _shared_memory()
+    names = [val[0] for val in specs.values()]
+    for name in list(_shared_arrays.keys()):
+        if name not in names:
+            _shared_arrays.pop(name)[0].close()
+    arrays = {}
+    for key, (name, shape, dtype) in specs.items():
+        if name not in _shared_arrays:
+            shm = shared_memory.SharedMemory(name=name)
+            _shared_arrays[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        arrays[key] = _shared_arrays[name][1]
+    return arrays
+
+def _csr_matrix(*args, **kwargs):
+    try:
+        from scipy.sparse import csr_matrix
+    except ImportError:
+        raise ImportError("The scipy package is needed for the sparse eigenvector " \
+                          +"transformation. Install it with `pip install vibrav[sparse]`.")
+    return csr_matrix(*args, **kwargs)
+
+def _compute_mode_shared(task, specs, kwargs):
+    arrays = _attach_shared(specs)
+    if 'eigvectors_data' in arrays:
+        # rebuild the sparse eigen vectors from the shared arrays
+        csr = (arrays.pop('eigvectors_data'), arrays.pop('eigvectors_indices'),
+               arrays.pop('eigvectors_indptr'))
+        nstates = csr[2].shape[0] - 1
+        arrays['eigvectors'] = _csr_matrix(csr, shape=(nstates, nstates), copy=False)
+    return _compute_mode(*task, **arrays, **kwargs)
+
+def _parallel_modes(tasks, arrays, n_jobs=-1, executor=None, **kwargs):
+    '''
+    Generator to compute the normal modes in separate processes. The results are yielded in
+    the same order as the input tasks and only a limited number of tasks are submitted at any
+    given time so that the completed results do not pile up in memory.
+    '''
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    blocks, specs = _create_shared(arrays)
+    pool = executor
+    futures = []
+    try:
+        if executor is None:
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+        window = 2*n_jobs
+        for task in tasks:
+            futures.append(pool.submit(_compute_mode_shared, task, specs, kwargs))
+            if len(futures) >= window:
+                yield futures.pop(0).result()
+        while futures:
+            yield futures.pop(0).result()
+    finally:
+        # the modes that were not started are not needed when the generator is closed early
+        for future in futures:
+            future.cancel()
+        if executor is None and pool is not None:
+            pool.shutdown(wait=True)
+        for shm in blocks:
+            if shm.name in _shared_arrays:
+                _shared_arrays.pop(shm.name)[0].close()
+            shm.close()
+            shm.unlink()
 
 class Vibronic:
     '''
@@ -86,6 +343,22 @@ class Vibronic:
     | so_cont_tol      | Cut-off parameter for the minimum spin-free contribution   | None           |
     |                  | to each spin-orbit state.                                  |                |
     +------------------+------------------------------------------------------------+----------------+
+    | initial_states   | Number of the lowest spin-orbit states to use as the       | None           |
+    |                  | initial states. Extended to include all of the states that |                |
+    |                  | are degenerate with the last one.                          |                |
+    +------------------+------------------------------------------------------------+----------------+
+    | final_energy_min | Minimum energy of the final spin-orbit states relative to  | None           |
+    |                  | the ground state in Hartree.                               |                |
+    +------------------+------------------------------------------------------------+----------------+
+    | final_energy_max | Maximum energy of the final spin-orbit states relative to  | None           |
+    |                  | the ground state in Hartree.                               |                |
+    +------------------+------------------------------------------------------------+----------------+
+    | dham_dq_tol      | Cut-off parameter for the absolute value of the elements   | None           |
+    |                  | of the Hamiltonian derivatives. The smaller elements are   |                |
+    |                  | removed and the sparse sum over states is used. The        |                |
+    |                  | vibronic property values of a normal mode without any      |                |
+    |                  | remaining elements are zero.                               |                |
+    +------------------+------------------------------------------------------------+----------------+
     '''
     _required_inputs = {'number_of_multiplicity': int, 'spin_multiplicity': (tuple, int),
                         'number_of_states': (tuple, int), 'number_of_nuclei': int,
@@ -95,7 +368,18 @@ class Vibronic:
                        'spin_file': ('spin', str), 'quadrupole_file': ('quadrupole', str),
                        'degen_delta': (1e-7, float), 'eigvectors_file': ('eigvectors.txt', str),
                        'so_cont_tol': (None, float), 'sparse_hamiltonian': (False, bool),
-                       'states': (None, int)}
+                       'states': (None, int), 'initial_states': (None, int),
+                       'final_energy_min': (None, float), 'final_energy_max': (None, float),
+                       'dham_dq_tol': (None, float)}
+    # name of the output files, molcas output parser attribute and components
+    # of each of the available properties
+    _properties = {'electric-dipole': ('dipole', 'sf_dipole_moment', {1: 'x', 2: 'y', 3: 'z'}),
+                   'electric-quadrupole': ('quadrupole', 'sf_quadrupole_moment',
+                                           {1: 'xx', 2: 'xy', 3: 'xz', 4: 'yy', 5: 'yz',
+                                            6: 'zz'}),
+                   'magnetic-dipole': ('angmom', 'sf_angmom', {1: 'x', 2: 'y', 3: 'z'})}
+    # real and complex data types of the vibronic kernels for each precision
+    _precisions = {'double': (np.float64, np.complex128), 'single': (np.float32, np.complex64)}
     @staticmethod
     def check_size(data, size, var_name, dataframe=False):
         '''
@@ -176,44 +460,284 @@ class Vibronic:
         incl_states = df['incl_states'].values
         return incl_states
 
-    def get_hamiltonian_deriv(self, select_fdx, delta, redmass, nmodes, use_sqrt_rmass,
-                              sparse_hamiltonian):
+    @staticmethod
+    def _count_window(fp, energy_min, energy_max):
         '''
-        Find and read all of the Hamiltonian txt files in the different confg
-        directories.
+        Count the spin-orbit states in the final state energy window without building the
+        array of the energies. The same window as :meth:`_get_windows` is used.
+        '''
+        first = None
+        count = 0
+        with open(fp, 'r') as fn:
+            for line in fn:
+                line = line.split('#')[0].strip()
+                if not line:
+                    continue
+                energy = float(line.split(',')[0])
+                if first is None: first = energy
+                rel = energy - first
+                if (energy_min is None or rel >= energy_min) and \
+                        (energy_max is None or rel <= energy_max):
+                    count += 1
+        if count == 0:
+            raise ValueError("No spin-orbit states were found between the final state " \
+                             +"energies {} and {}.".format(energy_min, energy_max))
+        return count
 
-        Note:
-            The path of confg is hardcoded along with the names of the
-            SF Hamiltonian files as `'ham-sf.txt'`.
+    @staticmethod
+    def _get_windows(energies_so, initial_states, energy_min, energy_max, degen_delta):
+        '''
+        Get the zero based indeces of the initial and final spin-orbit states. :code:`None` is
+        returned when all of the states are used.
+        '''
+        nstates = energies_so.shape[0]
+        if initial_states is not None and initial_states < nstates:
+            order = np.argsort(energies_so, kind='stable')
+            # do not split a degenerate manifold
+            cutoff = energies_so[order[initial_states-1]] + degen_delta
+            initial = np.where(energies_so <= cutoff)[0]
+        else:
+            initial = None
+        if energy_min is not None or energy_max is not None:
+            rel = energies_so - energies_so[0]
+            keep = np.ones(nstates, dtype=bool)
+            if energy_min is not None: keep &= rel >= energy_min
+            if energy_max is not None: keep &= rel <= energy_max
+            final = np.where(keep)[0]
+            if final.shape[0] == 0:
+                raise ValueError("No spin-orbit states were found between the final state " \
+                                 +"energies {} and {}.".format(energy_min, energy_max))
+        else:
+            final = None
+        return initial, final
 
-        Args:
-            select_fdx (int):
-            delta (pd.DataFrame): Data frame with all the delta values
-                        used for each of the normal mode displacements.
-                        Read from the given `delta_file` input in the
-                        configuration file.
-            redmass (pd.DataFrame): Data frame with all of the reduced
-                        masses for each of the normal modes. Read from
-                        the given `redmass_file` input in the
-                        configuration file.
-            nmodes (int): The number of normal modes in the molecule.
-            use_sqrt_rmass (bool):
-            sparse_hamiltonian (bool): Tell the program that the input
-                        Hamiltonian files are sparse matrices made up
-                        of block diagonal values.
+    @staticmethod
+    def _get_vib_energies(energies_so, evib, gs_degeneracy, sign):
+        # energies of the vibronic states relative to the ground state
+        # the states in the ground state manifold have the opposite vibrational quanta
+        if sign == 'minus':
+            energies = energies_so + (1./2.)*evib - energies_so[0]
+            energies[range(gs_degeneracy)] = energies_so[:gs_degeneracy] \
+                                                - energies_so[0] + (3./2.)*evib
+        else:
+            energies = energies_so + (3./2.)*evib - energies_so[0]
+            energies[range(gs_degeneracy)] = energies_so[:gs_degeneracy] \
+                                                - energies_so[0] + (1./2.)*evib
+        return energies
 
-        Returns:
-            dham_dq (pd.DataFrame): Data frame with the derivative of
-                        the Hamiltonians with respect to the normal
-                        mode.
-        '''
-        # read the hamiltonian files in each of the confg??? directories
-        # it is assumed that the directories are named confg with a 3-fold padded number (000)
-        padding = 3
-        plus_matrix = []
-        minus_matrix = []
-        found_modes = []
+    @staticmethod
+    def _compute_oscillators(vib_prop, energies, evib, boltz, founddx, keep_all, initial=None,
+                             final=None, mag_prop=None):
+        # compute the oscillator strengths from equation S12 for both signs
+        # with the boltzmann weighting of each temperature
+        # the rotatory strengths are computed with them when the magnetic dipoles are given
+        oscil = {}
+        for idx, (val, sign) in enumerate(zip([-1, 1], ['minus', 'plus'])):
+            boltz_factors = np.array([data.loc[founddx, sign] for data in boltz],
+                                     dtype=np.float64)
+            oscil[sign] = compute_oscil_compact_temps(vib_prop[idx], energies, val*evib,
+                                                      boltz_factors, keep_all, final=final,
+                                                      initial=initial,
+                                                      mag_prop=None if mag_prop is None \
+                                                               else mag_prop[idx])
+        return oscil
+
+    @staticmethod
+    def _zero_oscillators(ntemps, rotatory=False):
+        # the compact oscillator arrays without any transitions of a normal mode that is not
+        # computed
+        oscil = {}
+        for sign in ['minus', 'plus']:
+            oscil[sign] = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                           np.empty((ntemps, 4, 0), dtype=np.float64),
+                           np.empty(0, dtype=np.float64))
+            if rotatory:
+                oscil[sign] += (np.empty((ntemps, 0), dtype=np.float64),)
+        return oscil
+
+    @staticmethod
+    def _time_transforms(profile, founddx, vib_prop_sf, timings, multiplicity, eigvectors,
+                         eigvectors_csr, use_sparse, initial, final):
+        # timings of both eigenvector transformations for a normal mode
+        # the one that was used is already timed and only the other one is done again with the
+        # spin-free derivatives of the normal mode
+        used = 'sparse' if use_sparse else 'dense'
+        profile.add('so-transform-'+used, *timings['so-transform'], founddx=founddx)
+        dprop_dq_sf = np.ascontiguousarray(np.transpose(vib_prop_sf[1], (0, 2, 1)))
+        blocks = get_spin_blocks(multiplicity)
+        if use_sparse:
+            with profile.stage('so-transform-dense', founddx):
+                compute_d_dq_blocks(eigvectors, dprop_dq_sf, blocks, rows=initial, cols=final)
+        elif eigvectors_csr is not None:
+            with profile.stage('so-transform-sparse', founddx):
+                compute_d_dq_blocks_sparse(eigvectors_csr, dprop_dq_sf, blocks, rows=initial,
+                                           cols=final)
+
+    @staticmethod
+    def _precision_report(founddx, components, values, reference):
+        # largest absolute deviation of each component and relative to the largest
+        # reference value
+        data = []
+        for kind, vals, refs in zip(['spin-orbit', 'spin-free'], values, reference):
+            for cdx, (prop_name, key) in enumerate(components):
+                diff = np.abs(vals[:, cdx] - refs[:, cdx]).max()
+                scale = np.abs(refs[:, cdx]).max()
+                data.append([founddx+1, kind, prop_name, key, diff,
+                             diff/scale if scale > 0 else 0.])
+        return pd.DataFrame(data, columns=['freqdx', 'values', 'property', 'component',
+                                           'max_abs', 'max_rel'])
+
+    @staticmethod
+    def _add_spectra(oscillators, founddx, spectra):
+        # add the oscillator strengths of each temperature to its own spectrum
+        # the added transitions are returned so that they can be removed again
+        added = {}
+        for sign in ['minus', 'plus']:
+            energy, oscil_temps = oscillators[sign][3], oscillators[sign][2]
+            for tdx, (spec, oscil) in enumerate(zip(spectra, oscil_temps)):
+                keep = (oscil[0] > 0) & (energy > 0)
+                spec.add(founddx, energy[keep], oscil[:, keep])
+                added['energy-{}-{}'.format(tdx, sign)] = energy[keep]
+                added['oscil-{}-{}'.format(tdx, sign)] = oscil[:, keep]
+        return added
+
+    @staticmethod
+    def _remove_spectra(added, founddx, spectra):
+        # remove the oscillator strengths returned by _add_spectra from the spectra
+        for sign in ['minus', 'plus']:
+            for tdx, spec in enumerate(spectra):
+                spec.remove(founddx, added['energy-{}-{}'.format(tdx, sign)],
+                            added['oscil-{}-{}'.format(tdx, sign)])
+
+    @staticmethod
+    def _write_oscillators(oscillators, founddx, osc_dirs, osc_tmp, write_all_oscil,
+                           print_stdout, profile=None, prune=None, store=None):
+        # write the oscillator strengths of each temperature to its own directory
+        # the writing of each component is recorded in the profile
+        # the pruned transitions are only removed from the files and the number of transitions
+        # and the isotropic oscillator strength that were removed are appended to their own file
+        # the rows are appended by the store so they can be written in the background
+        if store is None: store = TxtStore()
+        stage = 'write-'+osc_tmp.split('-{}')[0]
+        mapper = {0: 'iso', 1: 'x', 2: 'y', 3: 'z'}
+        template = ' '.join(['{:>5d}']*2 + ['{:>24.16E}']*2 + ['{:>6d}', '{:>7s}'])
+        for sign in ['minus', 'plus']:
+            nrow, ncol, oscil_temps, energy = oscillators[sign][:4]
+            for osc_dir, oscil in zip(osc_dirs, oscil_temps):
+                pruned = None
+                if prune is not None:
+                    pruned = prune_oscil(nrow, oscil[0], **prune)
+                    valid = (oscil[0] > 0) if not write_all_oscil else np.ones_like(pruned)
+                    positive = oscil[0] > 0
+                    total = oscil[0][positive].sum()
+                    discarded = oscil[0][positive & ~pruned].sum()
+                    store.append_rows(os.path.join(osc_dir, osc_tmp.format('pruned')),
+                                      template, [[int((valid & pruned).sum())],
+                                                 [int((valid & ~pruned).sum())], [total],
+                                                 [discarded], founddx, sign])
+                    if print_stdout:
+                        text = " Pruned {} transitions for sign {} with a total isotropic " \
+                               +"oscillator strength of {:.4E} out of {:.4E}"
+                        print(text.format(int((valid & ~pruned).sum()), sign, discarded,
+                                          total))
+                for cdx, osc in enumerate(oscil):
+                    # the transitions with a positive isotropic oscillator strength can have a
+                    # component that is zero
+                    # the isotropic values are only filtered again for more than one temperature
+                    if not write_all_oscil and (cdx > 0 or len(osc_dirs) > 1):
+                        keep = (osc > 0) & (oscil[0] > 0)
+                    else:
+                        keep = None
+                    if pruned is not None:
+                        keep = pruned if keep is None else keep & pruned
+                    if keep is not None:
+                        arrs = (nrow[keep], ncol[keep], osc[keep], energy[keep])
+                    else:
+                        arrs = (nrow, ncol, osc, energy)
+                    filename = os.path.join(osc_dir, osc_tmp.format(cdx))
+                    start = clock()
+                    nbytes = store.append_rows(filename, template, list(arrs)+[founddx, sign])
+                    wall, cpu = elapsed(start)
+                    if profile is not None:
+                        profile.add(stage, wall, cpu, founddx=founddx, component=mapper[cdx],
+                                    nbytes=nbytes)
+                    if not print_stdout:
+                        continue
+                    if cdx == 0:
+                        text = " Wrote isotropic oscillators to {} for sign {} in {:.2f} s"
+                        print(text.format(filename, sign, wall))
+                    else:
+                        text = " Wrote oscillators for {} component to {} for sign " \
+                               +"{} in {:.2f} s"
+                        print(text.format(mapper[cdx], filename, sign, wall))
+
+    @staticmethod
+    def _write_manifold_oscillators(oscillators, founddx, osc_dirs, manifolds, write_all_oscil,
+                                    profile=None, store=None):
+        # write the oscillator strengths summed over the degenerate initial and final manifolds
+        # the normal mode index is in the same column as the other oscillator files
+        if store is None: store = TxtStore()
+        manifold, first, degen = manifolds
+        template = ' '.join(['{:>5d}']*2 + ['{:>24.16E}']*2 + ['{:>6d}', '{:>7s}'] \
+                            + ['{:>5d}']*2)
+        for sign in ['minus', 'plus']:
+            nrow, ncol, oscil_temps, energy = oscillators[sign][:4]
+            start = clock()
+            mrow, mcol, oscil_temps, energy = sum_manifolds(nrow, ncol, oscil_temps, energy,
+                                                            manifold)
+            nrow, ncol = first[mrow]+1, first[mcol]+1
+            nrow_deg, ncol_deg = degen[mrow], degen[mcol]
+            if profile is not None:
+                profile.add('sum-manifolds', *elapsed(start), founddx=founddx)
+            for osc_dir, oscil in zip(osc_dirs, oscil_temps):
+                for cdx, osc in enumerate(oscil):
+                    if not write_all_oscil:
+                        keep = (osc > 0) & (oscil[0] > 0) & (energy > 0)
+                    else:
+                        keep = np.ones(osc.shape[0], dtype=bool)
+                    columns = [nrow[keep], ncol[keep], osc[keep], energy[keep], founddx, sign,
+                               nrow_deg[keep], ncol_deg[keep]]
+                    filename = os.path.join(osc_dir, 'oscillators-manifold-{}.txt'.format(cdx))
+                    start = clock()
+                    nbytes = store.append_rows(filename, template, columns)
+                    if profile is not None:
+                        profile.add('write-oscillators-manifold', *elapsed(start),
+                                    founddx=founddx, component=['iso', 'x', 'y', 'z'][cdx],
+                                    nbytes=nbytes)
+
+    @staticmethod
+    def _write_rotatory(oscillators, founddx, osc_dirs, write_all_oscil, profile=None,
+                        prune=None, store=None):
+        # write the rotatory strengths of the same transitions as the isotropic oscillators
+        if store is None: store = TxtStore()
+        template = ' '.join(['{:>5d}']*2 + ['{:>24.16E}']*2 + ['{:>6d}', '{:>7s}'])
+        for sign in ['minus', 'plus']:
+            nrow, ncol, oscil_temps, energy, rot_temps = oscillators[sign]
+            for osc_dir, oscil, rot in zip(osc_dirs, oscil_temps, rot_temps):
+                if not write_all_oscil and len(osc_dirs) > 1:
+                    keep = oscil[0] > 0
+                else:
+                    keep = None
+                if prune is not None:
+                    pruned = prune_oscil(nrow, oscil[0], **prune)
+                    keep = pruned if keep is None else keep & pruned
+                if keep is not None:
+                    arrs = (nrow[keep], ncol[keep], rot[keep], energy[keep])
+                else:
+                    arrs = (nrow, ncol, rot, energy)
+                start = clock()
+                nbytes = store.append_rows(os.path.join(osc_dir, 'rotatory.txt'), template,
+                                           list(arrs)+[founddx, sign])
+                if profile is not None:
+                    profile.add('write-rotatory', *elapsed(start), founddx=founddx,
+                                nbytes=nbytes)
+
+    @staticmethod
+    def _get_freq_range(select_fdx, nmodes):
+        ''' Get the one based indeces of the selected normal modes. '''
         if isinstance(select_fdx, (list, tuple, np.ndarray)):
+            if len(select_fdx) == 0:
+                return []
             if select_fdx[0] == -1 and len(select_fdx) == 1:
                 select_fdx = select_fdx[0]
             elif select_fdx[0] != -1:
@@ -226,55 +750,350 @@ class Vibronic:
         else:
             if isinstance(select_fdx, int): select_fdx = [select_fdx]
             freq_range = np.array(select_fdx) + 1
+        return freq_range
+
+    @classmethod
+    def _get_precision(cls, precision):
+        if precision not in cls._precisions:
+            raise ValueError("Precision {} not understood, must be one of {}".format(
+                                 precision, list(cls._precisions.keys())))
+        return cls._precisions[precision]
+
+    @staticmethod
+    def _get_temps(temp):
+        ''' Get the list of temperatures. '''
+        if isinstance(temp, (list, tuple, np.ndarray)):
+            return [float(val) for val in temp]
+        return [temp]
+
+    def _get_components(self, property):
+        '''
+        Get the properties of interest, the property and label of each of the stacked
+        components and where each property is found in the stack.
+        '''
+        if isinstance(property, str): property = [property]
+        properties = []
+        for prop_name in property:
+            prop_name = prop_name.replace('_', '-')
+            if prop_name not in self._properties:
+                raise NotImplementedError("Sorry the attribute that you are trying to use is " \
+                                         +"not yet implemented.")
+            if prop_name not in properties:
+                properties.append(prop_name)
+        components = []
+        prop_slices = {}
+        for prop_name in properties:
+            idx_map = self._properties[prop_name][2]
+            start = len(components)
+            components += [(prop_name, idx_map[idx]) for idx in sorted(idx_map.keys())]
+            prop_slices[prop_name] = slice(start, len(components))
+        return properties, components, prop_slices
+
+    def _read_mode_inputs(self):
+        ''' Read the displacements, reduced masses and frequencies of the normal modes. '''
+        config = self.config
+        delta = pd.read_csv(config.delta_file, header=None)
+        rmass = pd.read_csv(config.reduced_mass_file, header=None)
+        freq = pd.read_csv(config.frequency_file, header=None).values.reshape(-1,)
+        return delta, rmass, freq
+
+    def _load_zero_order(self, properties, print_stdout):
+        ''' Read the eigenvectors and parse the zero order data of the properties. '''
+        # read the eigvectors data
+        eigvectors = self._read_eigvectors(print_stdout)
+        eq_props, energies_sf, energies_so = self._parse_zero_order(properties)
+        return dict(eigvectors=eigvectors, eq_props=eq_props, energies_sf=energies_sf,
+                    energies_so=energies_so)
+
+    @staticmethod
+    def _hash_mode_inputs(fdx, nmodes, delta, rmass, freq):
+        ''' Get the hash of the inputs that only affect a single normal mode. '''
+        padding = 3
+        files = [os.path.join('confg'+str(idx).zfill(padding), 'ham-sf.txt')
+                 for idx in [fdx+1, fdx+1+nmodes]]
+        return hash_inputs(files, [delta.loc[fdx].values.tolist(),
+                                   rmass.loc[fdx].values.tolist(), freq[fdx]])
+
+    def _get_boltz(self, freq, temp, boltz_tol, boltz_states, print_stdout):
+        '''
+        Get the Boltzmann weighting of the minus and plus displacements of each normal mode.
+
+        Args:
+            freq (:obj:`numpy.array`): Frequencies of the normal modes in wavenumbers.
+            temp (:obj:`float`): Temperature for the boltzmann statistics.
+            boltz_tol (:obj:`float`): Tolerance value for the Boltzmann distribution cutoff.
+            boltz_states (:obj:`int`): Boltzmann states to calculate in the distribution.
+            print_stdout (:obj:`bool`): Print the distributions to stdout.
+
+        Returns:
+            boltz (:class:`pandas.DataFrame`): Boltzmann weighting of the minus and plus
+                                               displacements and the partition function.
+        '''
+        config = self.config
+        nmodes = config.number_of_modes
+        # calculate the boltzmann factors
+        boltz_factor = boltz_dist(freq, temp, boltz_tol, boltz_states)
+        cols = boltz_factor.columns.tolist()[:-3]
+        boltz = np.zeros((boltz_factor.shape[0], 2))
+        # sum the boltzmann factors as we will do the sme thing later on anyway
+        # important when looking at the oscillator strengths
+        for freqdx, data in boltz_factor.groupby('freqdx'):
+            boltz[freqdx][0] = np.sum([val*(idx) for idx, val in enumerate(data[cols].values[0])])
+            boltz[freqdx][1] = np.sum([val*(idx+1) for idx, val in enumerate(data[cols[:-1]].values[0])])
+        boltz = pd.DataFrame(boltz, columns=['minus', 'plus'])
+        boltz['freqdx'] = boltz_factor['freqdx']
+        boltz['partition'] = boltz_factor['partition']
+        boltz.index = boltz['freqdx'].values
+        # deprecated because there are issues with the printing algorithm
+        if print_stdout and False:
+            tmp = boltz_factor.copy()
+            tmp = tmp[tmp.columns[:-3]]
+            tmp = tmp.T
+            tmp.index = pd.Index(range(tmp.shape[0]), name='state')
+            tmp.columns = boltz_factor['freqdx']
+            print_cols = 6
+            text = " Printing Boltzmann populations for each normal mode with the\n" \
+                  +" energies from the {} file.".format(config.frequency_file)
+            print('='*78)
+            print(text)
+            print('-'*78)
+            print(dataframe_to_txt(tmp, float_format=['{:11.7f}'.format]*nmodes,
+                                   ncols=print_cols))
+            print('='*78)
+            tmp = boltz.copy()
+            tmp.index = tmp['freqdx']
+            tmp.drop(['freqdx'], inplace=True, axis=1)
+            tmp = tmp.T
+            print('\n\n')
+            text = " Printing the Boltzmann weighting for the plus an minus displaced\n" \
+                  +" and the respective partition function for each normal mode."
+            print('='*81)
+            print(text)
+            print('-'*81)
+            print(dataframe_to_txt(tmp, float_format=['{:11.7f}'.format]*nmodes,
+                                   ncols=print_cols))
+            print('='*81)
+            #print('-'*80)
+            #print("Printing the boltzmann distribution for all")
+            #print("of the available frequencies at a temperature: {:.2f}".format(temp))
+            #formatters = ['{:.7f}'.format, '{:.7f}'.format, '{:d}'.format, '{:.7f}'.format]
+            #print(boltz.to_string(index=False, formatters=formatters))
+            #print('-'*80)
+            #raise
+        return boltz
+
+    def _read_eigvectors(self, print_stdout):
+        ''' Read the eigenvectors and remove the small spin-free contributions. '''
+        config = self.config
+        eigvectors = open_txt(config.eigvectors_file).values
+        # mainly for testing purposes but this serves the purpose of limiting
+        # the contribution of the SOC from states that can cause some issues
+        # with the final intensities
+        if config.so_cont_tol is not None:
+            conts = abs2(eigvectors)
+            so_cont_limit = conts < config.so_cont_tol
+            eigvectors[so_cont_limit] = 0.0
+            conts = abs2(eigvectors)
+            if print_stdout:
+                print("*"*50)
+                print("Printing out sum of the percent contribution\n" \
+                      +"of each spin-orbit state after removing those\n" \
+                      +"less than {}".format(config.so_cont_tol))
+                print("*"*50)
+                print("Printing sorted and unsorted contributions.")
+                print("*"*50)
+                unsorted_ser = pd.Series(np.sum(conts, axis=1))
+                sorted_ser = unsorted_ser.copy().sort_values()
+                df_dict = {'so-index-sorted': sorted_ser.index,
+                           'sorted-contributions': sorted_ser.values,
+                           'so-index-unsorted': unsorted_ser.index,
+                           'unsorted-contributions': unsorted_ser.values}
+                df = pd.DataFrame.from_dict(df_dict)
+                print(df.to_string(index=False))
+        return eigvectors
+
+    def _parse_zero_order(self, properties):
+        '''
+        Parse the spin-free property values and the energies from the zero order file.
+
+        Args:
+            properties (:obj:`list`): Properties of interest. Must be keys of the
+                                      `_properties` attribute.
+
+        Returns:
+            eq_props (:obj:`numpy.array`): Spin-free property values with the components
+                                           of each property stacked in the order of the index
+                                           map.
+            energies_sf (:obj:`numpy.array`): Spin-free energies.
+            energies_so (:obj:`numpy.array`): Spin-orbit energies.
+        '''
+        nstates_sf = self.nstates_sf
+        config = self.config
+        ed = Output(config.zero_order_file)
+        all_props = []
+        for property in properties:
+            _, attr, idx_map = self._properties[property]
+            # get the property of choice from the zero order file given in the config file
+            # the extra column in each of the parsed properties comes from the component column
+            # in the molcas output parser
+            getattr(ed, 'parse_'+attr)()
+            ncomp = len(idx_map.keys())
+            self.check_size(getattr(ed, attr), (nstates_sf*ncomp, nstates_sf+1), attr)
+            grouped_data = getattr(ed, attr).groupby('component')
+            # for easier access
+            idx_map_rev = {v: k for k, v in idx_map.items()}
+            # stack the zero order property components in the order of the idx_map
+            eq_props = np.zeros((ncomp, nstates_sf, nstates_sf), dtype=np.float64)
+            for key, val in grouped_data:
+                prop = val.drop('component', axis=1).values
+                self.check_size(prop, (nstates_sf, nstates_sf), 'prop_{}'.format(key))
+                eq_props[idx_map_rev[key]-1] = prop
+            all_props.append(eq_props)
+        eq_props = np.concatenate(all_props)
+        # get the energies
+        energies_sf, energies_so = self._parse_energies(ed, config.sf_energies_file,
+                                                        config.so_energies_file)
+        return eq_props, energies_sf, energies_so
+
+    def _find_hamiltonians(self, select_fdx, nmodes, use_sqrt_rmass):
+        # read the hamiltonian files in each of the confg??? directories
+        # it is assumed that the directories are named confg with a 3-fold padded number (000)
+        padding = 3
+        found_modes = []
+        freq_range = self._get_freq_range(select_fdx, nmodes)
         nselected = len(freq_range)
+        files = []
         for idx in freq_range:
-            # error catching serves the purpose to know which
-            # of the hamiltonian files are missing
-            try:
-                plus = open_txt(os.path.join('confg'+str(idx).zfill(padding), 'ham-sf.txt'),
-                                fill=sparse_hamiltonian)
-                try:
-                    minus = open_txt(os.path.join('confg'+str(idx+nmodes).zfill(padding),
-                                                  'ham-sf.txt'), fill=sparse_hamiltonian)
-                except FileNotFoundError:
-                    warnings.warn("Could not find ham-sf.txt file for in directory " \
-                                  +'confg'+str(idx+nmodes).zfill(padding) \
-                                  +"\nIgnoring frequency index {}".format(idx), Warning)
-                    continue
-            except FileNotFoundError:
+            # find the normal modes where both of the hamiltonian files are available
+            # so that we know which of the hamiltonian files are missing
+            plus = os.path.join('confg'+str(idx).zfill(padding), 'ham-sf.txt')
+            minus = os.path.join('confg'+str(idx+nmodes).zfill(padding), 'ham-sf.txt')
+            missing = [fp for fp in [plus, minus] if not os.path.exists(fp)]
+            if missing:
                 warnings.warn("Could not find ham-sf.txt file for in directory " \
-                              +'confg'+str(idx).zfill(padding) \
+                              +os.path.dirname(missing[0]) \
                               +"\nIgnoring frequency index {}".format(idx), Warning)
                 continue
-            # put it all together only if both plus and minus
-            # ham-sf.txt files are found
-            plus_matrix.append(plus)
-            minus_matrix.append(minus)
+            files.append((plus, minus))
             found_modes.append(idx-1)
-        ham_plus = pd.concat(plus_matrix, ignore_index=True)
-        ham_minus = pd.concat(minus_matrix, ignore_index=True)
-        dham_dq = ham_plus - ham_minus
         if nselected != len(found_modes):
             warnings.warn("Number of selected normal modes is not equal to found modes, " \
                          +"currently, {} and {}\n".format(nselected, len(found_modes)) \
                          +"Overwriting the number of selceted normal modes by the number "\
                          +"of found modes.", Warning)
-            nselected = len(found_modes)
-        self.check_size(dham_dq, (self.nstates_sf*nselected, self.nstates_sf), 'dham_dq')
+        if not use_sqrt_rmass:
+            warnings.warn("We assume that you used non-mass-weighted displacements to generate " \
+                          +"the displaced structures. We cannot ensure that this actually works.",
+                          Warning)
+        return found_modes, files
+
+    def _read_mode_deriv(self, plus, minus, founddx, delta, redmass, use_sqrt_rmass,
+                         sparse_hamiltonian, out):
+        # difference of the plus and minus hamiltonians of a single normal mode
+        nstates_sf = self.nstates_sf
+        ham_plus = open_txt(plus, fill=sparse_hamiltonian).values
+        self.check_size(ham_plus, (nstates_sf, nstates_sf), 'ham_plus')
+        ham_minus = open_txt(minus, fill=sparse_hamiltonian).values
+        self.check_size(ham_minus, (nstates_sf, nstates_sf), 'ham_minus')
         # TODO: this division by the sqrt of the mass needs to be verified
         #       left as is for the time being as it was in the original code
-        sf_sqrt_rmass = np.repeat(np.sqrt(redmass.loc[found_modes].values*(1/conv.amu2u)),
-                                  self.nstates_sf).reshape(-1, 1)
-        sf_delta = np.repeat(delta.loc[found_modes].values, self.nstates_sf).reshape(-1, 1)
         if use_sqrt_rmass:
-            to_dq = 2 * sf_sqrt_rmass * sf_delta
+            sqrt_rmass = np.sqrt(redmass.loc[founddx].values*(1/conv.amu2u))[0]
+            to_dq = 2 * sqrt_rmass * delta.loc[founddx].values[0]
         else:
-            warnings.warn("We assume that you used non-mass-weighted displacements to generate " \
-                          +"the displaced structures. We cannot ensure that this actually works.",
-                          Warning)
-            to_dq = 2 * sf_delta
-        # convert to normal coordinates
-        dham_dq = dham_dq / to_dq
+            to_dq = 2 * delta.loc[founddx].values[0]
+        # convert to normal coordinates in place
+        # multiply by the reciprocal as numpy does for the complex values so the
+        # derivatives are the same as those of the complex data frames
+        np.subtract(np.real(ham_plus), np.real(ham_minus), out=out)
+        out *= 1/to_dq
+
+    def read_hamiltonian_deriv(self, select_fdx, delta, redmass, nmodes, use_sqrt_rmass,
+                               sparse_hamiltonian, scratch=None):
+        '''
+        Read the Hamiltonian txt files in the different confg directories one normal mode at a
+        time into a memory-mapped array of the derivatives. The difference of the plus and
+        minus displacements and the conversion to the normal coordinates are done in place so
+        only the Hamiltonians of a single normal mode are kept in memory.
+
+        Note:
+            The path of confg is hardcoded along with the names of the
+            SF Hamiltonian files as `'ham-sf.txt'`.
+
+            The array is backed by a temporary file in the `scratch` directory that is
+            removed when the array is no longer used. Only the real part of the Hamiltonians
+            is kept.
+
+        Args:
+            select_fdx (:obj:`list`): Zero based indeces of the normal modes.
+            delta (:class:`pandas.DataFrame`): Displacements used for each of the normal
+                                               modes. Read from the given `delta_file` input
+                                               in the configuration file.
+            redmass (:class:`pandas.DataFrame`): Reduced masses of each of the normal modes.
+                                                 Read from the given `redmass_file` input in
+                                                 the configuration file.
+            nmodes (:obj:`int`): The number of normal modes in the molecule.
+            use_sqrt_rmass (:obj:`bool`): The calculations used mass-weighted normal modes for
+                                          the displaced structures.
+            sparse_hamiltonian (:obj:`bool`): The input Hamiltonian files are sparse matrices
+                                              made up of block diagonal values.
+            scratch (:obj:`str`, optional): Directory of the temporary file. Defaults to
+                                            :code:`None` (the default temporary directory,
+                                            i.e. :code:`TMPDIR`).
+
+        Returns:
+            found_modes (:obj:`numpy.array`): Zero based indeces of the normal modes where both
+                                              Hamiltonian files were found.
+            dham_dq (:class:`numpy.memmap`): Derivatives of the Hamiltonian with respect to
+                                             each of the found normal modes with the shape
+                                             `(nfound, nstates_sf, nstates_sf)`.
+        '''
+        nstates_sf = self.nstates_sf
+        found_modes, files = self._find_hamiltonians(select_fdx, nmodes, use_sqrt_rmass)
+        dham_dq = _scratch_array((len(found_modes), nstates_sf, nstates_sf), scratch)
+        for fdx, (founddx, (plus, minus)) in enumerate(zip(found_modes, files)):
+            self._read_mode_deriv(plus, minus, founddx, delta, redmass, use_sqrt_rmass,
+                                  sparse_hamiltonian, dham_dq[fdx])
+        return np.array(found_modes, dtype=np.int64), dham_dq
+
+    def get_hamiltonian_deriv(self, select_fdx, delta, redmass, nmodes, use_sqrt_rmass,
+                              sparse_hamiltonian):
+        '''
+        Find and read all of the Hamiltonian txt files in the different confg
+        directories.
+
+        Note:
+            The path of confg is hardcoded along with the names of the
+            SF Hamiltonian files as `'ham-sf.txt'`.
+
+            All of the derivatives are put in a single data frame. Use
+            :meth:`read_hamiltonian_deriv` to get them one normal mode at a time without
+            holding all of them in memory.
+
+        Args:
+            select_fdx (int):
+            delta (pd.DataFrame): Data frame with all the delta values
+                        used for each of the normal mode displacements.
+                        Read from the given `delta_file` input in the
+                        configuration file.
+            redmass (pd.DataFrame): Data frame with all of the reduced
+                        masses for each of the normal modes. Read from
+                        the given `redmass_file` input in the
+                        configuration file.
+            nmodes (int): The number of normal modes in the molecule.
+            use_sqrt_rmass (bool):
+            sparse_hamiltonian (bool): Tell the program that the input
+                        Hamiltonian files are sparse matrices made up
+                        of block diagonal values.
+
+        Returns:
+            dham_dq (pd.DataFrame): Data frame with the derivative of
+                        the Hamiltonians with respect to the normal
+                        mode.
+        '''
+        found_modes, dham_dq = self.read_hamiltonian_deriv(select_fdx, delta, redmass, nmodes,
+                                                           use_sqrt_rmass, sparse_hamiltonian)
+        dham_dq = pd.DataFrame(dham_dq.reshape(-1, self.nstates_sf))
         # add a frequency index reference
         dham_dq['freqdx'] = np.repeat(found_modes, self.nstates_sf)
         return dham_dq
@@ -331,11 +1150,596 @@ class Vibronic:
         #                             'oscillator': oscil.reshape(-1,)})
         #self.mag_oscil = df
 
+    def estimate(self, property='electric_dipole', temp=298, select_fdx=-1, write_property=True,
+                 write_oscil=True, write_sf_oscil=False, write_sf_property=False,
+                 write_dham_dq=False, store=None, n_jobs=1, memory_budget=None,
+                 disk_budget=None, flop_rate=1e10, io_rate=5e7, print_stdout=True,
+                 precision='double', pipeline=False):
+        '''
+        Estimate the resources needed by :meth:`vibronic_coupling` without running it. Only the
+        configuration file and the sizes of the input files are used. The spin-orbit energies
+        file is only scanned line by line to count the states when a final state energy window
+        is given.
+
+        Args:
+            property (:obj:`str` or :obj:`list`, optional): Property or properties to calculate.
+                                                            Defaults to `'electric_dipole'`.
+            temp (:obj:`float` or :obj:`list`, optional): Temperature or temperatures.
+                                                          Defaults to 298.
+            select_fdx (:obj:`list`, optional): Zero based indeces of the normal modes.
+                                                Defaults to `-1` (all normal modes).
+            write_property (:obj:`bool`, optional): Write the vibronic property values and
+                                                    energies. Defaults to :code:`True`.
+            write_oscil (:obj:`bool`, optional): Write the vibronic oscillators. Defaults to
+                                                 :code:`True`.
+            write_sf_oscil (:obj:`bool`, optional): Write the spin-free vibronic oscillators.
+                                                    Defaults to :code:`False`.
+            write_sf_property (:obj:`bool`, optional): Write the spin-free vibronic property
+                                                       values. Defaults to :code:`False`.
+            write_dham_dq (:obj:`bool`, optional): Write the Hamiltonian derivatives. Defaults
+                                                   to :code:`False`.
+            store (:obj:`str`, optional): Filepath of the HDF5 store. The uncompressed size of
+                                          the datasets is used. Defaults to :code:`None`.
+            n_jobs (:obj:`int`, optional): Number of worker processes. Defaults to `1`.
+            memory_budget (:obj:`float`, optional): Warn when the peak memory in bytes is
+                                                    larger. Defaults to :code:`None`.
+            disk_budget (:obj:`float`, optional): Warn when the size of the outputs in bytes
+                                                  is larger. Defaults to :code:`None`.
+            flop_rate (:obj:`float`, optional): Floating point operations per second for the
+                                                time estimate. Defaults to `1e10`.
+            io_rate (:obj:`float`, optional): Bytes per second of text I/O for the time
+                                              estimate. Defaults to `5e7`.
+            print_stdout (:obj:`bool`, optional): Print the estimate. Defaults to
+                                                  :code:`True`.
+            precision (:obj:`str`, optional): Precision of the vibronic kernels. Either
+                                              `'double'` or `'single'`. Defaults to
+                                              `'double'`.
+            pipeline (:obj:`bool`, optional): Read, compute and write the normal modes in
+                                              separate stages. Defaults to :code:`False`.
+
+        Returns:
+            estimate (:class:`vibrav.core.estimate.ResourceEstimate`): Estimated resources.
+        '''
+        config = self.config
+        nstates = self.nstates
+        nstates_sf = self.nstates_sf
+        nmodes = config.number_of_modes
+        properties, components, _ = self._get_components(property)
+        ncomp = len(components)
+        calc_oscil = 'electric-dipole' in properties
+        ntemps = len(self._get_temps(temp))
+        nselect = len(self._get_freq_range(select_fdx, nmodes))
+        if n_jobs < 1:
+            n_jobs = os.cpu_count()
+        # number of initial and final states of the spin-orbit transitions
+        ninitial = nstates
+        if config.initial_states is not None:
+            ninitial = min(int(config.initial_states), nstates)
+        nfinal = nstates
+        window = config.final_energy_min is not None or config.final_energy_max is not None
+        if window and os.path.exists(config.so_energies_file):
+            nfinal = self._count_window(config.so_energies_file, config.final_energy_min,
+                                        config.final_energy_max)
+        ntrans = ninitial*nfinal
+        # the spin blocks have the spin-free states of a multiplicity for each of the
+        # spin projections
+        sf_mult = {}
+        for mult, state in zip(config.spin_multiplicity, config.number_of_states):
+            sf_mult[int(mult)] = sf_mult.get(int(mult), 0) + int(state)
+        block_size = sum([mult*state**2 for mult, state in sf_mult.items()])
+        est = ResourceEstimate('the vibronic coupling', flop_rate=flop_rate, io_rate=io_rate)
+        # bytes of the real values computed by the vibronic kernels
+        real = np.dtype(self._get_precision(precision)[0]).itemsize
+        # input files
+        padding = 3
+        for idx in self._get_freq_range(select_fdx, nmodes):
+            for jdx in [idx, idx+nmodes]:
+                fp = os.path.join('confg'+str(jdx).zfill(padding), 'ham-sf.txt')
+                if os.path.exists(fp):
+                    est.add('input', 'hamiltonian files', os.path.getsize(fp))
+        for fp in [config.eigvectors_file, config.zero_order_file]:
+            if os.path.exists(fp):
+                est.add('input', fp, os.path.getsize(fp))
+        # normal modes that are being computed or waiting to be written
+        inflight = 1 if n_jobs == 1 else 2*n_jobs
+        if pipeline:
+            # the completed normal modes waiting to be written
+            inflight += pipeline_queue_size
+        # arrays that are kept for the whole calculation
+        est.add('memory', 'eigenvectors', 16*nstates**2)
+        est.add('memory', 'zero order property values', 8*ncomp*nstates_sf**2)
+        est.add('memory', 'energy denominators', 8*nstates_sf**2)
+        if real != 8:
+            # the double precision arrays are kept for the reference of the first normal mode
+            est.add('memory', 'eigenvectors', 2*real*nstates**2)
+            est.add('memory', 'zero order property values', real*ncomp*nstates_sf**2)
+            est.add('memory', 'energy denominators', real*nstates_sf**2)
+        # the plus and minus hamiltonians of a single normal mode are complex and the
+        # derivatives are memory-mapped so only the pages of the current normal modes
+        # are resident
+        est.add('memory', 'hamiltonians', 2*16*nstates_sf**2)
+        # the derivatives of the normal modes that have been read ahead
+        ahead = pipeline_queue_size if pipeline else 0
+        est.add('memory', 'hamiltonian derivatives',
+                min(nselect, inflight+ahead)*8*nstates_sf**2)
+        # arrays of each normal mode that is being computed or waiting to be written
+        est.add('memory', 'spin-free derivatives', inflight*3*real*ncomp*nstates_sf**2)
+        est.add('memory', 'eigenvector transformation',
+                inflight*2*real*ncomp*ninitial*(nstates+nfinal))
+        est.add('memory', 'vibronic property values', inflight*3*2*real*ncomp*ntrans)
+        if write_sf_property:
+            est.add('memory', 'spin-free values extended to spin-orbit',
+                    inflight*3*real*ncomp*nstates**2)
+        if calc_oscil and write_oscil:
+            # the compact arrays and the text of a single file
+            est.add('memory', 'oscillators', ntrans*(24+32*ntemps) + 2*ntrans*78)
+        # output files
+        # the lines of the matrix and oscillator files have a fixed width
+        matrix_line = 55
+        oscil_line = 78
+        if write_property:
+            if store is None:
+                est.add('output', 'vibronic property values',
+                        nselect*2*ncomp*(ntrans*matrix_line+54))
+                est.add('output', 'vibronic energies', nselect*2*(nstates*16+25))
+            else:
+                est.add('output', 'vibronic property values',
+                        nselect*2*ncomp*ntrans*2*real)
+                est.add('output', 'vibronic energies', nselect*2*nstates*8)
+        if write_sf_property:
+            size = ncomp*(nstates_sf**2 + nstates**2)
+            est.add('output', 'spin-free vibronic property values',
+                    nselect*2*(size*matrix_line if store is None else size*real))
+        if write_dham_dq:
+            est.add('output', 'hamiltonian derivatives',
+                    nselect*nstates_sf**2*(matrix_line if store is None else 16))
+        if calc_oscil and write_oscil:
+            est.add('output', 'oscillators', nselect*2*4*ntemps*ntrans*oscil_line)
+        if calc_oscil and write_sf_oscil:
+            est.add('output', 'spin-free oscillators',
+                    nselect*2*4*ntemps*nstates_sf**2*oscil_line)
+        # floating point operations
+        est.add('flops', 'spin-free derivatives', nselect*4*ncomp*nstates_sf**3)
+        # real times complex for the spin blocks and complex times complex for the
+        # second half of the transformation
+        est.add('flops', 'eigenvector transformation',
+                nselect*ncomp*ninitial*(4*block_size + 8*nstates*nfinal))
+        if calc_oscil and write_oscil:
+            est.add('flops', 'oscillators', nselect*2*ntrans*(4*ncomp+4*ntemps))
+        if calc_oscil and write_sf_oscil:
+            est.add('flops', 'spin-free oscillators',
+                    nselect*2*nstates_sf**2*(4*ncomp+4*ntemps))
+        if print_stdout:
+            print(est.to_string())
+        est.check(memory_budget=memory_budget, disk_budget=disk_budget)
+        return est
+
+    def iter_modes(self, property, temp=298, print_stdout=False, verbose=False,
+                   use_sqrt_rmass=True, select_fdx=-1, boltz_states=None, boltz_tol=1e-6,
+                   oscil=True, sf_oscil=False, all_oscil=False, sf_property=False, n_jobs=1,
+                   executor=None, sparse_eigvectors=None, sparse_fill=0.1, zero_order=None,
+                   profile=None, rotatory=False, precision='double', pipeline=False):
+        '''
+        Compute the vibronic coupling of each normal mode without writing anything to disk.
+        All of the setup (parsing the zero order data, the Hamiltonian derivatives and the
+        energy denominators) is done when this method is called and a generator is returned
+        that computes the normal modes one at a time. Only the results of the current normal
+        mode are kept in memory so the results can be analyzed and dropped as they are
+        computed. :meth:`vibronic_coupling` writes the files from the same results.
+
+        The Boltzmann weighting of each temperature is available in the `boltz` attribute
+        after calling this method. With the single precision the deviations of the first normal
+        mode from the double precision values are available in the `precision_report`
+        attribute once it has been computed.
+
+        Args:
+            property (:obj:`str` or :obj:`list`): Property or properties of interest to
+                                                  calculate.
+            temp (:obj:`float` or :obj:`list`, optional): Temperature or temperatures for the
+                                                          boltzmann statistics of the
+                                                          oscillators. Defaults to 298.
+            print_stdout (:obj:`bool`, optional): Print the progress to stdout. Defaults to
+                                                  :code:`False`.
+            verbose (:obj:`bool`, optional): Record the timings of both of the eigenvector
+                                             transformations of the first normal mode in the
+                                             profile as the `so-transform-dense` and
+                                             `so-transform-sparse` stages. Defaults to
+                                             :code:`False`.
+            use_sqrt_rmass (:obj:`bool`, optional): The calculations used mass-weighted normal
+                                                    modes for the displaced structures.
+                                                    Defaults to :code:`True`.
+            select_fdx (:obj:`list`, optional): Zero based indeces of the normal modes to
+                                                compute. Defaults to `-1` (all normal modes).
+            boltz_states (:obj:`int`, optional): Boltzmann states to calculate in the
+                                                 distribution. Defaults to :code:`None`.
+            boltz_tol (:obj:`float`, optional): Tolerance value for the Boltzmann distribution
+                                                cutoff. Defaults to `1e-6`.
+            oscil (:obj:`bool`, optional): Compute the spin-orbit oscillator strengths. Only
+                                           available for the electric dipole. Defaults to
+                                           :code:`True`.
+            sf_oscil (:obj:`bool`, optional): Compute the spin-free oscillator strengths.
+                                              Defaults to :code:`False`.
+            all_oscil (:obj:`bool`, optional): Keep all of the transitions instead of only those
+                                               that are physically meaningful. Defaults to
+                                               :code:`False`.
+            sf_property (:obj:`bool`, optional): Keep the spin-free vibronic property values
+                                                 and those extended to the number of spin-orbit
+                                                 states. Defaults to :code:`False`.
+            n_jobs (:obj:`int`, optional): Number of worker processes to distribute the normal
+                                           modes over. Defaults to `1`.
+            executor (:class:`concurrent.futures.Executor`, optional): Executor to submit the
+                                                                       normal modes to.
+                                                                       Defaults to :code:`None`.
+            sparse_eigvectors (:obj:`bool`, optional): Use the sparse eigenvector
+                                                       transformation. Defaults to :code:`None`
+                                                       (decided by `sparse_fill`).
+            sparse_fill (:obj:`float`, optional): Fraction of non-zero eigenvector coefficients
+                                                  below which the sparse transformation is used.
+                                                  Defaults to `0.1`.
+            zero_order (:obj:`dict`, optional): Already parsed eigenvectors (`eigvectors`),
+                                                spin-free property values (`eq_props`) and
+                                                energies (`energies_sf` and `energies_so`) of
+                                                the properties. Defaults to :code:`None` (parse
+                                                them from the files in the configuration file).
+            profile (:class:`vibrav.vibronic.profiling.Profile`, optional): Profile to record
+                                                                            the timings of the
+                                                                            setup and of each
+                                                                            normal mode in.
+                                                                            Defaults to
+                                                                            :code:`None`.
+            rotatory (:obj:`bool`, optional): Compute the electric and magnetic dipoles together
+                                              and the rotatory strengths of the same transitions
+                                              as the spin-orbit oscillators. Both properties are
+                                              added to the requested ones. Defaults to
+                                              :code:`False`.
+            precision (:obj:`str`, optional): Precision of the sum over states, the spin
+                                              expansion and the eigenvector transformation.
+                                              Either `'double'` or `'single'`. The Hamiltonian
+                                              derivatives, the energy denominators, the
+                                              oscillator strengths and the Boltzmann weighting
+                                              are always computed in double precision. With
+                                              `'single'` the first normal mode is also computed
+                                              in double precision for the report of the
+                                              deviations. Defaults to `'double'`.
+            pipeline (:obj:`bool`, optional): Read the Hamiltonian files of the next normal
+                                              modes in a background thread while the current
+                                              normal mode is computed instead of reading all of
+                                              them when this method is called. Defaults to
+                                              :code:`False`.
+
+        Returns:
+            modes (:obj:`generator`): Generator of the
+                                      :class:`vibrav.vibronic.results.ModeResult` of each
+                                      normal mode in the order of the found normal modes.
+
+        Raises:
+            NotImplementedError: When the property requested with the `property` parameter
+                                 does not have any output parser or just has not been coded
+                                 yet.
+            ValueError: When there are no spin-orbit states in the final state energy window
+                        or the precision is not understood.
+        '''
+        store_gs_degen = True
+        # to reduce typing
+        nstates = self.nstates
+        nstates_sf = self.nstates_sf
+        config = self.config
+        # define constants used later on
+        speed_of_light_au = speed_of_light*Length['m', 'au']/Time['s', 'au']
+        planck_constant_au = 2*np.pi
+        # TODO: these hardcoded values need to be generalized
+        # this was used in the old script but needs to be fixed
+        fc = 1
+        real, cplx = self._get_precision(precision)
+        self.precision_report = None
+        if profile is None:
+            profile = Profile()
+        # read all of the data files
+        with profile.stage('read-mode-inputs'):
+            delta, rmass, freq = self._read_mode_inputs()
+        nmodes = config.number_of_modes
+        # calculate the boltzmann factors
+        with profile.stage('boltzmann'):
+            boltz = [self._get_boltz(freq, val, boltz_tol, boltz_states, print_stdout)
+                     for val in self._get_temps(temp)]
+        self.boltz = boltz
+        # make a multiplicity array for extending the derivative arrays from spin-free
+        # states to spin-orbit states
+        multiplicity = []
+        for idx, mult in enumerate(config.spin_multiplicity):
+            multiplicity.append(np.repeat(int(mult), int(config.number_of_states[idx])))
+        multiplicity = np.concatenate(tuple(multiplicity))
+        self.check_size(multiplicity, (nstates_sf,), 'multiplicity')
+        # all of the properties are computed with the same hamiltonian derivatives
+        # and energy denominators
+        if rotatory:
+            if isinstance(property, str): property = [property]
+            property = list(property) + ['electric-dipole', 'magnetic-dipole']
+        properties, components, prop_slices = self._get_components(property)
+        calc_oscil = 'electric-dipole' in properties
+        if zero_order is None:
+            with profile.stage('zero-order-parse'):
+                zero_order = self._load_zero_order(properties, print_stdout)
+        eigvectors = zero_order['eigvectors']
+        eq_props = zero_order['eq_props']
+        energies_sf = zero_order['energies_sf']
+        energies_so = zero_order['energies_so']
+        self.check_size(eigvectors, (nstates, nstates), 'eigvectors')
+        # use the sparse transformation when most of the eigen vector coefficients
+        # have been removed
+        fill = np.count_nonzero(eigvectors)/eigvectors.size
+        use_sparse = sparse_eigvectors
+        if use_sparse is None:
+            use_sparse = fill < sparse_fill
+        if use_sparse:
+            try:
+                eigvectors_csr = _csr_matrix(eigvectors)
+            except ImportError:
+                if sparse_eigvectors: raise
+                warnings.warn("Could not import scipy. Using the dense eigenvector " \
+                              +"transformation. Install it with `pip install vibrav[sparse]`.",
+                              Warning)
+                use_sparse = False
+                eigvectors_csr = None
+        elif verbose:
+            # only used to time the sparse transformation
+            try:
+                eigvectors_csr = _csr_matrix(eigvectors)
+            except ImportError:
+                eigvectors_csr = None
+        else:
+            eigvectors_csr = None
+        if print_stdout:
+            print("Non-zero eigenvector coefficients: {:.2f}%. ".format(fill*100) \
+                  +"Using the {} transformation.".format('sparse' if use_sparse else 'dense'))
+        # get the hamiltonian derivatives of the selected normal modes
+        select_modes = [fdx-1 for fdx in self._get_freq_range(select_fdx, nmodes)]
+        if not select_modes:
+            found_modes = []
+            loaded = []
+        elif pipeline:
+            # the hamiltonian files of each normal mode are read when the derivatives are
+            # needed by the background thread
+            found_modes, files = self._find_hamiltonians(select_modes, nmodes, use_sqrt_rmass)
+            dham_dq = _scratch_array((len(found_modes), nstates_sf, nstates_sf))
+            def read():
+                for fdx, (founddx, (plus, minus)) in enumerate(zip(found_modes, files)):
+                    with profile.stage('hamiltonian-read', founddx):
+                        self._read_mode_deriv(plus, minus, founddx, delta, rmass,
+                                              use_sqrt_rmass, config.sparse_hamiltonian,
+                                              dham_dq[fdx])
+                    yield fdx
+            loaded = read()
+        else:
+            with profile.stage('hamiltonian-read'):
+                found_modes, dham_dq = self.read_hamiltonian_deriv(select_modes, delta, rmass,
+                                                                   nmodes, use_sqrt_rmass,
+                                                                   config.sparse_hamiltonian)
+            loaded = range(len(found_modes))
+        # deprecated
+        #if eq_cont:
+        #    # get the spin-orbit property from the molcas output for the equilibrium geometry
+        #    dfs = []
+        #    for file in glob(so_file+'-?.txt'):
+        #        idx = int(file.split('-')[-1].replace('.txt', ''))
+        #        df = open_txt(file)
+        #        # use a mapper as we cannot ensure that the files are found in any
+        #        # expected order
+        #        df['component'] = idx_map[idx]
+        #        dfs.append(df)
+        #    so_props = pd.concat(dfs, ignore_index=True)
+        #
+        # more testing things but this will only include a select number of the
+        # sf states in the SOS equations
+        if config.states is not None:
+            incl_states = self._get_states(energies_sf, config.states)
+        else:
+            incl_states = None
+        # the energy denominators do not depend on the normal mode or component
+        # so we only build them once
+        with profile.stage('energy-denominators'):
+            denom = get_energy_denominator(energies_sf, config.degen_delta,
+                                           incl_states=incl_states)
+        degeneracy = energetic_degeneracy(energies_so, config.degen_delta)
+        gs_degeneracy = degeneracy.loc[0, 'degen']
+        if print_stdout:
+            print("--------------------------------------------")
+            print("Spin orbit ground state was found to be: {:3d}".format(gs_degeneracy))
+            print("--------------------------------------------")
+        if store_gs_degen: self.gs_degeneracy = gs_degeneracy
+        # the degenerate manifolds of the spin-orbit states for the summed oscillators
+        self.so_manifolds = get_manifolds(degeneracy, energies_so.shape[0])
+        # only the transitions from the initial states to the final states are computed
+        initial, final = self._get_windows(energies_so, config.initial_states,
+                                           config.final_energy_min, config.final_energy_max,
+                                           config.degen_delta)
+        if print_stdout and (initial is not None or final is not None):
+            print("Computing the transitions from {} initial states to {} final states.".format(
+                      nstates if initial is None else initial.shape[0],
+                      nstates if final is None else final.shape[0]))
+        # the double precision arrays are kept to compute the reference of the first
+        # normal mode
+        reference = None
+        if precision != 'double':
+            reference = {'eq_props': eq_props, 'denom': denom, 'multiplicity': multiplicity,
+                         'eigvectors': eigvectors_csr if use_sparse else eigvectors}
+            eq_props = eq_props.astype(real)
+            denom = denom.astype(real)
+            eigvectors = eigvectors.astype(cplx)
+            if eigvectors_csr is not None:
+                eigvectors_csr = eigvectors_csr.astype(cplx)
+        # get the hamiltonian derivatives and prefactors of each of the normal modes
+        def prepare(loaded):
+            for fdx in loaded:
+                founddx = found_modes[fdx]
+                # view of the memory-mapped array
+                dham_dq_mode = dham_dq[fdx]
+                self.check_size(dham_dq_mode, (nstates_sf, nstates_sf), 'dham_dq_mode')
+                deriv = dham_dq_mode
+                if config.dham_dq_tol is not None:
+                    # remove the numerical noise of the finite differences so only the
+                    # non-zero elements are used in the sum over states
+                    # the memory-mapped array is left as is so the written derivatives are
+                    # the ones that were read
+                    deriv = get_csr(np.where(np.abs(dham_dq_mode) < config.dham_dq_tol, 0.0,
+                                             dham_dq_mode))
+                    if deriv[0].shape[0] == 0:
+                        # the normal mode is not computed but it still has the same outputs
+                        # as all of the others
+                        warnings.warn("All of the Hamiltonian derivatives are below " \
+                                      +"dham_dq_tol.\nThe vibronic property values of " \
+                                      +"frequency index {} are zero.".format(founddx+1),
+                                      Warning)
+                tdm_prefac = np.sqrt(planck_constant_au \
+                                     /(2*speed_of_light_au*freq[founddx]/Length['cm', 'au'])) \
+                             /(2*np.pi)
+                yield founddx, dham_dq_mode, (fdx, deriv, tdm_prefac, components, nstates)
+        if pipeline:
+            # read the next normal modes while the current one is computed
+            prepared = prefetch(prepare(loaded))
+        else:
+            prepared = list(prepare(loaded))
+        # the normal modes that have been handed to the computation and are waiting for
+        # their results
+        pending = deque()
+        # the normal modes without any Hamiltonian derivatives above dham_dq_tol
+        is_zero = lambda item: isinstance(item[2][1], tuple) and item[2][1][0].shape[0] == 0
+        def tasks():
+            for item in prepared:
+                pending.append(item)
+                if not is_zero(item):
+                    yield item[2]
+        shared = {'eq_props': eq_props, 'denom': denom, 'multiplicity': multiplicity}
+        if executor is None and n_jobs == 1:
+            # compute everything in this process
+            shared['eigvectors'] = eigvectors_csr if use_sparse else eigvectors
+            results = (_compute_mode(*task, fc=fc, extend_so=sf_property,
+                                     initial=initial, final=final, **shared)
+                       for task in tasks())
+        else:
+            if use_sparse:
+                shared['eigvectors_data'] = eigvectors_csr.data
+                shared['eigvectors_indices'] = eigvectors_csr.indices
+                shared['eigvectors_indptr'] = eigvectors_csr.indptr
+            else:
+                shared['eigvectors'] = eigvectors
+            # results are returned in the order of the found modes so the output files
+            # are identical to a serial run
+            results = _parallel_modes(tasks(), shared, n_jobs=n_jobs, executor=executor, fc=fc,
+                                      extend_so=sf_property, initial=initial, final=final)
+        # the property values are stored as the transpose so they are put back in
+        # the orientation of the written files
+        split = lambda values: {prop_name: np.transpose(values[:, sl], (0, 1, 3, 2))
+                                for prop_name, sl in prop_slices.items()}
+        def zero_mode():
+            # the vibronic property values of a normal mode that is not computed
+            ncomp = len(components)
+            nfinal = nstates if final is None else final.shape[0]
+            ninitial = nstates if initial is None else initial.shape[0]
+            vib_prop = np.zeros((2, ncomp, nfinal, ninitial), dtype=cplx)
+            vib_prop_sf = np.zeros((2, ncomp, nstates_sf, nstates_sf), dtype=real)
+            vib_prop_sf_so_len = np.zeros((2, ncomp, nstates, nstates), dtype=real) \
+                                    if sf_property else None
+            return vib_prop, vib_prop_sf, vib_prop_sf_so_len, {}
+        def ordered():
+            # the results of the computed normal modes with the ones that are not computed
+            # put back in their place
+            for values in results:
+                while is_zero(pending[0]):
+                    yield pending.popleft(), zero_mode()
+                yield pending.popleft(), values
+            while pending:
+                yield pending.popleft(), zero_mode()
+        def modes():
+            nonzero = []
+            start = clock()
+            first = True
+            try:
+                for item, (vib_prop, vib_prop_sf, vib_prop_sf_so_len, timings) in ordered():
+                    founddx, dham_dq_mode, task = item
+                    zero = is_zero(item)
+                    # the time spent waiting for the worker processes is kept along with the
+                    # timings of each of the steps in the worker process
+                    if not zero:
+                        timings['compute'] = elapsed(start)
+                    tdm_prefac = task[2]
+                    if config.dham_dq_tol is not None:
+                        nonzero.append(task[1][0].shape[0])
+                    # the checks are done with the first normal mode that is computed
+                    check = first and not zero
+                    if check:
+                        first = False
+                    if verbose and check:
+                        self._time_transforms(profile, founddx, vib_prop_sf, timings,
+                                              multiplicity, eigvectors, eigvectors_csr,
+                                              use_sparse, initial, final)
+                    if reference is not None and check:
+                        with profile.stage('precision-check', founddx):
+                            ref = _compute_mode(*task, fc=fc, initial=initial,
+                                                final=final, **reference)
+                            self.precision_report = self._precision_report(
+                                                        founddx, components,
+                                                        [vib_prop, vib_prop_sf], ref[:2])
+                        if print_stdout:
+                            print("Maximum deviation from double precision for normal " \
+                                  +"mode {}:".format(founddx+1))
+                            print(self.precision_report.to_string(index=False))
+                    evib = freq[founddx]*conv.inv_m2Ha*100
+                    energies = {sign: self._get_vib_energies(energies_so, evib, gs_degeneracy,
+                                                             sign)
+                                for sign in ['minus', 'plus']}
+                    # calculate the oscillator strengths
+                    start = clock()
+                    so_oscil = None
+                    sf_oscils = None
+                    if calc_oscil and (oscil or rotatory) and zero and not all_oscil:
+                        # none of the transitions have a positive oscillator strength
+                        so_oscil = self._zero_oscillators(len(boltz), rotatory)
+                    elif calc_oscil and (oscil or rotatory):
+                        sl = prop_slices['electric-dipole']
+                        mag_prop = vib_prop[:, prop_slices['magnetic-dipole']] \
+                                        if rotatory else None
+                        so_oscil = self._compute_oscillators(vib_prop[:, sl], energies_so, evib,
+                                                             boltz, founddx, all_oscil,
+                                                             initial=initial, final=final,
+                                                             mag_prop=mag_prop)
+                    if calc_oscil and sf_oscil and zero and not all_oscil:
+                        sf_oscils = self._zero_oscillators(len(boltz))
+                    elif calc_oscil and sf_oscil:
+                        sl = prop_slices['electric-dipole']
+                        sf_oscils = self._compute_oscillators(vib_prop_sf[:, sl], energies_sf,
+                                                              evib, boltz, founddx, all_oscil)
+                    timings['oscillators'] = elapsed(start)
+                    for key, val in timings.items():
+                        profile.add(key, *val, founddx=founddx)
+                    yield ModeResult(founddx, tdm_prefac, evib, split(vib_prop), energies,
+                                     dham_dq_mode,
+                                     sf_properties=split(vib_prop_sf) if sf_property else None,
+                                     sf_so_len_properties=split(vib_prop_sf_so_len) \
+                                                          if sf_property else None,
+                                     oscil=so_oscil, sf_oscil=sf_oscils, initial=initial,
+                                     final=final, timings=timings)
+                    start = clock()
+            finally:
+                results.close()
+                if pipeline:
+                    prepared.close()
+            if print_stdout and nonzero:
+                print("Non-zero Hamiltonian derivative elements: " \
+                      +"{:.2f}%.".format(np.mean(nonzero)/nstates_sf**2*100))
+        return modes()
+
     def vibronic_coupling(self, property, write_property=True, write_energy=True, write_oscil=True,
                           print_stdout=True, temp=298, eq_cont=False, verbose=False,
                           use_sqrt_rmass=True, select_fdx=-1, boltz_states=None, boltz_tol=1e-6,
                           write_sf_oscil=False, write_sf_property=False, write_dham_dq=False,
-                          write_all_oscil=False):
+                          write_all_oscil=False, n_jobs=1, executor=None, store=None,
+                          store_compression='gzip', checkpoint=False, resume=False,
+                          incremental=False, spectrum=None, sparse_eigvectors=None,
+                          sparse_fill=0.1, profile=False, write_rotatory=False, shard=None,
+                          precision='double', pipeline=False, async_write=False,
+                          write_manifold_oscil=False, oscil_tol=None, oscil_rel_tol=None,
+                          oscil_top_n=None):
         '''
         Vibronic coupling method to calculate the vibronic coupling by the equations as given
         in reference *J. Phys. Chem. Lett.* **2018**, 9, 887-894. This code follows a similar structure
@@ -357,7 +1761,10 @@ class Vibronic:
             per-system basis. **We make no guarantees everything will work out of the box**.
 
         Args:
-            property (:obj:`str`): Property of interest to calculate.
+            property (:obj:`str` or :obj:`list`): Property of interest to calculate. A list of
+                                                  properties will compute all of them in one
+                                                  pass with the same Hamiltonian derivatives
+                                                  and eigenvector transformations.
             write_property (:obj:`bool`, optional): Write the calculated vibronic property values to file.
                                                     Defaults to `True`.
             write_energy (:obj:`bool`, optional): Write the vibronic energies to file.
@@ -366,7 +1773,13 @@ class Vibronic:
                                                  Defaults to `True`.
             print_stdout (:obj:`bool`, optional): Print the progress of the script to stdout.
                                                   Defaults to `True`.
-            temp (:obj:`float`, optional): Temperature for the boltzmann statistics. Defaults to 298.
+            temp (:obj:`float` or :obj:`list`, optional): Temperature for the boltzmann statistics.
+                                                          For a list of temperatures the
+                                                          oscillators and Boltzmann populations
+                                                          of each temperature are written to a
+                                                          `vibronic-outputs/{temp}K` directory.
+                                                          The vibronic property values are only
+                                                          computed once. Defaults to 298.
             verbose (:obj:`bool`, optional): Send all availble print statements listing where the
                             program is in the calculation to stdout and timings. Recommended if
                             you have a system with many spin-orbit states. Defaults to `False`.
@@ -391,11 +1804,175 @@ class Vibronic:
                                                      oscillator values instead of only those that
                                                      are physically meaningful (positive energy and
                                                      oscillator value). Defaults to `False`.
+            n_jobs (:obj:`int`, optional): Number of worker processes to distribute the normal
+                                           modes over. The eigenvectors, energy denominators and
+                                           zero order property values are placed in shared memory.
+                                           A value less than 1 will use all of the available
+                                           cores. Defaults to `1` (everything is computed in
+                                           the main process).
+            executor (:class:`concurrent.futures.Executor`, optional): Executor to submit the
+                                           normal modes to instead of creating a process pool.
+                                           Must run on the same node as the shared memory is
+                                           used. `n_jobs` is only used to limit the number of
+                                           modes submitted at any given time. Defaults to `None`.
+            store (:obj:`str`, optional): Filepath of an HDF5 file to write the property values,
+                                          energies and hamiltonian derivatives to instead of the
+                                          text files in the `vib###` directories. See
+                                          :class:`vibrav.vibronic.store.HDF5Store`. Defaults to
+                                          `None`.
+            store_compression (:obj:`str`, optional): Compression filter for the datasets in the
+                                                      HDF5 file. Defaults to `'gzip'`.
+            checkpoint (:obj:`bool`, optional): Record the completed normal modes and the parsed
+                                                zero order data in the `vibronic-outputs`
+                                                directory so that the calculation can be resumed.
+                                                See :class:`vibrav.vibronic.checkpoint.Checkpoint`.
+                                                Defaults to `False`.
+            resume (:obj:`bool`, optional): Resume an interrupted calculation from the checkpoint
+                                            in the `vibronic-outputs` directory. The completed
+                                            normal modes are skipped and the output of the
+                                            interrupted normal mode is discarded. The settings
+                                            must be the same as the interrupted calculation.
+                                            Implies `checkpoint=True`. Defaults to `False`.
+            incremental (:obj:`bool`, optional): Only compute the normal modes whose inputs have
+                                                 changed since the last calculation with a
+                                                 checkpoint. The content of the Hamiltonian files
+                                                 of the displaced structures, the displacement,
+                                                 reduced mass and frequency of each normal mode
+                                                 are hashed. Everything is computed again if any
+                                                 of the other inputs or settings changed. The new
+                                                 values are spliced into the existing output.
+                                                 Implies `checkpoint=True`. Defaults to `False`.
+            spectrum (:class:`vibrav.vibronic.spectrum.Spectrum`, optional): Accumulate the
+                                                 spin-orbit oscillator strengths of each normal
+                                                 mode on the energy grid of the spectrum and
+                                                 write the broadened isotropic and component
+                                                 spectra to `spectrum.csv` next to the
+                                                 oscillator files. Only available for the
+                                                 electric dipole. Does not need the oscillator
+                                                 files to be written. Defaults to `None`.
+            sparse_eigvectors (:obj:`bool`, optional): Store the eigenvectors as a sparse matrix
+                                                       for the transformation of the spin-free
+                                                       derivatives. Requires the `scipy`
+                                                       package (`sparse` extra). Defaults to
+                                                       `None` (use the sparse transformation
+                                                       when the fraction of non-zero
+                                                       coefficients is less than
+                                                       `sparse_fill`).
+            sparse_fill (:obj:`float`, optional): Fraction of non-zero eigenvector coefficients
+                                                  below which the sparse transformation is used.
+                                                  Typically only reached when removing the small
+                                                  contributions with the `so_cont_tol` input.
+                                                  With `verbose` the timings of both
+                                                  transformations are recorded in the profile.
+                                                  Defaults to `0.1`.
+            profile (:obj:`bool`, optional): Write the wall and CPU times of each stage for
+                                             each normal mode and component, the bytes written
+                                             and the peak memory to
+                                             `vibronic-outputs/profile.json`. Defaults to
+                                             `False`.
+            write_rotatory (:obj:`bool`, optional): Compute the vibronic electric and magnetic
+                                                    dipoles in the same run and write the
+                                                    rotatory strengths of the spin-orbit
+                                                    transitions to `rotatory.txt` next to the
+                                                    oscillator files. The property values of
+                                                    the properties that were not requested are
+                                                    not written. Defaults to `False`.
+            shard (:obj:`str` or :obj:`tuple`, optional): Only compute a deterministic subset
+                                                          of the selected normal modes given as
+                                                          `'index/count'` (i.e. `'3/8'`). The
+                                                          outputs that are not written per normal
+                                                          mode are written to
+                                                          `vibronic-outputs/shard-3-of-8` and an
+                                                          HDF5 store is written to that directory
+                                                          with the same file name. Combine the
+                                                          shards with
+                                                          :func:`vibrav.vibronic.shard.merge_shards`.
+                                                          Defaults to `None`.
+            precision (:obj:`str`, optional): Compute the sum over states, the spin expansion
+                                              and the eigenvector transformation in `'single'`
+                                              or `'double'` precision. The single precision
+                                              property values are written as they are and the
+                                              maximum deviations of the first normal mode from
+                                              the double precision values are written to
+                                              `vibronic-outputs/precision-report.csv`. Defaults
+                                              to `'double'`.
+            pipeline (:obj:`bool`, optional): Overlap the reading of the Hamiltonian files, the
+                                              computation and the writing of the files. The
+                                              Hamiltonian files of the next normal modes are
+                                              read in one background thread and the completed
+                                              normal modes are written in another one while the
+                                              current normal mode is computed. Only a few normal
+                                              modes wait between the stages. The written files
+                                              are the same. Defaults to :code:`False`.
+            async_write (:obj:`bool`, optional): Format and write the vibronic property values,
+                                                 energies and Hamiltonian derivatives in a
+                                                 background process with
+                                                 :class:`vibrav.vibronic.store.AsyncStore`
+                                                 while the next normal mode is computed. The
+                                                 oscillator files are still appended to in this
+                                                 process. With checkpoints the writes of each
+                                                 normal mode are waited for before it is marked
+                                                 as completed. Defaults to :code:`False`.
+            write_manifold_oscil (:obj:`bool`, optional): Write the spin-orbit oscillator
+                                                 strengths summed over the degenerate initial
+                                                 and final manifolds to
+                                                 `oscillators-manifold-{0..3}.txt` next to the
+                                                 oscillator files. The manifolds are found with
+                                                 the `degen_delta` input. Each line has the one
+                                                 based index of the first state of both
+                                                 manifolds, the summed oscillator strength, the
+                                                 mean transition energy, the normal mode, the
+                                                 sign and the number of states in both
+                                                 manifolds. Can be used without `write_oscil`.
+                                                 Defaults to :code:`False`.
+            oscil_tol (:obj:`float`, optional): Do not write the transitions with an isotropic
+                                                oscillator strength less than this value to the
+                                                oscillator and rotatory strength files. Defaults
+                                                to :code:`None`.
+            oscil_rel_tol (:obj:`float`, optional): Do not write the transitions with an
+                                                    isotropic oscillator strength less than this
+                                                    value times the largest one of the normal
+                                                    mode and sign. Defaults to :code:`None`.
+            oscil_top_n (:obj:`int`, optional): Only write the transitions with the `N` largest
+                                                isotropic oscillator strengths out of each
+                                                initial state. Defaults to :code:`None`.
+                                                With any of the pruning options the number of
+                                                transitions that were kept and removed and the
+                                                total and removed isotropic oscillator strength
+                                                of each normal mode and sign are written to
+                                                `oscillators-pruned.txt` (and
+                                                `oscillators-sf-pruned.txt`). The spectrum and
+                                                the manifold oscillators are not pruned.
+
+        Note:
+            When running with more than one process it is recommended to limit the number of
+            threads used by the linear algebra libraries (e.g. :code:`OMP_NUM_THREADS`) so that
+            the processes do not compete for the same cores. The files that are written are the
+            same as those of a serial run as all of the writing is done by the main process in
+            the order of the normal modes.
+
+            The values are computed by :meth:`iter_modes` and this method only writes the
+            files from the results of each normal mode. Use :meth:`iter_modes` directly to
+            analyze the results without writing and parsing the files.
+
+            The `initial_states`, `final_energy_min` and `final_energy_max` inputs in the
+            configuration file limit the spin-orbit property values and oscillators to the
+            transitions out of the lowest states into the final states in the energy window.
+            Only the needed rows and columns of the eigenvector transformation are computed.
+            The spin-orbit property files then only have the lines of those states.
+
+            The property names are the same with underscores or hyphens (i.e.
+            `electric_dipole` and `electric-dipole`) and the vibronic property values of both
+            are checked to be Hermitian (anti-Hermitian for the magnetic dipole). With
+            `precision='single'` the check is to the precision of the data type.
 
         Raises:
             NotImplementedError: When the property requested with the `property` parameter does not
                                  have any output parser or just has not been coded yet.
             ValueError: If the array that is expected to be Hermitian actually is not.
+            ValueError: When resuming with settings that are different from the checkpoint.
+            ValueError: When there are no spin-orbit states in the final state energy window.
+            ValueError: When the pruning cut-offs are negative or `oscil_top_n` is less than 1.
         '''
         # 90% of this method is actually just error checking and making
         # sure that the input data is what is to be expected
@@ -406,18 +1983,26 @@ class Vibronic:
         # if the error is not documented or thrown by something other than
         # this program feel free to contact the administrators on github
         # to look into the issue
-        sparse = True
-        store_gs_degen = True
         # for program running ststistics
         program_start = time()
+        # the profile is always recorded but only written when requested
+        prof = Profile()
+        prof.add('config-parse', *self._config_times)
         # to reduce typing
-        nstates = self.nstates
-        nstates_sf = self.nstates_sf
         config = self.config
         # create the vibronic-outputs directory if not available
         vib_dir = 'vibronic-outputs'
         if not os.path.exists(vib_dir):
             os.mkdir(vib_dir)
+        # each shard writes to its own directory so that they can be merged
+        store_fp = store
+        if shard is not None:
+            shard_index, nshards = parse_shard(shard)
+            vib_dir = shard_dir(vib_dir, shard_index, nshards)
+            os.makedirs(vib_dir, exist_ok=True)
+            remove_manifest(vib_dir)
+            if store is not None:
+                store_fp = os.path.join(vib_dir, os.path.basename(store))
         # print out the contents of the config file so the user knows how the parameters were read
         if print_stdout:
             print("Printing contents of config file")
@@ -426,529 +2011,323 @@ class Vibronic:
             print("*"*46)
         # for defining the sizes of the arrays later on
         #oscil_states = int(config.oscillator_spin_states)
-        # define constants used later on
-        speed_of_light_au = speed_of_light*Length['m', 'au']/Time['s', 'au']
-        planck_constant_au = 2*np.pi
-        # TODO: these hardcoded values need to be generalized
-        # this was used in the old script but needs to be fixed
-        fc = 1
         # read all of the data files
-        delta = pd.read_csv(config.delta_file, header=None)
-        rmass = pd.read_csv(config.reduced_mass_file, header=None)
-        freq = pd.read_csv(config.frequency_file, header=None).values.reshape(-1,)
+        delta, rmass, freq = self._read_mode_inputs()
         nmodes = config.number_of_modes
-        # calculate the boltzmann factors
-        boltz_factor = boltz_dist(freq, temp, boltz_tol, boltz_states)
-        cols = boltz_factor.columns.tolist()[:-3]
-        boltz = np.zeros((boltz_factor.shape[0], 2))
-        # sum the boltzmann factors as we will do the sme thing later on anyway
-        # important when looking at the oscillator strengths
-        for freqdx, data in boltz_factor.groupby('freqdx'):
-            boltz[freqdx][0] = np.sum([val*(idx) for idx, val in enumerate(data[cols].values[0])])
-            boltz[freqdx][1] = np.sum([val*(idx+1) for idx, val in enumerate(data[cols[:-1]].values[0])])
-        boltz = pd.DataFrame(boltz, columns=['minus', 'plus'])
-        boltz['freqdx'] = boltz_factor['freqdx']
-        boltz['partition'] = boltz_factor['partition']
-        boltz.index = boltz['freqdx'].values
-        filename = os.path.join(vib_dir, 'boltzmann-populations.csv')
-        boltz.to_csv(filename, index=False)
-        # deprecated because there are issues with the printing algorithm
-        if print_stdout and False:
-            tmp = boltz_factor.copy()
-            tmp = tmp[tmp.columns[:-3]]
-            tmp = tmp.T
-            tmp.index = pd.Index(range(tmp.shape[0]), name='state')
-            tmp.columns = boltz_factor['freqdx']
-            print_cols = 6
-            text = " Printing Boltzmann populations for each normal mode with the\n" \
-                  +" energies from the {} file.".format(config.frequency_file)
-            print('='*78)
-            print(text)
-            print('-'*78)
-            print(dataframe_to_txt(tmp, float_format=['{:11.7f}'.format]*nmodes,
-                                   ncols=print_cols))
-            print('='*78)
-            tmp = boltz.copy()
-            tmp.index = tmp['freqdx']
-            tmp.drop(['freqdx'], inplace=True, axis=1)
-            tmp = tmp.T
-            print('\n\n')
-            text = " Printing the Boltzmann weighting for the plus an minus displaced\n" \
-                  +" and the respective partition function for each normal mode."
-            print('='*81)
-            print(text)
-            print('-'*81)
-            print(dataframe_to_txt(tmp, float_format=['{:11.7f}'.format]*nmodes,
-                                   ncols=print_cols))
-            print('='*81)
-            #print('-'*80)
-            #print("Printing the boltzmann distribution for all")
-            #print("of the available frequencies at a temperature: {:.2f}".format(temp))
-            #formatters = ['{:.7f}'.format, '{:.7f}'.format, '{:d}'.format, '{:.7f}'.format]
-            #print(boltz.to_string(index=False, formatters=formatters))
-            #print('-'*80)
-            #raise
-        # read the dipoles in the zero order file
-        # make a multiplicity array for extending the derivative arrays from spin-free
-        # states to spin-orbit states
-        multiplicity = []
-        for idx, mult in enumerate(config.spin_multiplicity):
-            multiplicity.append(np.repeat(int(mult), int(config.number_of_states[idx])))
-        multiplicity = np.concatenate(tuple(multiplicity))
-        self.check_size(multiplicity, (nstates_sf,), 'multiplicity')
-        # read the eigvectors data
-        eigvectors = open_txt(config.eigvectors_file).values
-        # mainly for testing purposes but this serves the purpose of limiting
-        # the contribution of the SOC from states that can cause some issues
-        # with the final intensities
-        if config.so_cont_tol is not None:
-            conts = abs2(eigvectors)
-            so_cont_limit = conts < config.so_cont_tol
-            eigvectors[so_cont_limit] = 0.0
-            conts = abs2(eigvectors)
-            if print_stdout:
-                print("*"*50)
-                print("Printing out sum of the percent contribution\n" \
-                      +"of each spin-orbit state after removing those\n" \
-                      +"less than {}".format(config.so_cont_tol))
-                print("*"*50)
-                print("Printing sorted and unsorted contributions.")
-                print("*"*50)
-                unsorted_ser = pd.Series(np.sum(conts, axis=1))
-                sorted_ser = unsorted_ser.copy().sort_values()
-                df_dict = {'so-index-sorted': sorted_ser.index,
-                           'sorted-contributions': sorted_ser.values,
-                           'so-index-unsorted': unsorted_ser.index,
-                           'unsorted-contributions': unsorted_ser.values}
-                df = pd.DataFrame.from_dict(df_dict)
-                print(df.to_string(index=False))
-        self.check_size(eigvectors, (nstates, nstates), 'eigvectors')
-        # get the hamiltonian derivatives
-        dham_dq = self.get_hamiltonian_deriv(select_fdx, delta, rmass, nmodes,
-                                             use_sqrt_rmass, config.sparse_hamiltonian)
-        found_modes = dham_dq['freqdx'].unique()
-        # TODO: it would be really cool if we could just input a list of properties to compute
-        #       and the program will take care of the rest
-        ed = Output(config.zero_order_file)
-        # get the property of choice from the zero order file given in the config file
-        # the extra column in each of the parsed properties comes from the component column
-        # in the molcas output parser
-        if property.replace('_', '-') == 'electric-dipole':
-            ed.parse_sf_dipole_moment()
-            self.check_size(ed.sf_dipole_moment, (nstates_sf*3, nstates_sf+1), 'sf_dipole_moment')
-            grouped_data = ed.sf_dipole_moment.groupby('component')
-            out_file = 'dipole'
-            so_file = config.dipole_file
-            idx_map = {1: 'x', 2: 'y', 3: 'z'}
-        elif property.replace('_', '-') == 'electric-quadrupole':
-            ed.parse_sf_quadrupole_moment()
-            self.check_size(ed.sf_quadrupole_moment, (nstates_sf*6, nstates_sf+1),
-                             'sf_quadrupole_moment')
-            grouped_data = ed.sf_quadrupole_moment.groupby('component')
-            out_file = 'quadrupole'
-            so_file = config.quadrupole_file
-            idx_map = {1: 'xx', 2: 'xy', 3: 'xz', 4: 'yy', 5: 'yz', 6: 'zz'}
-        elif property.replace('_', '-') == 'magnetic-dipole':
-            ed.parse_sf_angmom()
-            self.check_size(ed.sf_angmom, (nstates_sf*3, nstates_sf+1), 'sf_angmom')
-            grouped_data = ed.sf_angmom.groupby('component')
-            out_file = 'angmom'
-            so_file = config.angmom_file
-            idx_map = {1: 'x', 2: 'y', 3: 'z'}
+        # the oscillators of every temperature are computed from the same
+        # vibronic property values
+        temps = self._get_temps(temp)
+        if isinstance(temp, (list, tuple, np.ndarray)):
+            osc_dirs = [os.path.join(vib_dir, '{:g}K'.format(val)) for val in temps]
         else:
-            raise NotImplementedError("Sorry the attribute that you are trying to use is not " \
-                                     +"yet implemented.")
-        # deprecated
-        #if eq_cont:
-        #    # get the spin-orbit property from the molcas output for the equilibrium geometry
-        #    dfs = []
-        #    for file in glob(so_file+'-?.txt'):
-        #        idx = int(file.split('-')[-1].replace('.txt', ''))
-        #        df = open_txt(file)
-        #        # use a mapper as we cannot ensure that the files are found in any
-        #        # expected order
-        #        df['component'] = idx_map[idx]
-        #        dfs.append(df)
-        #    so_props = pd.concat(dfs, ignore_index=True)
-        #
-        # number of components
-        # important because we can have up to 6 components for the
-        # electric quadrupole moments
-        ncomp = len(idx_map.keys())
-        # for easier access
-        idx_map_rev = {v: k for k, v in idx_map.items()}
-        # get the energies
-        energies_sf, energies_so = self._parse_energies(ed, config.sf_energies_file,
-                                                        config.so_energies_file)
-        # more testing things but this will only include a select number of the
-        # sf states in the SOS equations
-        if config.states is not None:
-            incl_states = self._get_states(energies_sf, config.states)
+            osc_dirs = [vib_dir]
+        for osc_dir in osc_dirs:
+            if not os.path.exists(osc_dir):
+                os.mkdir(osc_dir)
+        properties, _, _ = self._get_components(property)
+        # the oscillator outputs are only written for the electric dipole
+        calc_oscil = 'electric-dipole' in properties
+        # the rotatory strengths are computed along with the oscillator strengths of the
+        # electric dipole even when they are not written
+        need_oscil = calc_oscil or write_rotatory
+        # the electric and magnetic dipoles are both needed for the rotatory strengths
+        computed = properties
+        if write_rotatory:
+            computed, _, _ = self._get_components(properties + ['electric-dipole',
+                                                                'magnetic-dipole'])
+        # the weak transitions are removed from the oscillator files
+        prune = None
+        if oscil_tol is not None or oscil_rel_tol is not None or oscil_top_n is not None:
+            if (oscil_tol is not None and oscil_tol < 0) or \
+                    (oscil_rel_tol is not None and oscil_rel_tol < 0):
+                raise ValueError("The oscillator strength cut-offs must not be negative.")
+            if oscil_top_n is not None and int(oscil_top_n) < 1:
+                raise ValueError("The number of transitions to keep for each initial state " \
+                                 +"must be at least 1, got {}.".format(oscil_top_n))
+            prune = {'tol': oscil_tol, 'rel_tol': oscil_rel_tol,
+                     'top_n': None if oscil_top_n is None else int(oscil_top_n)}
+        # the oscillator files are appended to after each normal mode
+        osc_files = []
+        rot_files = []
+        man_files = []
+        prune_files = []
+        for osc_dir in osc_dirs:
+            if write_oscil and calc_oscil:
+                osc_files += [os.path.join(osc_dir, 'oscillators-{}.txt'.format(idx))
+                              for idx in range(4)]
+            if write_sf_oscil and calc_oscil:
+                osc_files += [os.path.join(osc_dir, 'oscillators-sf-{}.txt'.format(idx))
+                              for idx in range(4)]
+            if write_rotatory:
+                rot_files.append(os.path.join(osc_dir, 'rotatory.txt'))
+            if prune is not None and write_oscil and calc_oscil:
+                prune_files.append(os.path.join(osc_dir, 'oscillators-pruned.txt'))
+            if prune is not None and write_sf_oscil and calc_oscil:
+                prune_files.append(os.path.join(osc_dir, 'oscillators-sf-pruned.txt'))
+            if write_manifold_oscil and calc_oscil:
+                man_files += [os.path.join(osc_dir, 'oscillators-manifold-{}.txt'.format(idx))
+                              for idx in range(4)]
+        # keep track of the completed normal modes
+        resumed = False
+        zero_order = None
+        settings = None
+        if checkpoint or resume or incremental or shard is not None:
+            # the hash of the inputs shared by all normal modes
+            inputs = hash_inputs([config.eigvectors_file, config.zero_order_file,
+                                  config.sf_energies_file, config.so_energies_file])
+            settings = {'inputs': inputs, 'property': properties, 'temp': temps,
+                        'select_fdx': select_fdx, 'boltz_states': boltz_states, 'boltz_tol': boltz_tol,
+                        'use_sqrt_rmass': use_sqrt_rmass, 'write_property': write_property,
+                        'write_energy': write_energy, 'write_oscil': write_oscil,
+                        'write_sf_oscil': write_sf_oscil, 'write_sf_property': write_sf_property,
+                        'write_dham_dq': write_dham_dq, 'write_all_oscil': write_all_oscil,
+                        'write_rotatory': write_rotatory, 'store': store,
+                        'write_manifold_oscil': write_manifold_oscil, 'prune': prune,
+                        'precision': precision,
+                        'spectrum': None if spectrum is None else spectrum.get_settings(),
+                        'config': {key: str(val) for key, val in config.items()}}
+            if isinstance(select_fdx, np.ndarray): settings['select_fdx'] = select_fdx.tolist()
+        if checkpoint or resume or incremental:
+            ckpt = Checkpoint(vib_dir, settings, osc_files+rot_files+man_files+prune_files)
+            if resume or incremental:
+                resumed = ckpt.load(strict=not incremental)
+            if resumed:
+                zero_order = ckpt.load_data()
+                if print_stdout:
+                    print("Resuming from checkpoint with {} ".format(len(ckpt.completed)) \
+                          +"completed normal modes.")
+            else:
+                ckpt.reset()
         else:
-            incl_states = None
+            ckpt = None
+        if zero_order is None:
+            with prof.stage('zero-order-parse'):
+                zero_order = self._load_zero_order(computed, print_stdout)
+            if ckpt is not None:
+                with prof.stage('checkpoint'):
+                    ckpt.save_data(**zero_order)
+        # only compute the normal modes that are not done
+        all_modes = [fdx-1 for fdx in self._get_freq_range(select_fdx, nmodes)]
+        # the order of the normal modes of the calculation that is not sharded
+        order = all_modes
+        if shard is not None:
+            all_modes = select_shard(all_modes, shard_index, nshards)
+        select_modes = all_modes
+        if ckpt is not None:
+            digests = {fdx: self._hash_mode_inputs(fdx, nmodes, delta, rmass, freq)
+                       for fdx in all_modes}
+            if incremental:
+                # compute the normal modes with different inputs again
+                changed = [fdx for fdx in ckpt.completed
+                           if ckpt.hashes.get(str(fdx)) != digests.get(fdx)]
+                if print_stdout and changed:
+                    print("Inputs changed for normal modes: " \
+                          +"{}".format(', '.join([str(fdx+1) for fdx in changed])))
+                ckpt.discard(changed)
+            select_modes = [fdx for fdx in all_modes if fdx not in ckpt.completed]
+        # the oscillators are also needed for the spectrum
+        modes = self.iter_modes(computed, temp=temp, print_stdout=print_stdout,
+                                verbose=verbose, use_sqrt_rmass=use_sqrt_rmass,
+                                select_fdx=select_modes, boltz_states=boltz_states,
+                                boltz_tol=boltz_tol,
+                                oscil=need_oscil and (write_oscil or write_manifold_oscil \
+                                                      or spectrum is not None \
+                                                      or write_rotatory),
+                                sf_oscil=calc_oscil and write_sf_oscil,
+                                all_oscil=write_all_oscil,
+                                sf_property=write_sf_property, n_jobs=n_jobs,
+                                executor=executor, sparse_eigvectors=sparse_eigvectors,
+                                sparse_fill=sparse_fill, zero_order=zero_order, profile=prof,
+                                rotatory=write_rotatory, precision=precision,
+                                pipeline=pipeline)
+        for boltz, osc_dir in zip(self.boltz, osc_dirs):
+            filename = os.path.join(osc_dir, 'boltzmann-populations.csv')
+            boltz.to_csv(filename, index=False)
+        # the spectra of each temperature
+        if spectrum is not None and calc_oscil:
+            spectra = [copy.deepcopy(spectrum) for _ in osc_dirs]
+            spectra_files = [os.path.join(osc_dir, 'spectrum-sticks.npz') for osc_dir in osc_dirs]
+            if resumed:
+                for spec, fp in zip(spectra, spectra_files):
+                    if os.path.exists(fp):
+                        spec.load(fp)
+                # only the completed normal modes are kept
+                # the normal modes that were interrupted or whose inputs changed are
+                # subtracted with the oscillators saved in the checkpoint
+                added = set([fdx for spec in spectra for fdx in spec.modes])
+                for fdx in sorted(added.difference(ckpt.completed)):
+                    data = ckpt.load_mode_data(fdx)
+                    if data is None:
+                        raise ValueError("The spectrum of the checkpoint has the normal mode " \
+                                         +"{} but its oscillators were not ".format(fdx+1) \
+                                         +"saved. Cannot resume the calculation.")
+                    self._remove_spectra(data, fdx, spectra)
+        else:
+            spectra = None
         # timing things
         time_setup = time() - program_start
         # counter just for timing statistics
         vib_times = []
-        grouped = dham_dq.groupby('freqdx')
         iter_times = []
         prefactor = []
-        degeneracy = energetic_degeneracy(energies_so, config.degen_delta)
-        gs_degeneracy = degeneracy.loc[0, 'degen']
-        if print_stdout:
-            print("--------------------------------------------")
-            print("Spin orbit ground state was found to be: {:3d}".format(gs_degeneracy))
-            print("--------------------------------------------")
-        if store_gs_degen: self.gs_degeneracy = gs_degeneracy
+        completed = []
         # initialize the oscillator files
-        if write_oscil and property.replace('_', '-') == 'electric-dipole':
-            osc_tmp = 'oscillators-{}.txt'.format
-            header = "{:>5s} {:>5s} {:>24s} {:>24s} {:>6s} {:>7s}".format
-            oscil_formatters = ['{:>5d}'.format]*2+['{:>24.16E}'.format]*2 \
-                               +['{:>6d}'.format, '{:>7s}'.format]
-            with open(os.path.join(vib_dir, osc_tmp(0)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(1)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(2)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(3)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-        if write_sf_oscil and property.replace('_', '-') == 'electric-dipole':
-            osc_tmp = 'oscillators-sf-{}.txt'.format
+        # when resuming they have already been truncated to the last completed normal mode
+        if not resumed:
             header = "{:>5s} {:>5s} {:>24s} {:>24s} {:>6s} {:>7s}".format
-            oscil_formatters = ['{:>5d}'.format]*2+['{:>24.16E}'.format]*2 \
-                               +['{:>6d}'.format, '{:>7s}'.format]
-            with open(os.path.join(vib_dir, osc_tmp(0)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(1)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(2)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-            with open(os.path.join(vib_dir, osc_tmp(3)), 'w') as fn:
-                fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
-        for fdx, founddx in enumerate(found_modes):
-            vib_prop = np.zeros((2, ncomp, nstates, nstates), dtype=np.complex128)
-            vib_prop_sf = np.zeros((2, ncomp, nstates_sf, nstates_sf), dtype=np.float64)
-            vib_prop_sf_so_len = np.zeros((2, ncomp, nstates, nstates), dtype=np.float64)
-            vib_start = time()
+            for fp in osc_files:
+                with open(fp, 'w') as fn:
+                    fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN'))
+            for fp in rot_files:
+                with open(fp, 'w') as fn:
+                    fn.write(header('#NROW', 'NCOL', 'ROTATORY', 'ENERGY', 'FREQDX', 'SIGN'))
+            for fp in prune_files:
+                with open(fp, 'w') as fn:
+                    fn.write(header('#NKEEP', 'NPRUNE', 'OSCIL', 'PRUNED', 'FREQDX', 'SIGN'))
+            for fp in man_files:
+                with open(fp, 'w') as fn:
+                    fn.write(header('#NROW', 'NCOL', 'OSCIL', 'ENERGY', 'FREQDX', 'SIGN') \
+                             +" {:>5s} {:>5s}".format('NDEGR', 'NDEGC'))
+        # where the property values, energies and hamiltonian derivatives are written to
+        if store is None:
+            store_args = (TxtStore,), {}
+        else:
+            store_args = (HDF5Store, store_fp), {'compression': store_compression}
+        if async_write:
+            # the files are formatted and written in a background process
+            out_store = AsyncStore(*store_args[0], **store_args[1])
+        else:
+            out_store = store_args[0][0](*store_args[0][1:], **store_args[1])
+        # the files are written from the results of each normal mode as they are computed
+        def write_mode(result):
+            founddx = result.founddx
             if print_stdout:
                 print("*******************************************")
                 print("*     RUNNING VIBRATIONAL MODE: {:5d}     *".format(founddx+1))
                 print("*******************************************")
-            # assume that the hamiltonian values are real which they should be anyway
-            dham_dq_mode = np.real(grouped.get_group(founddx).drop('freqdx', axis=1).values)
-            self.check_size(dham_dq_mode, (nstates_sf, nstates_sf), 'dham_dq_mode')
-            tdm_prefac = np.sqrt(planck_constant_au \
-                                 /(2*speed_of_light_au*freq[founddx]/Length['cm', 'au']))/(2*np.pi)
-            if print_stdout:
-                print("TDM prefac: {:.4f}".format(tdm_prefac))
-            prefactor.append(tdm_prefac)
-            # iterate over all of the available components
-            for idx, (key, val) in enumerate(grouped_data):
-                start = time()
-                # get the values of the specific component
-                prop = val.drop('component', axis=1).values
-                self.check_size(prop, (nstates_sf, nstates_sf), 'prop_{}'.format(key))
-                # initialize arrays
-                # spin-free derivatives
-                dprop_dq_sf = np.zeros((nstates_sf, nstates_sf), dtype=np.float64)
-                # spin-free derivatives extended into the number of spin-orbit states
-                # this gets the array ready for spin-orbit mixing
-                dprop_dq_so = np.zeros((nstates, nstates), dtype=np.float64)
-                # spin-orbit derivatives
-                dprop_dq = np.zeros((nstates, nstates), dtype=np.complex128)
-                # calculate everything
-                compute_d_dq_sf(nstates_sf, dham_dq_mode, prop, energies_sf, dprop_dq_sf,
-                                config.degen_delta, incl_states=incl_states)
-                sf_to_so(nstates_sf, nstates, multiplicity, dprop_dq_sf, dprop_dq_so)
-                compute_d_dq(nstates, eigvectors, dprop_dq_so, dprop_dq)
-                # check if the array is hermitian
-                if property == 'electric_dipole':
-                    if not ishermitian(dprop_dq):
-                        text = "The vibronic electric dipole at frequency {} for component {} " \
-                               +"was not found to be hermitian."
-                        raise ValueError(text.format(fdx, key))
-                    if not ishermitian(dprop_dq_sf):
-                        text = "The vibronic electric dipole at frequency {} for component {} " \
-                               +"was not found to be hermitian."
-                        raise ValueError(text.format(fdx, key))
-                elif property == 'magnetic_dipole':
-                    if not isantihermitian(dprop_dq):
-                        text = "The vibronic magentic dipole at frequency {} for component {} " \
-                               +"was not found to be non-hermitian."
-                        raise ValueError(text.format(fdx, key))
-                elif property == 'electric_quadrupole':
-                    if not ishermitian(dprop_dq):
-                        text = "The vibronic electric quadrupole at frequency {} for " \
-                               +"component {} was not found to be hermitian."
-                        raise ValueError(text.format(fdx, key))
-                dprop_dq *= tdm_prefac
-                dprop_dq_sf *= tdm_prefac
-                dprop_dq_so *= tdm_prefac
-                # generate the full property vibronic states following equation S3 for the reference
-                if eq_cont and False:
-                    # deprecated
-                    so_prop = so_props.groupby('component').get_group(key).drop('component', axis=1)
-                    vib_prop_plus = fc*(so_prop + dprop_dq)
-                    vib_prop_minus = fc*(so_prop - dprop_dq)
-                else:
-                    # store the transpose as it will make some things easier down the line
-                    vib_prop_plus = fc*dprop_dq.T
-                    vib_prop_minus = fc*-dprop_dq.T
-                    vib_prop_sf_plus = fc*dprop_dq_sf.T
-                    vib_prop_sf_minus = fc*-dprop_dq_sf.T
-                    vib_prop_sf_so_len_plus = fc*dprop_dq_so.T
-                    vib_prop_sf_so_len_minus = fc*-dprop_dq_so.T
-                # store in array
-                vib_prop[0][idx_map_rev[key]-1] = vib_prop_minus
-                vib_prop[1][idx_map_rev[key]-1] = vib_prop_plus
-                vib_prop_sf[0][idx_map_rev[key]-1] = vib_prop_sf_minus
-                vib_prop_sf[1][idx_map_rev[key]-1] = vib_prop_sf_plus
-                vib_prop_sf_so_len[0][idx_map_rev[key]-1] = vib_prop_sf_so_len_minus
-                vib_prop_sf_so_len[1][idx_map_rev[key]-1] = vib_prop_sf_so_len_plus
-            # calculate the oscillator strengths
-            evib = freq[founddx]*conv.inv_m2Ha*100
-            initial = np.tile(range(nstates), nstates)+1
-            final = np.repeat(range(nstates), nstates)+1
-            template = "{:6d}  {:6d}  {:>18.9E}  {:>18.9E}\n".format
-            # TODO: This needs some revisions. Whole lot of spaghetti code.
+                print("TDM prefac: {:.4f}".format(result.prefactor))
+            prefactor.append(result.prefactor)
+            completed.append(founddx)
             # no calculations from this point onward
             # just a whole lot of file writing
             if write_property:
-                for idx, (minus, plus) in enumerate(zip(*vib_prop)):
-                    plus_T = plus.flatten()
-                    real = np.real(plus_T)
-                    imag = np.imag(plus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'plus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755, exist_ok=True)
-                    filename = os.path.join(dir_name, out_file+'-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>18s}  {:>18s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates*nstates):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
-                    minus_T = minus.flatten()
-                    real = np.real(minus_T)
-                    imag = np.imag(minus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'minus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755)
-                    filename = os.path.join(dir_name, out_file+'-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>10s}  {:>10s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates*nstates):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
-                dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'minus')
-                with open(os.path.join(dir_name, 'energies.txt'), 'w') as fn:
-                    fn.write('# {} (atomic units)\n'.format(nstates))
-                    energies = energies_so + (1./2.)*evib - energies_so[0]
-                    energies[range(gs_degeneracy)] = energies_so[:gs_degeneracy] \
-                                                        - energies_so[0] + (3./2.)*evib
-                    for energy in energies:
-                        fn.write('{:.9E}\n'.format(energy))
-                dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'plus')
-                with open(os.path.join(dir_name, 'energies.txt'), 'w') as fn:
-                    fn.write('# {} (atomic units)\n'.format(nstates))
-                    energies = energies_so + (3./2.)*evib - energies_so[0]
-                    energies[range(gs_degeneracy)] = energies_so[:gs_degeneracy] \
-                                                        - energies_so[0] + (1./2.)*evib
-                    for energy in energies:
-                        fn.write('{:.9E}\n'.format(energy))
+                for idx, sign in enumerate(['minus', 'plus']):
+                    for prop_name, values in result.properties.items():
+                        # the properties only computed for the rotatory strengths
+                        if prop_name not in properties:
+                            continue
+                        out_file = self._properties[prop_name][0]
+                        with prof.stage('write-property', founddx, prop_name) as rec:
+                            rec['bytes'] = out_store.write_property(founddx, sign, 'so', out_file,
+                                                                    values[idx],
+                                                                    rows=result.initial,
+                                                                    cols=result.final)
+                    with prof.stage('write-energies', founddx) as rec:
+                        rec['bytes'] = out_store.write_energies(founddx, sign,
+                                                                result.energies[sign])
             if write_sf_property:
-                initial = np.tile(range(nstates_sf), nstates_sf)+1
-                final = np.repeat(range(nstates_sf), nstates_sf)+1
-                for idx, (minus, plus) in enumerate(zip(*vib_prop_sf)):
-                    plus_T = plus.flatten()
-                    real = np.real(plus_T)
-                    imag = np.imag(plus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'plus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755, exist_ok=True)
-                    filename = os.path.join(dir_name, out_file+'-sf-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>18s}  {:>18s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates_sf*nstates_sf):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
-                    minus_T = minus.flatten()
-                    real = np.real(minus_T)
-                    imag = np.imag(minus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'minus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755)
-                    filename = os.path.join(dir_name, out_file+'-sf-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>10s}  {:>10s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates_sf*nstates_sf):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
-            if write_sf_property:
-                initial = np.tile(range(nstates), nstates)+1
-                final = np.repeat(range(nstates), nstates)+1
-                for idx, (minus, plus) in enumerate(zip(*vib_prop_sf_so_len)):
-                    plus_T = plus.flatten()
-                    real = np.real(plus_T)
-                    imag = np.imag(plus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'plus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755, exist_ok=True)
-                    filename = os.path.join(dir_name, out_file+'-sf-so-len-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>18s}  {:>18s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates*nstates):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
-                    minus_T = minus.flatten()
-                    real = np.real(minus_T)
-                    imag = np.imag(minus_T)
-                    dir_name = os.path.join('vib'+str(founddx+1).zfill(3), 'minus')
-                    if not os.path.exists(dir_name):
-                        os.makedirs(dir_name, 0o755)
-                    filename = os.path.join(dir_name, out_file+'-sf-so-len-{}.txt'.format(idx+1))
-                    with open(filename, 'w') as fn:
-                        fn.write('{:>5s}  {:>6s}  {:>10s}  {:>10s}\n'.format('#NROW', 'NCOL',
-                                                                             'REAL', 'IMAG'))
-                        for i in range(nstates*nstates):
-                            fn.write(template(initial[i], final[i], real[i], imag[i]))
+                for idx, sign in enumerate(['minus', 'plus']):
+                    for prop_name, values in result.sf_properties.items():
+                        if prop_name not in properties:
+                            continue
+                        out_file = self._properties[prop_name][0]
+                        with prof.stage('write-sf-property', founddx, prop_name) as rec:
+                            sf_so_len = result.sf_so_len_properties[prop_name]
+                            nbytes = [out_store.write_property(founddx, sign, 'sf', out_file,
+                                                               values[idx]),
+                                      out_store.write_property(founddx, sign, 'sf-so-len',
+                                                               out_file, sf_so_len[idx])]
+                            # the bytes are not known when writing in the background
+                            if None not in nbytes:
+                                rec['bytes'] = sum(nbytes)
             if write_dham_dq:
-                initial = np.tile(range(nstates_sf), nstates_sf)+1
-                final = np.repeat(range(nstates_sf), nstates_sf)+1
-                dir_name = os.path.join('vib'+str(founddx+1).zfill(3))
-                if not os.path.exists(dir_name):
-                    os.makedirs(dir_name, 0o755)
-                filename = os.path.join(dir_name, 'hamiltonian-derivs.txt')
-                real = np.real(dham_dq_mode.flatten(order='F'))
-                imag = np.imag(dham_dq_mode.flatten(order='F'))
-                with open(filename, 'w') as fn:
-                    fn.write('{:>5s}  {:>6s}  {:>10s}  {:>10s}\n'.format('#NROW', 'NCOL',
-                                                                         'REAL', 'IMAG'))
-                    for i in range(nstates_sf*nstates_sf):
-                        fn.write(template(initial[i], final[i], real[i], imag[i]))
-            if (property.replace('_', '-') == 'electric-dipole') and write_oscil:
-                mapper = {0: 'iso', 1: 'x', 2: 'y', 3: 'z'}
-                # finally get the oscillator strengths from equation S12
-                to_drop = ['component', 'freqdx', 'sign', 'prop']
-                nrow = np.tile(range(nstates), nstates) + 1
-                ncol = np.repeat(range(nstates), nstates) + 1
-                for idx, (val, sign) in enumerate(zip([-1, 1], ['minus', 'plus'])):
-                    boltz_factor = boltz.loc[founddx, sign]
-                    absorption = abs2(vib_prop[idx].reshape(ncomp, nstates*nstates))
-                    # get the transition energies
-                    energy = energies_so.reshape(-1, 1) - energies_so.reshape(-1,) + val*evib
-                    energy = energy.flatten()
-                    # check for correct size
-                    self.check_size(energy, (nstates*nstates,), 'energy')
-                    self.check_size(absorption, (ncomp, nstates*nstates), 'absorption')
-                    # compute the isotropic oscillators
-                    oscil = boltz_factor * 2./3. * compute_oscil_str(np.sum(absorption, axis=0),
-                                                                     energy)
-                    # write to file
-                    template = ' '.join(['{:>5d}']*2 + ['{:>24.16E}']*2 \
-                                        + ['{:>6d}', '{:>7s}'])
-                    filename = os.path.join('vibronic-outputs', 'oscillators-0.txt')
-                    start = time()
-                    with open(filename, 'a') as fn:
-                        text = ''
-                        # use a for loop instead of a df.to_string() as it is significantly faster
-                        for nr, nc, osc, eng in zip(nrow, ncol, oscil, energy):
-                            if not write_all_oscil:
-                                if osc > 0 and eng > 0:
-                                    text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                            else:
-                                text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                        fn.write(text)
-                    if print_stdout:
-                        text = " Wrote isotropic oscillators to {} for sign {} in {:.2f} s"
-                        print(text.format(filename, sign, time() - start))
-                    # compute the oscillators for the individual cartesian components
-                    for idx, component in enumerate(absorption):
-                        self.check_size(component, (nstates*nstates,),
-                                        'absorption component {}'.format(idx))
-                        oscil = boltz_factor * 2. * compute_oscil_str(component, energy)
-                        filename = os.path.join('vibronic-outputs',
-                                                'oscillators-{}.txt'.format(idx+1))
-                        start = time()
-                        with open(filename, 'a') as fn:
-                            text = ''
-                            for nr, nc, osc, eng in zip(nrow, ncol, oscil, energy):
-                                if not write_all_oscil:
-                                    if osc > 0 and eng > 0:
-                                        text += '\n'+template.format(nr, nc, osc, eng, founddx,
-                                                                     sign)
-                                else:
-                                    text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                            fn.write(text)
-                        if print_stdout:
-                            text = " Wrote oscillators for {} component to {} for sign " \
-                                   +"{} in {:.2f} s"
-                            print(text.format(mapper[idx+1], filename, sign, time() - start))
-            if (property.replace('_', '-') == 'electric-dipole') and write_sf_oscil:
-                mapper = {0: 'iso', 1: 'x', 2: 'y', 3: 'z'}
-                # finally get the oscillator strengths from equation S12
-                to_drop = ['component', 'freqdx', 'sign', 'prop']
-                nrow = np.tile(range(nstates_sf), nstates_sf) + 1
-                ncol = np.repeat(range(nstates_sf), nstates_sf) + 1
-                for idx, (val, sign) in enumerate(zip([-1, 1], ['minus', 'plus'])):
-                    boltz_factor = boltz.loc[founddx, sign]
-                    absorption = abs2(vib_prop_sf[idx].reshape(ncomp, nstates_sf*nstates_sf))
-                    # get the transition energies
-                    energy = energies_sf.reshape(-1, 1) - energies_sf.reshape(-1,) + val*evib
-                    energy = energy.flatten()
-                    # check for correct size
-                    self.check_size(energy, (nstates_sf*nstates_sf,), 'energy')
-                    self.check_size(absorption, (ncomp, nstates_sf*nstates_sf), 'absorption')
-                    # compute the isotropic oscillators
-                    oscil = boltz_factor * 2./3. * compute_oscil_str(np.sum(absorption, axis=0),
-                                                                     energy)
-                    # write to file
-                    template = ' '.join(['{:>5d}']*2 + ['{:>24.16E}']*2 \
-                                        + ['{:>6d}', '{:>7s}'])
-                    filename = os.path.join('vibronic-outputs', 'oscillators-sf-0.txt')
-                    start = time()
-                    with open(filename, 'a') as fn:
-                        text = ''
-                        # use a for loop instead of a df.to_string() as it is significantly faster
-                        for nr, nc, osc, eng in zip(nrow, ncol, oscil, energy):
-                            if write_all_oscil:
-                                if osc > 0 and eng > 0:
-                                    text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                            else:
-                                text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                        fn.write(text)
-                    if print_stdout:
-                        text = " Wrote isotropic oscillators to {} for sign {} in {:.2f} s"
-                        print(text.format(filename, sign, time() - start))
-                    # compute the oscillators for the individual cartesian components
-                    for idx, component in enumerate(absorption):
-                        self.check_size(component, (nstates_sf*nstates_sf,),
-                                        'absorption component {}'.format(idx))
-                        oscil = boltz_factor * 2. * compute_oscil_str(component, energy)
-                        filename = os.path.join('vibronic-outputs',
-                                                'oscillators-sf-{}.txt'.format(idx+1))
-                        start = time()
-                        with open(filename, 'a') as fn:
-                            text = ''
-                            for nr, nc, osc, eng in zip(nrow, ncol, oscil, energy):
-                                if write_all_oscil:
-                                    if osc > 0 and eng > 0:
-                                        text += '\n'+template.format(nr, nc, osc, eng, founddx,
-                                                                     sign)
-                                else:
-                                    text += '\n'+template.format(nr, nc, osc, eng, founddx, sign)
-                            fn.write(text)
-                        if print_stdout:
-                            text = " Wrote oscillators for {} component to {} for sign " \
-                                   +"{} in {:.2f} s"
-                            print(text.format(mapper[idx+1], filename, sign, time() - start))
+                with prof.stage('write-dham-dq', founddx) as rec:
+                    rec['bytes'] = out_store.write_dham_dq(founddx, result.dham_dq)
+            added = None
+            if result.oscil is not None:
+                if spectra is not None:
+                    with prof.stage('add-spectrum', founddx):
+                        added = self._add_spectra(result.oscil, founddx, spectra)
+                if write_oscil and calc_oscil:
+                    self._write_oscillators(result.oscil, founddx, osc_dirs,
+                                            'oscillators-{}.txt', write_all_oscil, print_stdout,
+                                            profile=prof, prune=prune, store=out_store)
+                if write_rotatory:
+                    self._write_rotatory(result.oscil, founddx, osc_dirs, write_all_oscil,
+                                         profile=prof, prune=prune, store=out_store)
+                if man_files:
+                    self._write_manifold_oscillators(result.oscil, founddx, osc_dirs,
+                                                     self.so_manifolds, write_all_oscil,
+                                                     profile=prof, store=out_store)
+            if result.sf_oscil is not None:
+                self._write_oscillators(result.sf_oscil, founddx, osc_dirs,
+                                        'oscillators-sf-{}.txt', write_all_oscil, print_stdout,
+                                        profile=prof, prune=prune, store=out_store)
+            if ckpt is not None:
+                with prof.stage('checkpoint', founddx):
+                    # the files of the normal mode must be written before it is marked
+                    # as completed
+                    out_store.flush()
+                    # the spectra are saved before the normal mode is marked as completed
+                    # along with the added oscillators to be able to remove them again
+                    if spectra is not None:
+                        ckpt.save_mode_data(founddx, **added)
+                        for spec, fp in zip(spectra, spectra_files):
+                            spec.save(fp)
+                    ckpt.update(founddx, result.prefactor, digests[founddx])
+        try:
+            if pipeline:
+                # the completed normal modes are written in a background thread while the
+                # next normal mode is computed
+                with Writer(write_mode) as writer:
+                    for result in modes:
+                        writer.put(result)
+            else:
+                for result in modes:
+                    write_mode(result)
+        finally:
+            modes.close()
+            # wait for the files that are written in the background
+            with prof.stage('store-close') as rec:
+                out_store.close()
+                if async_write:
+                    rec['bytes'] = out_store.nbytes
+        if ckpt is not None:
+            # put the normal modes computed now in the same order as a full calculation
+            if resumed:
+                ckpt.sort(all_modes)
+            prefactor = list(ckpt.prefactor)
+            completed = list(ckpt.completed)
+        if spectra is not None:
+            with prof.stage('write-spectrum'):
+                for spec, osc_dir in zip(spectra, osc_dirs):
+                    spec.to_csv(os.path.join(osc_dir, 'spectrum.csv'))
         if print_stdout:
             print("Writing out the prefactors used for the transition dipole moments.")
         with open(os.path.join(vib_dir, 'alpha.txt'), 'w') as fn:
             fn.write('alpha\n')
             for val in prefactor:
                 fn.write('{:.9f}\n'.format(val))
+        if self.precision_report is not None:
+            self.precision_report.to_csv(os.path.join(vib_dir, 'precision-report.csv'),
+                                         index=False)
+        if shard is not None:
+            # the accumulated oscillators of the spectra are merged with the other shards
+            if spectra is not None:
+                for spec, fp in zip(spectra, spectra_files):
+                    spec.save(fp)
+            rel = lambda fp: os.path.relpath(fp, vib_dir)
+            write_manifest(vib_dir, shard=shard_index, nshards=nshards, settings=settings,
+                           modes=[int(fdx) for fdx in order],
+                           completed=[int(fdx) for fdx in completed],
+                           prefactor=[float(val) for val in prefactor],
+                           files=[rel(fp) for fp in osc_files+rot_files+man_files+prune_files],
+                           boltzmann=[rel(os.path.join(osc_dir, 'boltzmann-populations.csv'))
+                                      for osc_dir in osc_dirs],
+                           spectra=[] if spectra is None else [rel(val) for val in osc_dirs],
+                           store=store)
+        if profile:
+            prof.write(os.path.join(vib_dir, 'profile.json'))
         #program_end = time()
         #if print_stdout:
         #    program_exec = timedelta(seconds=round(program_end - program_start, 0))
@@ -967,8 +2346,10 @@ class Vibronic:
         #    print("***************************************")
 
     def __init__(self, config_file, *args, **kwargs):
+        start = clock()
         config = Config.open_config(config_file, self._required_inputs,
                                     defaults=self._default_inputs)
+        self._config_times = elapsed(start)
         # check that the number of multiplicities and states are the same
         if len(config.spin_multiplicity) != len(config.number_of_states):
             print(config.spin_multiplicity, config.number_of_states)
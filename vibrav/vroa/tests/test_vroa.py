@@ -19,6 +19,7 @@ import pandas as pd
 import tarfile
 import os
 import shutil
+import pytest
 
 
 def test_vroa():
@@ -52,6 +53,14 @@ def test_vroa():
     test = cls.scatter.copy()
     assert np.allclose(base_scatter[cols[0]], test[cols[0]])
     assert np.allclose(base_scatter[cols[1]], test[cols[1]])
+    est = cls.estimate(nexc=cls.scatter['exc_idx'].unique().shape[0], print_stdout=False)
+    assert est.total('input') > 0
+    assert est.total('memory') > 0
+    # the tables written to csv files
+    size = len(cls.scatter.to_csv(index=False)) + len(cls.raman.to_csv(index=False))
+    assert 0.5*size < est.total('output') < 2*size
+    with pytest.warns(Warning):
+        cls.estimate(nexc=1, disk_budget=16, print_stdout=False)
     os.chdir(parent)
     shutil.rmtree('nwchem-h2o2-vroa')
 
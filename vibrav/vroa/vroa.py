@@ -15,12 +15,14 @@
 import numpy as np
 import pandas as pd
 import warnings
+import os
 #from exa.util.constants import (speed_of_light_in_vacuum as C,
 #                                Planck_constant as H,
 #                                Boltzmann_constant as KB)
 from exatomic.util import conversions, constants
 from vibrav.numerical.vroa_func import backscat, forwscat, _make_derivatives
 from vibrav.core.config import Config
+from vibrav.core.estimate import ResourceEstimate
 
 class VROA():
     '''
@@ -385,6 +387,70 @@ class VROA():
         self.raman.sort_values(by=['exc_freq', 'freq'], inplace=True)
         self.scatter.reset_index(drop=True, inplace=True)
 
+    def estimate(self, nexc=1, memory_budget=None, disk_budget=None, flop_rate=1e10,
+                 io_rate=5e7, print_stdout=True):
+        '''
+        Estimate the resources needed by :meth:`vroa` without running it. Only the
+        configuration file and the sizes of the input files are used. The outputs are the
+        `scatter` and `raman` tables when they are written to csv files.
+
+        Args:
+            nexc (:obj:`int`, optional): Number of excitation frequencies in the ROA data.
+                                         Defaults to `1`.
+            memory_budget (:obj:`float`, optional): Warn when the peak memory in bytes is
+                                                    larger. Defaults to :code:`None`.
+            disk_budget (:obj:`float`, optional): Warn when the size of the outputs in bytes
+                                                  is larger. Defaults to :code:`None`.
+            flop_rate (:obj:`float`, optional): Floating point operations per second for the
+                                                time estimate. Defaults to `1e10`.
+            io_rate (:obj:`float`, optional): Bytes per second of text I/O for the time
+                                              estimate. Defaults to `5e7`.
+            print_stdout (:obj:`bool`, optional): Print the estimate. Defaults to
+                                                  :code:`True`.
+
+        Returns:
+            estimate (:class:`vibrav.core.estimate.ResourceEstimate`): Estimated resources.
+        '''
+        config = self.config
+        nmodes = config.number_of_modes
+        nat = config.number_of_nuclei
+        est = ResourceEstimate('the vibrational Raman optical activity', flop_rate=flop_rate,
+                               io_rate=io_rate)
+        for fp in [config.roa_file, config.grad_file, config.smatrix_file]:
+            if os.path.exists(fp):
+                est.add('input', fp, os.path.getsize(fp))
+        ndisp = 2*nmodes+1
+        # real and imaginary rows of the three tensors with nine components and the
+        # label, file and excitation columns
+        est.add('memory', 'ROA tensors', nexc*ndisp*5*2*(9+3)*8)
+        est.add('memory', 'complex ROA tensors', nexc*ndisp*5*9*16)
+        est.add('memory', 'gradients', nexc*ndisp*nat*5*8)
+        est.add('memory', 'normal modes', nmodes*nat*4*8)
+        # a complex product is 6 flops and a complex sum or a scaling by a real value is 2
+        cprod, csum = 6, 2
+        # the nine components of the alpha and G' tensors and the 27 of the A tensor are
+        # scaled by the reduced mass for both displacements, subtracted and scaled by the
+        # displacement
+        est.add('flops', 'tensor derivatives', nexc*nmodes*(9+9+27)*4*csum)
+        # the terms of the invariants in _make_derivatives
+        # alpha squared and alpha G' have 9 terms of one product, a scaling and a sum
+        # beta(alpha) and beta(G') have 9 terms of two products, two scalings, a difference
+        # and a sum
+        # beta(A) has 81 terms of one product, scalings by the frequency, the Levi-Civita
+        # tensor and one half and a sum
+        invariants = 2*9*(cprod+2*csum) + 2*9*(2*cprod+4*csum) + 81*(cprod+4*csum)
+        est.add('flops', 'invariants', nexc*nmodes*invariants)
+        # the raman, backscattering and forward scattering intensities
+        est.add('flops', 'intensities', nexc*nmodes*12)
+        # about 20 characters for each value of the scatter table with seven columns and
+        # the raman table with five columns and both have the excitation columns
+        est.add('output', 'scatter table', nexc*nmodes*(7+2)*20)
+        est.add('output', 'raman table', nexc*nmodes*(5+2)*20)
+        if print_stdout:
+            print(est.to_string())
+        est.check(memory_budget=memory_budget, disk_budget=disk_budget)
+        return est
+
     def __init__(self, config_file, *args, **kwargs):
         config = Config.open_config(config_file, self._required_inputs,
                                     defaults=self._default_inputs)
@@ -12,7 +12,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with vibrav.  If not, see <https://www.gnu.org/licenses/>.
-from vibrav.core import Config
+from vibrav.core import Config, ResourceEstimate
 from vibrav.util.print import dataframe_to_txt
 from exatomic.exa.util.units import Length, Mass, Energy
 from exatomic.util.constants import Boltzmann_constant as boltzmann
@@ -633,6 +633,65 @@ class ZPVC:
             self.vib_average.to_csv(fp+'.csv')
             dataframe_to_txt(self.vib_average, ncols=6, fp=fp+'.txt', float_format=formatters)
 
+    def estimate(self, temperature=None, geometry=True, write_out_files=True,
+                 memory_budget=None, disk_budget=None, flop_rate=1e10, io_rate=5e7,
+                 print_stdout=True):
+        '''
+        Estimate the resources needed by :meth:`zpvc` without running it. Only the
+        configuration file and the sizes of the input files are used.
+
+        Args:
+            temperature (:obj:`list`, optional): Temperatures of interest. Defaults to
+                                                 :code:`None` (a single temperature).
+            geometry (:obj:`bool`, optional): Calculate the effective geometry. Defaults to
+                                              :code:`True`.
+            write_out_files (:obj:`bool`, optional): Write the output files. Defaults to
+                                                     :code:`True`.
+            memory_budget (:obj:`float`, optional): Warn when the peak memory in bytes is
+                                                    larger. Defaults to :code:`None`.
+            disk_budget (:obj:`float`, optional): Warn when the size of the outputs in bytes
+                                                  is larger. Defaults to :code:`None`.
+            flop_rate (:obj:`float`, optional): Floating point operations per second for the
+                                                time estimate. Defaults to `1e10`.
+            io_rate (:obj:`float`, optional): Bytes per second of text I/O for the time
+                                              estimate. Defaults to `5e7`.
+            print_stdout (:obj:`bool`, optional): Print the estimate. Defaults to
+                                                  :code:`True`.
+
+        Returns:
+            estimate (:class:`vibrav.core.estimate.ResourceEstimate`): Estimated resources.
+        '''
+        config = self.config
+        nmodes = config.number_of_modes
+        nat = config.number_of_nuclei
+        ntemps = 1 if temperature is None else len(temperature)
+        est = ResourceEstimate('the zero-point vibrational corrections', flop_rate=flop_rate,
+                               io_rate=io_rate)
+        for fp in [config.smatrix_file, config.eqcoord_file, config.frequency_file,
+                   config.reduced_mass_file, config.delta_file]:
+            if os.path.exists(fp):
+                est.add('input', fp, os.path.getsize(fp))
+        # the gradients have three components and the file index
+        est.add('memory', 'gradients', 32*(2*nmodes+1)*nat)
+        est.add('memory', 'normal modes', 32*nmodes*nat)
+        # gradients projected on the normal modes and the cubic force constants
+        est.add('memory', 'cubic force constants', 4*8*nmodes**2)
+        if geometry:
+            est.add('memory', 'effective geometries', 64*ntemps*nat)
+        if write_out_files:
+            # a csv and a text file of each data frame
+            est.add('output', 'cubic force constants', 40*nmodes*(nmodes+1))
+            est.add('output', 'property derivatives', 2*40*nmodes)
+            est.add('output', 'results', 2*100*ntemps)
+            est.add('output', 'vibrational average', 2*100*ntemps*nmodes)
+        est.add('flops', 'anharmonicity and curvature', 10*ntemps*nmodes*(nmodes+1))
+        if geometry:
+            est.add('flops', 'effective geometry', ntemps*nmodes*(10*nmodes+6*nat))
+        if print_stdout:
+            print(est.to_string())
+        est.check(memory_budget=memory_budget, disk_budget=disk_budget)
+        return est
+
     def __init__(self, config_file, *args, **kwargs):
         config = Config.open_config(config_file, self._required_inputs,
                                     defaults=self._default_inputs)